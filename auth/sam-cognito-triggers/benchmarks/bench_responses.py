@@ -0,0 +1,78 @@
+# Compares the response templates with building the responses on each call
+#
+#   make bench
+#   (or PYTHONPATH=src python -m benchmarks.bench_responses)
+
+from time import perf_counter
+import copy
+import json
+import os
+
+os.environ.setdefault('COGNITO_CLIENT_ID', '1irha5mrk1jjp86ikl7bhkj7gf')
+
+import app
+from utils import config
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+ITERATIONS = 20000
+REPEAT = 3
+
+
+def load_event(name):
+    with open(os.path.join(ROOT, 'events', f'{name}.json')) as f:
+        return json.load(f)
+
+
+def built_create(event):
+    # what create_auth_challenge did before the templates
+    event['response']['publicChallengeParameters'] = {
+        'challenge' : 'present a valid JWT token issued by a recognized provider',
+        'providers' : ', '.join(config.get().provider_names)
+    }
+    event['response']['privateChallengeParameters'] = {}
+    event['response']['challengeMetadata'] = "IDP_TOKEN"
+    return event
+
+
+def built_pre_signup(event):
+    event['response']['autoConfirmUser'] = True
+    event['response']['autoVerifyEmail'] = True
+    return event
+
+
+def measure(function, event):
+    # us per call, the fastest of REPEAT runs. Events are copied outside of the timed loop
+    runs = []
+    for _ in range(REPEAT):
+        events = [copy.deepcopy(event) for _ in range(ITERATIONS)]
+        start = perf_counter()
+        for e in events:
+            function(e)
+        runs.append(perf_counter() - start)
+    return min(runs) / ITERATIONS * 1e6
+
+
+def main():
+    cases = (
+        ('create', load_event('create_auth_challenge'), built_create, app.create_response()),
+        ('pre_signup', load_event('signup'), built_pre_signup, app.PRE_SIGNUP_RESPONSE),
+    )
+
+    for (name, event, built, template) in cases:
+        assert built(copy.deepcopy(event)) == template.apply(copy.deepcopy(event))
+        assert json.loads(template.dumps(event)) == template.apply(copy.deepcopy(event))
+
+        results = {
+            'built': measure(built, event),
+            'template': measure(template.apply, event),
+            'built + json': measure(lambda e: json.dumps(built(e), separators=(',', ':')), event),
+            'template json': measure(template.dumps, event),
+        }
+        for (case, us) in results.items():
+            print(f'{name:>10} {case:>14} : {us:6.2f} us / call')
+        print(f'{name:>10} {"speedup":>14} : {results["built"] / results["template"]:6.1f} x, '
+              f'{results["built + json"] / results["template json"]:.1f} x serialized')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+# Benchmarks the trigger paths end to end, through lambda_handler
+#
+#   make bench             run, and compare with benchmarks/baseline.json
+#   make bench-baseline    run, and save the results as the new baseline
+#
+# Events come from events/, tokens are signed locally and the Apple keys are
+# served by a local JWKS server: no network needed.
+
+from time import perf_counter, time
+import argparse
+import copy
+import json
+import os
+import platform
+import sys
+
+from jwcrypto import jwk, jwt
+
+import app
+from utils import config, jwt_apple, log, metrics, providers, rate_limit, replay
+from utils.jwks import KeyCache
+from tools.fake_apple import RSA_KEY_1, RSA_KEY_2, JWKSServer, jwks, apple_token
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+# a case is slower than the baseline when its p50 grew by more than this ratio,
+# and by more than MIN_REGRESSION_US: the p50 of the fastest cases are a few
+# microseconds, a ratio alone flags the noise
+TOLERANCE = 0.30
+MIN_REGRESSION_US = 5
+
+ITERATIONS = 2000
+COLD_ITERATIONS = 100
+# each case runs several times, the fastest run is kept to limit the noise
+REPEAT = 5
+
+GOOGLE_CLIENT_ID = '1234-abcd.apps.googleusercontent.com'
+
+HS256_KEY = jwk.JWK(generate='oct', size=256)
+
+
+def load_event(name, **changes):
+    with open(os.path.join(ROOT, 'events', f'{name}.json')) as f:
+        event = json.load(f)
+    event.update(changes)
+    return event
+
+
+def hs256_token(exp_in=600):
+    token = jwt.JWT(header={"alg": "HS256"},
+                    claims={'iss': 'https://appleid.apple.com', 'aud': 'com.stormacq.test',
+                            'exp': int(time()) + exp_in, 'iat': int(time())})
+    token.make_signed_token(HS256_KEY)
+    return token.serialize()
+
+
+def verify_event(token, testing_key=None, provider='Apple'):
+    event = load_event('verify_auth_challenge')
+    event['request']['challengeAnswer'] = f'{provider}:::{token}'
+    if testing_key is not None:
+        event['request']['testing_key'] = testing_key
+    return event
+
+
+def tampered(token):
+    (header, claims, _) = token.split('.')
+    (_, _, signature) = apple_token(RSA_KEY_2).split('.')
+    return f'{header}.{claims}.{signature}'
+
+
+class Case:
+
+    def __init__(self, name, event, iterations=ITERATIONS, before_each=None, fast_path=True, environ=None):
+        self.name = name
+        self.event = event
+        self.iterations = iterations
+        self.before_each = before_each
+        self.fast_path = fast_path
+        # configuration of this case only (rate limiting, replay protection, providers)
+        self.environ = environ or {}
+
+    def run(self):
+        saved = dict(os.environ)
+        os.environ.update(self.environ)
+        _reset()
+        try:
+            runs = [self._run_once() for _ in range(REPEAT)]
+        finally:
+            os.environ.clear()
+            os.environ.update(saved)
+            _reset()
+        return min(runs, key=lambda r: r['p50_us'])
+
+    def _run_once(self):
+        jwt_apple.RS256_FAST_PATH = self.fast_path
+        events = [copy.deepcopy(self.event) for _ in range(self.iterations)]
+
+        latencies = []
+        for event in events:
+            if self.before_each is not None:
+                self.before_each()
+            start = perf_counter()
+            try:
+                app.lambda_handler(event, None)
+            except Exception:
+                # expected for invalid tokens
+                pass
+            latencies.append(perf_counter() - start)
+
+        jwt_apple.RS256_FAST_PATH = True
+        return summarize(latencies)
+
+
+def _reset():
+    config.reset()
+    rate_limit.reset()
+    replay.reset()
+
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    total = sum(latencies)
+    return {
+        'ops_per_sec': round(len(latencies) / total, 1),
+        'p50_us': round(latencies[len(latencies) // 2] * 1e6, 1),
+        'p99_us': round(latencies[int(len(latencies) * 0.99)] * 1e6, 1)
+    }
+
+
+def cases(server, google_server):
+    warm_keys = KeyCache(server.url)
+    warm_keys.load(jwks([RSA_KEY_1, RSA_KEY_2]))
+
+    def warm():
+        jwt_apple.APPLE_KEYS = warm_keys
+        # rejected tokens are cached too, each iteration verifies the token again
+        jwt_apple.TOKEN_CACHE.clear()
+        jwt_apple.REJECTION_CACHE.clear()
+
+    def cold():
+        # a new container: empty key cache, the keys come from the local JWKS server
+        jwt_apple.APPLE_KEYS = KeyCache(server.url)
+        jwt_apple.TOKEN_CACHE.clear()
+        jwt_apple.REJECTION_CACHE.clear()
+
+    def cached():
+        jwt_apple.APPLE_KEYS = warm_keys
+
+    def replay_warm():
+        warm()
+        # each iteration verifies the token for the first time
+        replay.get_store().seen.clear()
+
+    def google_warm():
+        # the Google keys stay in memory once discovered
+        jwt_apple.TOKEN_CACHE.clear()
+        jwt_apple.REJECTION_CACHE.clear()
+
+    valid = apple_token(RSA_KEY_1)
+    # every attempt allowed: the cost of the check, not of the rejections
+    rate_limit_environ = {'RATE_LIMIT_STORE': 'memory', 'RATE_LIMIT_ATTEMPTS': str(10 ** 9)}
+    google_environ = {'ID_PROVIDERS': 'Apple,Google', 'GOOGLE_AUDIENCE': GOOGLE_CLIENT_ID}
+    google_token = apple_token(RSA_KEY_2, iss='https://accounts.google.com', aud=GOOGLE_CLIENT_ID)
+    providers.GOOGLE_DISCOVERY_URL = google_server.discovery_url
+    return [
+        Case('define_srpa', load_event('define_auth_srpa')),
+        Case('define_cli', load_event('define_auth_cli')),
+        Case('define_succeeded', load_event('define_auth_succeeded')),
+        Case('create', load_event('create_auth_challenge')),
+        Case('pre_signup', load_event('signup', triggerSource='PreSignUp_SignUp')),
+        Case('verify_no_separator', load_event('verify_auth_challenge')),
+        Case('verify_rs256_warm', verify_event(valid), before_each=warm),
+        Case('verify_rs256_jwcrypto_warm', verify_event(valid), before_each=warm, fast_path=False),
+        Case('verify_rs256_cold', verify_event(valid), COLD_ITERATIONS, before_each=cold),
+        Case('verify_rs256_token_cached', verify_event(valid), before_each=cached),
+        Case('verify_rs256_bad_signature', verify_event(tampered(valid)), before_each=warm),
+        Case('verify_rs256_expired', verify_event(apple_token(RSA_KEY_1, exp_in=-3600)), before_each=warm),
+        Case('verify_hs256_testing_key', verify_event(hs256_token(), HS256_KEY.export()), before_each=warm),
+        Case('define_srpa_rate_limit', load_event('define_auth_srpa'), environ=rate_limit_environ),
+        Case('verify_rs256_rate_limit', verify_event(valid), before_each=warm, environ=rate_limit_environ),
+        Case('verify_rs256_replay', verify_event(valid), before_each=replay_warm, environ={'REPLAY_STORE': 'memory'}),
+        Case('verify_google_warm', verify_event(google_token, provider='Google'), before_each=google_warm,
+             environ=google_environ),
+    ]
+
+
+def compare(results, baseline):
+    regressions = []
+    for (name, result) in results.items():
+        if name not in baseline:
+            continue
+        ratio = result['p50_us'] / baseline[name]['p50_us'] - 1
+        if ratio > TOLERANCE and result['p50_us'] - baseline[name]['p50_us'] > MIN_REGRESSION_US:
+            regressions.append(f'{name} : p50 {baseline[name]["p50_us"]} us -> {result["p50_us"]} us (+{ratio:.0%})')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the Cognito triggers')
+    parser.add_argument('--save', action='store_true', help='save the results as the new baseline')
+    parser.add_argument('--check', action='store_true', help='exit with an error when a case regressed')
+    args = parser.parse_args(argv)
+
+    os.environ['COGNITO_CLIENT_ID'] = '1irha5mrk1jjp86ikl7bhkj7gf'
+    log.LEVEL = log.ERROR + 1
+    metrics.ENABLED = False
+
+    server = JWKSServer([RSA_KEY_1, RSA_KEY_2]).start()
+    google_server = JWKSServer([RSA_KEY_2], issuer='https://accounts.google.com').start()
+    try:
+        results = {}
+        print(f'{"case":<30} {"ops/s":>10} {"p50 us":>10} {"p99 us":>10}')
+        for case in cases(server, google_server):
+            results[case.name] = case.run()
+            r = results[case.name]
+            print(f'{case.name:<30} {r["ops_per_sec"]:>10} {r["p50_us"]:>10} {r["p99_us"]:>10}')
+    finally:
+        server.stop()
+        google_server.stop()
+
+    if args.save:
+        with open(BASELINE, 'w') as f:
+            json.dump({'python': platform.python_version(), 'machine': platform.machine(), 'results': results},
+                      f, indent=2)
+            f.write('\n')
+        print(f'Baseline saved to {BASELINE}')
+        return 0
+
+    if not os.path.exists(BASELINE):
+        return 0
+
+    with open(BASELINE) as f:
+        regressions = compare(results, json.load(f)['results'])
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    return 1 if regressions and args.check else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,44 @@
+# Compares the RS256 fast path with the jwcrypto verification, per token
+#
+#   make bench
+#   (or PYTHONPATH=src python -m benchmarks.bench_verifier)
+
+import json
+import timeit
+
+from jwcrypto import jwt
+
+from utils import jwt_apple
+from tools.fake_apple import RSA_KEY_1, jwks, apple_token
+
+ITERATIONS = 2000
+
+
+def jwcrypto_verify(token):
+    # what decode_apple_user_token did before the fast path
+    key = jwt_apple.APPLE_KEYS.get('key1')
+    claims = json.loads(jwt.JWT(jwt=token, key=key).claims)
+    jwt_apple._validate_claims(claims)
+    return claims
+
+
+def fast_verify(token):
+    return jwt_apple._decode_apple_user_token(token)
+
+
+def main():
+    jwt_apple.APPLE_KEYS.load(jwks([RSA_KEY_1]))
+    token = apple_token(RSA_KEY_1)
+    assert jwcrypto_verify(token) == fast_verify(token)
+
+    results = {}
+    for (name, verify) in (('jwcrypto', jwcrypto_verify), ('fast path', fast_verify)):
+        seconds = min(timeit.repeat(lambda: verify(token), number=ITERATIONS, repeat=5))
+        results[name] = seconds / ITERATIONS * 1e6
+        print(f'{name:>10} : {results[name]:8.1f} us / verification')
+
+    print(f'{"speedup":>10} : {results["jwcrypto"] / results["fast path"]:8.1f} x')
+
+
+if __name__ == '__main__':
+    main()
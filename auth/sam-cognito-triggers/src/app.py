@@ -1,8 +1,24 @@
-import os 
-from utils import jwt_apple
+from time import perf_counter
+import os
+
+from utils import config, events, log, metrics, profiling, responses
+
+# utils.jwt_apple is imported in verify_auth_challenge_response() only:
+# it pulls jwcrypto, requests and the crypto stack, and the other triggers
+# do not need them. Keep this module cheap to import (see tests/test_cold_start.py)
+
+# provider name and separator, plus the largest token accepted (see jwt_apple.MAX_TOKEN_SIZE)
+MAX_ANSWER_SIZE = 8192 + 64
+
+def _rate_limited(event, cost=1):
+    # utils.rate_limit is only imported when rate limiting is enabled
+    if not config.get().rate_limit_store:
+        return False
+    from utils import rate_limit
+    return not rate_limit.allow(event, cost)
 
 def define_auth_challenge(event):
-    print('Define Auth Challenge')
+    log.debug('Define Auth Challenge')
 
     session_length = len(event['request']['session'])
 
@@ -17,6 +33,12 @@ def define_auth_challenge(event):
         event['response']['failAuthentication'] = False
 
 
+    # users over the rate limit do not get another challenge (see utils.rate_limit)
+    elif _rate_limited(event, cost=0):
+
+        event['response']['issueTokens'] = False
+        event['response']['failAuthentication'] = True
+
     # when using Amplify, first step is SRP_A, we bypass it and switch to custom challenge
     elif session_length == 1 \
         and event['request']['session'][-1]['challengeName'] == 'SRP_A':
@@ -40,106 +62,383 @@ def define_auth_challenge(event):
 
     return event
 
-def create_auth_challenge(event):
-    print('Create Auth Challenge')
-
-    event['response']['publicChallengeParameters'] = {
-        'challenge' : 'present a valid JWT token issued by a recognized provider',
-        'providers' : 'Apple'
-    }
-    event['response']['privateChallengeParameters'] = {}
-    event['response']['challengeMetadata'] = "IDP_TOKEN"
+# (configuration, Template), the providers come from the configuration
+_create_response = (None, None)
+
+def create_response():
+    global _create_response
+    settings = config.get()
+    if _create_response[0] is not settings:
+        _create_response = (settings, responses.Template({
+            'publicChallengeParameters': {
+                'challenge' : 'present a valid JWT token issued by a recognized provider',
+                'providers' : ', '.join(settings.provider_names)
+            },
+            'privateChallengeParameters': {},
+            'challengeMetadata': "IDP_TOKEN"
+        }))
+    return _create_response[1]
 
-    return event
-
-def verify_auth_challenge_response(event):
-    print('Verify Auth Challenge Response')
+def create_auth_challenge(event):
+    log.debug('Create Auth Challenge')
+    return create_response().apply(event)
 
-    # verify JWT Token received
+def _challenge_token(event):
+    # (provider name, token) to verify, None when the answer is rejected without verification
     # https://sarunw.com/posts/sign-in-with-apple-3/
     idp_token = event['request']['challengeAnswer']
-    print(f'IDTOKEN to verify : {idp_token[0:10]}')
+    log.debug('IDTOKEN to verify', prefix=idp_token[0:10])
+
+    # never scan, split or hash oversized answers
+    if len(idp_token) > MAX_ANSWER_SIZE:
+        log.info('Challenge answer is too large', size=len(idp_token))
+        metrics.set_property('rejection_reason', 'Answer too large')
+        event['response']['answerCorrect'] = False
+        return None
 
     # I expect to receive a token in the form
     # PROVIDER_NAME:::TOKEN
     TOKEN_SEPARATOR=':::'
     if idp_token.find(TOKEN_SEPARATOR) == -1:
-        print(f'There is no token separator in the string received. ' + \
-              'Token must be in the form <provider name>:::<base 64 encoded token>')
+        log.info('There is no token separator in the string received. ' + \
+                 'Token must be in the form <provider name>:::<base 64 encoded token>')
+        metrics.set_property('rejection_reason', 'No token separator')
         event['response']['answerCorrect'] = False
-    else:
-        (provider, _ , token) = idp_token.partition(TOKEN_SEPARATOR)
+        return None
+
+    (provider, _ , token) = idp_token.partition(TOKEN_SEPARATOR)
+
+    # we only accept tokens from the configured providers
+    if (provider.lower() not in config.get().id_providers):
+        log.info('Invalid token provider', provider=provider)
+        metrics.set_property('rejection_reason', 'Invalid token provider')
+        event['response']['answerCorrect'] = False
+        return None
+
+    return (provider, token)
+
+def _provider(event, name):
+    # the identity provider registered for this name, None when there is none
+    from utils import providers
+
+    provider = providers.get(name)
+    if provider is None:
+        log.warning('Identity provider not registered', provider=name)
+        metrics.set_property('rejection_reason', 'Invalid token provider')
+        event['response']['answerCorrect'] = False
+    return provider
+
+def verify_auth_challenge_response(event):
+    log.debug('Verify Auth Challenge Response')
 
-        # we only accept apple tokens
-        if (provider.lower() != 'apple'):
-            print(f'Invalid token provider : {provider}')
+    # each answer counts as an attempt, checked before any work on the token
+    if _rate_limited(event):
+        event['response']['answerCorrect'] = False
+        return event
+
+    # verify JWT Token received
+    answer = _challenge_token(event)
+    if answer is None:
+        return event
+
+    with metrics.stage('import'):
+        from utils import jwt_apple, replay
+
+    (name, token) = answer
+    provider = _provider(event, name)
+    if provider is not None:
+
+        # testing_key is for testing only
+        claim = jwt_apple.decode_token(token, provider, event['request'].get('testing_key'))
+        replay.check(token, claim)
+
+        log.debug('Token verified', claims=claim)
+        event['response']['answerCorrect'] = True
+
+    return event
+
+async def verify_auth_challenge_response_async(event, executor=None):
+    log.debug('Verify Auth Challenge Response')
+
+    # same as verify_auth_challenge_response(), without blocking the event loop
+    if config.get().rate_limit_store:
+        from utils import rate_limit
+        if not await rate_limit.allow_async(event, executor=executor):
             event['response']['answerCorrect'] = False
-        else:
+            return event
 
-            claim = None 
-            # For testing only 
-            if 'testing_key' in event['request']:
-                key = event['request']['testing_key']
-                claim = jwt_apple.decode_apple_user_token(token,key)
-            else:
-                claim = jwt_apple.decode_apple_user_token(token)
+    answer = _challenge_token(event)
+    if answer is None:
+        return event
 
-            print(claim)
-            event['response']['answerCorrect'] = True
+    with metrics.stage('import'):
+        from utils import jwt_apple_async, replay
 
+    (name, token) = answer
+    provider = _provider(event, name)
+    if provider is not None:
+
+        claim = await jwt_apple_async.decode_token(token, provider, event['request'].get('testing_key'), executor)
+        await replay.check_async(token, claim, executor)
+
+        log.debug('Token verified', claims=claim)
+        event['response']['answerCorrect'] = True
 
     return event
 
+PRE_SIGNUP_RESPONSE = responses.Template({'autoConfirmUser': True, 'autoVerifyEmail': True})
+
+def pre_signup_response():
+    return PRE_SIGNUP_RESPONSE
+
 def pre_signup(event):
-    print('PreSignUp')
+    log.debug('PreSignUp')
+    return PRE_SIGNUP_RESPONSE.apply(event)
+
+def user_migration(event):
+    log.debug('User Migration')
 
-    event['response']['autoConfirmUser'] = True
-    event['response']['autoVerifyEmail'] = True
+    # utils.migration (and boto3) are only imported for this trigger
+    from utils import migration
+
+    # UserMigration_ForgotPassword has no password to check
+    password = event['request'].get('password') if event['triggerSource'] == 'UserMigration_Authentication' else None
+    if not migration.migrate(event, password):
+        raise _user_not_found(event)
 
     return event
 
+def _outcome(result):
+    if 'response' not in result:
+        return 'unhandled'
+    response = result['response']
+    if response.get('answerCorrect') is False or response.get('failAuthentication') is True:
+        return 'rejected'
+    return 'ok'
+
+class _Invocation:
+    # logs and metrics of one invocation, common to the sync and async handlers
+
+    def __init__(self, event):
+        self.start = perf_counter()
+        self.trigger = event.get('triggerSource') if isinstance(event, dict) else None
+        metrics.start(self.trigger)
+
+        # full payloads are logged for a sample of the invocations only,
+        # the event is copied (and redacted) before handlers modify it
+        self.sampled = log.sampled()
+        self.received = log.redact(event) if self.sampled else None
+
+    def failed(self, e):
+        latency_ms = (perf_counter() - self.start) * 1000
+        metrics.set_property('error', type(e).__name__)
+        metrics.flush('error', latency_ms)
+        log.invocation(self.trigger, 'error', latency_ms,
+                       error_class=type(e).__name__, event=self.received)
+
+    def succeeded(self, result):
+        latency_ms = (perf_counter() - self.start) * 1000
+        outcome = _outcome(result)
+        metrics.flush(outcome, latency_ms)
+        log.invocation(self.trigger, outcome, latency_ms,
+                       event=self.received, response=result.get('response') if self.sampled else None)
+        return result
+
 # https://docs.aws.amazon.com/cognito/latest/developerguide/user-pool-lambda-pre-authentication.html
 def lambda_handler(event, _):
-    print('RECEIVED')
-    print(event)
+    invocation = _Invocation(event)
+    # a sample of the invocations is profiled when PROFILE_SAMPLE_RATE is set (see utils.profiling)
+    profiler = profiling.start(invocation.trigger) if profiling.SAMPLE_RATE > 0 else None
+    try:
+        result = handle(event)
+    except Exception as e:
+        invocation.failed(e)
+        raise
+    finally:
+        if profiler is not None:
+            profiling.stop(profiler, invocation.trigger)
+    return invocation.succeeded(result)
+
+# for async hosts (aiohttp / ASGI service), one event loop serving many challenges
+async def lambda_handler_async(event, _=None, executor=None):
+    invocation = _Invocation(event)
+    try:
+        result = await handle_async(event, executor)
+    except Exception as e:
+        invocation.failed(e)
+        raise
+    return invocation.succeeded(result)
+
+# for hosts serializing the results themselves (HTTP services, emulators): returns JSON
+def lambda_handler_serialized(event, _=None):
+    invocation = _Invocation(event)
+    try:
+        result = handle_serialized(event)
+    except Exception as e:
+        invocation.failed(e)
+        raise
+    invocation.succeeded(event)
+    return result
+
+def unhandled(event):
+    log.warning('Cognito Event not handled', trigger=event['triggerSource'])
+    # force an error on Cognito 
+    del event['response']
+    return event
 
-    COGNITO_CLIENT_ID = os.environ['COGNITO_CLIENT_ID']
-    client_id = event['callerContext']['clientId']
-    if client_id not in (COGNITO_CLIENT_ID, 'CLIENT_ID_NOT_APPLICABLE'):
-        raise Exception(f'Cannot authenticate users from this user pool app client: {client_id}')
+class Trigger:
+    # how to handle one trigger source. validate rejects malformed events,
+    # handler_async is for the triggers that wait on the network or the CPU,
+    # template returns the responses.Template of the triggers answering with constants
+
+    def __init__(self, handler, validate, handler_async=None, template=None):
+        self.handler = handler
+        self.validate = validate
+        self.handler_async = handler_async
+        self.template = template
+
+# trigger source -> Trigger, validators are built once, at import
+TRIGGERS = {}
+
+def register(trigger_source, handler, request=None, handler_async=None, template=None):
+    # request: the request fields the handler reads, {name: type}, see utils.events
+    TRIGGERS[trigger_source] = Trigger(handler, events.validator(trigger_source, request), handler_async, template)
+
+register('DefineAuthChallenge_Authentication', define_auth_challenge,
+         {'session': [{'challengeName': str, 'challengeResult': bool}]})
+register('CreateAuthChallenge_Authentication', create_auth_challenge, template=create_response)
+register('VerifyAuthChallengeResponse_Authentication', verify_auth_challenge_response, {'challengeAnswer': str},
+         handler_async=verify_auth_challenge_response_async)
+register('PreSignUp_SignUp', pre_signup, template=pre_signup_response)
+# users created with the admin API, e.g. by tools/provision_users.py
+register('PreSignUp_AdminCreateUser', pre_signup, template=pre_signup_response)
+register('UserMigration_Authentication', user_migration, {'password': str})
+register('UserMigration_ForgotPassword', user_migration)
+
+UNHANDLED = Trigger(unhandled, events.validator('Cognito'))
+
+def _trigger(event):
+    # the Trigger for this event, once the event is known to be valid
+    source = event.get('triggerSource') if isinstance(event, dict) else None
+    trigger = TRIGGERS.get(source, UNHANDLED)
+    trigger.validate(event)
+
+    with metrics.stage('client_id'):
+        client_id = event['callerContext']['clientId']
+        if client_id not in config.get().client_ids:
+            raise Exception(f'Cannot authenticate users from this user pool app client: {client_id}')
 
     # when user does not exist, reject the request
-    if 'userNotFound' in event['request'] and event['request']['userNotFound']:
-        # the [USER_NOT_FOUND] tag is important to let client know the error,
-        # I could not find a way to capture a specific exception in the client
-        raise Exception(f"User {event['userName']} does not exist in pool {event['userPoolId']}, " +
-                        f"please signup first. [USER_NOT_FOUND]")
+    if event['request'].get('userNotFound'):
+        raise _user_not_found(event)
+
+    return trigger
+
+def _user_not_found(event):
+    # the [USER_NOT_FOUND] tag is important to let client know the error,
+    # I could not find a way to capture a specific exception in the client
+    return Exception(f"User {event['userName']} does not exist in pool {event['userPoolId']}, " +
+                     f"please signup first. [USER_NOT_FOUND]")
+
+def handle(event):
+    return _trigger(event).handler(event)
+
+def handle_serialized(event):
+    # the result as JSON: the responses of the template triggers are spliced in, pre-serialized
+    trigger = _trigger(event)
+    if trigger.template is not None:
+        return trigger.template().dumps(event)
+    import json
+    return json.dumps(trigger.handler(event), separators=responses.SEPARATORS)
+
+async def handle_async(event, executor=None):
+    # only the token verification waits on the network or the CPU,
+    # the other triggers answer right away
+    trigger = _trigger(event)
+    if trigger.handler_async is None:
+        return trigger.handler(event)
+    return await trigger.handler_async(event, executor)
+
+# how long the init phase may spend on prefetch_keys(), invocations do the rest
+WARMUP_BUDGET_MS = float(os.environ.get('WARMUP_BUDGET_MS', '2000'))
+
+def prefetch_keys(budget_ms=None):
+    # imports the verification code, loads the keys of all the identity providers
+    # in use (snapshot or network) and verifies one dummy token per provider, so that
+    # the first invocation finds everything hot. Steps left when the budget is spent
+    # are done by the invocations
+    budget = (WARMUP_BUDGET_MS if budget_ms is None else budget_ms) / 1000
+    start = perf_counter()
+    report = {}
+
+    def elapsed():
+        return perf_counter() - start
+
+    # importing jwt_apple registers the Apple provider
+    from utils import jwt_apple, providers
+    report['import_ms'] = round(elapsed() * 1000, 3)
+
+    ready = providers.prefetch(timeout=max(0, budget - elapsed()))
+    report['keys_ms'] = round(elapsed() * 1000 - report['import_ms'], 3)
+
+    warmed = []
+    for provider in providers.configured():
+        if elapsed() >= budget:
+            break
+        if provider.name in ready and jwt_apple.warm_up(provider):
+            warmed.append(provider.name)
+
+    report.update(providers=ready, warmed=warmed, total_ms=round(elapsed() * 1000, 3),
+                  over_budget=elapsed() >= budget)
+    if report['over_budget']:
+        log.warning('Warmup over budget', budget_ms=budget * 1000, **report)
+    else:
+        log.info('Warmup done', **report)
+    return report
 
-    result = event
-    if event['triggerSource'] == 'DefineAuthChallenge_Authentication':
-        result = define_auth_challenge(event)
+# only in Lambda (see template.yaml): tests and tools import this module without the network
+if os.environ.get('PREFETCH_KEYS', 'false').lower() == 'true':
+    prefetch_keys()
 
-    elif event['triggerSource'] == 'CreateAuthChallenge_Authentication':
-        result = create_auth_challenge(event)
+def verify_tokens_main(args):
+    # python src/app.py verify-tokens tokens.txt --workers 8 --mode process > results.jsonl
+    import json
+    import sys
+    from utils import batch
 
-    elif event['triggerSource'] == 'VerifyAuthChallengeResponse_Authentication':
-        result = verify_auth_challenge_response(event)
+    # stdout is for the results
+    log.STREAM = sys.stderr
 
-    elif event['triggerSource'] == 'PreSignUp_SignUp':
-        result = pre_signup(event)
+    lines = sys.stdin if args.file == '-' else open(args.file)
+    invalid = 0
+    try:
+        for result in batch.verify_tokens(lines, workers=args.workers, mode=args.mode, chunk_size=args.chunk_size):
+            invalid += 0 if result['valid'] else 1
+            print(json.dumps(result, separators=(',', ':')))
+    finally:
+        if lines is not sys.stdin:
+            lines.close()
 
-    else:
-        print(f"WARNING - Cognito Event {event['triggerSource']} not handled")
-        # force an error on Cognito 
-        del result['response']
-        
-    print('RESPONSE')
-    print(result)
+    return 1 if invalid else 0
 
-    return result
+def main(argv=None): 
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Cognito triggers for Sign in with Apple')
+    commands = parser.add_subparsers(dest='command')
+
+    verify = commands.add_parser('verify-tokens', help='verify Apple identity tokens, one per line, results as JSON lines')
+    verify.add_argument('file', nargs='?', default='-', help='file to read the tokens from (default: stdin)')
+    verify.add_argument('--workers', type=int, default=4)
+    verify.add_argument('--mode', choices=('thread', 'process'), default='thread')
+    verify.add_argument('--chunk-size', type=int, default=64)
+
+    args = parser.parse_args(argv)
+    if args.command == 'verify-tokens':
+        return verify_tokens_main(args)
 
-def main(): 
-    print("Hello World")
+    parser.print_help()
+    return 0
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    raise SystemExit(main())
\ No newline at end of file
@@ -0,0 +1,92 @@
+# Verifies large dumps of Apple identity tokens (migrations, offline audits)
+#
+# - tokens are read lazily, one per line (raw, or in the PROVIDER:::TOKEN form),
+#   and results are yielded in input order as soon as they are known:
+#   memory stays flat whatever the input size
+# - tokens are verified by chunks across a thread or process pool, with a
+#   bounded number of chunks in flight
+# - threads share the key cache of the process. Worker processes load the keys
+#   from a snapshot written by the parent before they start, so the keys are
+#   fetched once for the whole batch
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+import hashlib
+
+from utils import jwt_apple
+
+TOKEN_SEPARATOR = ':::'
+CHUNK_SIZE = 64
+# chunks in flight, per worker
+QUEUE_DEPTH = 2
+
+
+def verify_token(line_number, line):
+    # never raises: the outcome is described by the result
+    token = line.strip().rpartition(TOKEN_SEPARATOR)[2]
+    result = {
+        'line': line_number,
+        'digest': hashlib.sha256(token.encode()).hexdigest()[:16],
+        'valid': False
+    }
+
+    try:
+        claims = jwt_apple.decode_apple_user_token(token)
+        result.update(valid=True, sub=claims.get('sub'), aud=claims.get('aud'), exp=claims.get('exp'))
+    except jwt_apple.TokenError as e:
+        result.update(code=e.code, error=str(e))
+    except Exception as e:
+        # not a problem with the token itself (network error, ...)
+        result.update(code='VERIFICATION_FAILED', error=f'{type(e).__name__}: {e}')
+
+    return result
+
+
+def _verify_chunk(chunk):
+    return [verify_token(line_number, line) for (line_number, line) in chunk]
+
+
+def _init_worker(snapshot_path):
+    # runs in each worker process, before any token
+    jwt_apple.APPLE_KEYS.snapshot_path = snapshot_path
+    jwt_apple.APPLE_KEYS.load_snapshot()
+
+
+def _chunks(lines, chunk_size):
+    numbered = ((n, line) for (n, line) in enumerate(lines, start=1) if line.strip())
+    while True:
+        chunk = list(islice(numbered, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def prefetch_keys(snapshot_path):
+    # make sure the keys are available, and saved where the worker processes expect them
+    keys = jwt_apple.APPLE_KEYS
+    if not keys.keys and not keys.load_snapshot():
+        keys.refresh()
+    keys.save_snapshot(snapshot_path)
+
+
+def verify_tokens(lines, workers=4, mode='thread', chunk_size=CHUNK_SIZE, snapshot_path=None):
+    # yields one result per non empty line, in input order
+    if mode == 'process':
+        snapshot_path = snapshot_path or jwt_apple.APPLE_KEY_SNAPSHOT
+        prefetch_keys(snapshot_path)
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(snapshot_path,))
+    elif mode == 'thread':
+        executor = ThreadPoolExecutor(max_workers=workers)
+    else:
+        raise ValueError(f'Unknown mode {mode}, expecting thread or process')
+
+    with executor:
+        in_flight = deque()
+        for chunk in _chunks(lines, chunk_size):
+            in_flight.append(executor.submit(_verify_chunk, chunk))
+            if len(in_flight) >= workers * QUEUE_DEPTH:
+                yield from in_flight.popleft().result()
+
+        while in_flight:
+            yield from in_flight.popleft().result()
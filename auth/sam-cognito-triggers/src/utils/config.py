@@ -0,0 +1,51 @@
+# Configuration of the triggers, read from the environment once per container
+#
+# Resolved on first use (the init phase, or the first invocation), not on each
+# call. reset() forgets it, for tests changing the environment.
+
+import os
+
+# app client id Cognito sends for events not related to a client (admin APIs, ...)
+CLIENT_ID_NOT_APPLICABLE = 'CLIENT_ID_NOT_APPLICABLE'
+
+
+class Config:
+
+    def __init__(self, environ):
+        self.cognito_client_id = environ['COGNITO_CLIENT_ID']
+        # app clients allowed to authenticate users
+        self.client_ids = frozenset((self.cognito_client_id, CLIENT_ID_NOT_APPLICABLE))
+
+        # identity providers accepted, as presented to the clients (see utils.providers)
+        self.provider_names = [name.strip() for name in environ.get('ID_PROVIDERS', 'Apple').split(',') if name.strip()]
+        self.id_providers = tuple(name.lower() for name in self.provider_names)
+        self.google_audience = [aud for aud in environ.get('GOOGLE_AUDIENCE', '').split(',') if aud]
+        self.oidc_providers = environ.get('OIDC_PROVIDERS')
+
+        # replay protection (see utils.replay): memory, dynamodb, or empty to disable
+        self.replay_store = environ.get('REPLAY_STORE', '').lower()
+        self.replay_table = environ.get('REPLAY_TABLE')
+
+        # sign-in attempts per user (see utils.rate_limit): memory, dynamodb, or empty to disable
+        self.rate_limit_store = environ.get('RATE_LIMIT_STORE', '').lower()
+        self.rate_limit_table = environ.get('RATE_LIMIT_TABLE')
+        self.rate_limit_attempts = int(environ.get('RATE_LIMIT_ATTEMPTS', '5'))
+        self.rate_limit_window = int(environ.get('RATE_LIMIT_WINDOW', '300'))
+
+        # users of the legacy backend, migrated on sign-in (see utils.migration)
+        self.legacy_users_table = environ.get('LEGACY_USERS_TABLE')
+
+
+_config = None
+
+
+def get():
+    global _config
+    if _config is None:
+        _config = Config(os.environ)
+    return _config
+
+
+def reset():
+    global _config
+    _config = None
@@ -0,0 +1,72 @@
+# Shape validation of the Cognito trigger events
+#
+# A malformed event is rejected before any handler runs, with a message naming
+# the faulty field, instead of a KeyError deep inside the handler.
+# Validators are built once per trigger type (see app.TRIGGERS): a call only
+# walks a tuple of (field, expected types) pairs.
+
+# fields all the trigger events have
+COMMON_FIELDS = {
+    'userName': str,
+    'userPoolId': str,
+    'triggerSource': str,
+    'callerContext': dict,
+    'request': dict,
+    'response': dict
+}
+
+CALLER_CONTEXT_FIELDS = {
+    'clientId': str
+}
+
+
+class MalformedEvent(Exception):
+    pass
+
+
+def _type_names(types):
+    return ' or '.join(t.__name__ for t in types)
+
+
+def _compile(fields):
+    # {name: type, tuple of types, or [{item fields}]} -> ((name, types, expected, item checks), ...)
+    checks = []
+    for (name, types) in fields.items():
+        items = None
+        if isinstance(types, list):
+            # a list of objects, each one with these fields
+            (items, types) = (_compile(types[0]), list)
+        types = types if isinstance(types, tuple) else (types,)
+        checks.append((name, types, _type_names(types), items))
+    return tuple(checks)
+
+
+def _check(checks, value, path, trigger):
+    for (name, types, expected, items) in checks:
+        field = value.get(name)
+        if not isinstance(field, types):
+            problem = 'is missing' if field is None else f'must be {expected}, got {type(field).__name__}'
+            raise MalformedEvent(f'Malformed {trigger} event: {path}{name} {problem}')
+        if items is not None:
+            for (i, item) in enumerate(field):
+                if not isinstance(item, dict):
+                    raise MalformedEvent(f'Malformed {trigger} event: {path}{name}[{i}] must be an object, '
+                                         f'got {type(item).__name__}')
+                _check(items, item, f'{path}{name}[{i}].', trigger)
+
+
+def validator(trigger, request=None):
+    # request: the request fields the handler reads, {name: type or tuple of types},
+    # [{name: type, ...}] for the lists of objects
+    common = _compile(COMMON_FIELDS)
+    caller_context = _compile(CALLER_CONTEXT_FIELDS)
+    request = _compile(request or {})
+
+    def validate(event):
+        if not isinstance(event, dict):
+            raise MalformedEvent(f'Malformed {trigger} event: expecting an object, got {type(event).__name__}')
+        _check(common, event, '', trigger)
+        _check(caller_context, event['callerContext'], 'callerContext.', trigger)
+        _check(request, event['request'], 'request.', trigger)
+
+    return validate
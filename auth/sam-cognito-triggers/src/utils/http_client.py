@@ -0,0 +1,132 @@
+# HTTP client used to fetch identity provider documents (JWKS)
+#
+# - one pooled session per container, connections are kept alive across invocations
+# - explicit connect / read timeouts, and a deadline for all attempts together
+#   (the function timeout is 3 seconds, see template.yaml)
+# - bounded retries, exponential backoff with full jitter
+# - a circuit breaker per host stops calling a slow or failing provider for a while,
+#   callers keep using their cached keys meanwhile
+
+from time import sleep, time
+from urllib.parse import urlparse
+import random
+import threading
+
+from requests.adapters import HTTPAdapter
+import requests
+
+from utils import log
+
+CONNECT_TIMEOUT = 0.5
+READ_TIMEOUT = 1.0
+DEADLINE = 2.0
+RETRIES = 2
+BACKOFF = 0.1
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# consecutive failures before opening the circuit, and how long it stays open
+BREAKER_THRESHOLD = 3
+BREAKER_RESET_TIMEOUT = 30
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+
+        self.failures = 0
+        self.opened_at = None
+
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time() - self.opened_at >= self.reset_timeout:
+                # half open: let one call go through, re-open when it fails
+                self.opened_at = time()
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time()
+
+
+def _new_session():
+    session = requests.Session()
+    # retries are handled by get(), to apply jitter and the deadline
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=0)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+SESSION = _new_session()
+BREAKERS = {}
+_breakers_lock = threading.Lock()
+
+
+def _breaker(host):
+    with _breakers_lock:
+        if host not in BREAKERS:
+            BREAKERS[host] = CircuitBreaker()
+        return BREAKERS[host]
+
+
+def _retry_delay(attempt):
+    return random.uniform(0, BACKOFF * (2 ** attempt))
+
+
+def get(url, connect_timeout=None, read_timeout=None, deadline=None, retries=None):
+    connect_timeout = CONNECT_TIMEOUT if connect_timeout is None else connect_timeout
+    read_timeout = READ_TIMEOUT if read_timeout is None else read_timeout
+    deadline = DEADLINE if deadline is None else deadline
+    retries = RETRIES if retries is None else retries
+
+    host = urlparse(url).netloc
+    breaker = _breaker(host)
+    if not breaker.allow():
+        raise CircuitOpenError(f'Circuit open for {host}, not calling {url}')
+
+    start = time()
+    attempt = 0
+    while True:
+        remaining = deadline - (time() - start)
+        try:
+            response = SESSION.get(url, timeout=(connect_timeout, max(0.01, min(read_timeout, remaining))))
+            if response.status_code not in RETRY_STATUS:
+                response.raise_for_status()
+                breaker.success()
+                return response
+            error = requests.HTTPError(f'{response.status_code} returned by {url}', response=response)
+
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = e
+
+        except requests.HTTPError:
+            # 4xx, no need to retry
+            breaker.failure()
+            raise
+
+        attempt += 1
+        delay = _retry_delay(attempt)
+        if attempt > retries or time() - start + delay >= deadline:
+            breaker.failure()
+            raise error
+
+        log.warning('Retrying', url=url, delay=delay, error=error)
+        sleep(delay)
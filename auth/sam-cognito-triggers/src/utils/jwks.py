@@ -0,0 +1,270 @@
+# JSON Web Key Set cache, indexed by key id (kid)
+#
+# - keys are served from memory until the max-age announced by the provider
+#   (Cache-Control header) has passed, at least min_refresh_interval
+# - once stale, the old keys are still served while a background refresh runs
+# - a token signed with an unknown kid triggers an immediate refresh
+#   (providers rotate their keys), at most once per min_refresh_interval.
+#   Kids still unknown after that are rejected right away until the next one
+# - a cold cache first looks for a snapshot on disk (written in /tmp after
+#   each fetch, or bundled with the deployment) before going to the network
+# - refreshes are single flight: one fetch at a time, concurrent callers either
+#   wait for it (no keys yet) or keep using the stale keys
+
+from time import time
+import json
+import os
+import re
+import threading
+
+from jwcrypto import jwk
+
+from utils import http_client, log, metrics
+from utils.ttl_cache import TTLCache
+
+DEFAULT_MAX_AGE = 60 * 60 * 24
+MIN_REFRESH_INTERVAL = 60
+
+# how long callers without any key wait for the in-flight fetch: the fetch gives up
+# at http_client.DEADLINE, the followers a bit later, before the function timeout (3 s)
+FLIGHT_TIMEOUT = http_client.DEADLINE + 0.5
+
+# kids not found after a refresh, remembered until the next refresh is allowed
+UNKNOWN_KIDS_SIZE = 256
+
+MAX_AGE_REGEX = re.compile(r'max-age\s*=\s*(\d+)')
+
+
+class _Flight:
+    # a fetch in progress
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None
+
+
+def _max_age(headers, default, minimum=0):
+    # never below minimum: no-cache or max-age=0 would mean one request per invocation
+    cache_control = headers.get('Cache-Control', '')
+    if 'no-cache' in cache_control or 'no-store' in cache_control:
+        return minimum
+    match = MAX_AGE_REGEX.search(cache_control)
+    if match is None:
+        return max(minimum, default)
+    return max(minimum, int(match.group(1)))
+
+
+class KeyCache:
+
+    def __init__(self, url, default_max_age=DEFAULT_MAX_AGE, min_refresh_interval=MIN_REFRESH_INTERVAL,
+                 snapshot_path=None, bundled_snapshot_path=None):
+        self.url = url
+        self.default_max_age = default_max_age
+        self.min_refresh_interval = min_refresh_interval
+
+        # snapshot_path is read and written, bundled_snapshot_path is read only
+        self.snapshot_path = snapshot_path
+        self.bundled_snapshot_path = bundled_snapshot_path
+        self._snapshot_checked = False
+
+        self.keys = {}
+        self.public_keys = {}
+        self.payload = None
+        self.fetched_at = 0
+        self.expires_at = 0
+        self.last_forced_refresh = 0
+
+        self.fetch_count = 0
+        self._forced_refresh_pending = False
+        self.unknown_kids = TTLCache(UNKNOWN_KIDS_SIZE, min_refresh_interval)
+
+        self._lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
+        self._in_flight = None
+        self._background_refresh = None
+
+    def get(self, kid):
+        # returns the key for this kid, or None when the provider does not know it
+        self.check_snapshot()
+
+        fetched_at = self.fetched_at
+        key = self.keys.get(kid)
+        now = time()
+
+        if key is not None:
+            if now >= self.expires_at:
+                self._refresh_in_background(fetched_at)
+            return key
+
+        if self.is_unknown(kid):
+            return None
+
+        if not self.keys:
+            # nothing to serve yet, we have to wait for the keys
+            self.refresh(fetched_at)
+
+        elif self._force_refresh(now):
+            # unknown kid, the provider probably rotated its keys
+            log.info('Unknown key id, refreshing keys', kid=kid, url=self.url)
+            try:
+                self.refresh(fetched_at)
+            except Exception as e:
+                # the provider is slow or down, carry on with the keys we have
+                log.warning('Cannot refresh keys', url=self.url, error=e)
+
+        key = self.keys.get(kid)
+        if key is None:
+            self.unknown_kids.set(kid, True)
+        return key
+
+    def is_unknown(self, kid):
+        # True when the kid was looked up recently and the provider did not know it
+        return kid not in self.keys and self.unknown_kids.get(kid) is not None
+
+    def check_snapshot(self):
+        # a cold cache loads the snapshot, once
+        if not self.keys and not self._snapshot_checked:
+            with self._snapshot_lock:
+                if not self._snapshot_checked:
+                    self.load_snapshot()
+                    self._snapshot_checked = True
+
+    def public_key(self, kid):
+        # same as get(), but returns the RSA key as a ready to use cryptography object
+        if self.get(kid) is None:
+            return None
+        return self.cached_public_key(kid)
+
+    def cached_public_key(self, kid):
+        # same as public_key(), from the keys in memory only: never fetches.
+        # None for the keys that are not RSA, only RS256 is verified without jwcrypto
+        return self.public_keys.get(kid)
+
+    def refresh(self, stale_fetched_at=None):
+        # stale_fetched_at is the fetched_at the caller saw: when the keys have
+        # been refreshed since, there is nothing left to do
+        with self._lock:
+            if stale_fetched_at is not None and self.fetched_at != stale_fetched_at:
+                # the forced refresh this caller asked for is the one that just ended
+                self._forced_refresh_pending = False
+                return
+            flight = self._in_flight
+            leader = flight is None
+            if leader:
+                flight = self._in_flight = _Flight()
+
+        if not leader:
+            # somebody else is fetching, wait for the result
+            if not flight.done.wait(FLIGHT_TIMEOUT):
+                raise TimeoutError(f'Timeout waiting for keys from {self.url}')
+            if flight.error is not None:
+                raise flight.error
+            return
+
+        try:
+            self.fetch_count += 1
+            metrics.count('key_fetch')
+            with metrics.stage('key_fetch'):
+                response = http_client.get(self.url)
+            self.install(response.json(), response.headers)
+
+        except Exception as e:
+            flight.error = e
+            raise
+
+        finally:
+            with self._lock:
+                self._in_flight = None
+                self._forced_refresh_pending = False
+            flight.done.set()
+
+    def install(self, payload, headers):
+        # keys just fetched from the provider
+        self.load(payload, headers)
+        if self.snapshot_path is not None:
+            self.save_snapshot(self.snapshot_path, payload)
+
+    def load(self, payload, headers=None, fetched_at=None, expires_at=None):
+        keys = {}
+        public_keys = {}
+        for key in payload['keys']:
+            keys[key['kid']] = jwk.JWK(**key)
+            if key.get('kty') == 'RSA':
+                public_keys[key['kid']] = keys[key['kid']].get_op_key('verify')
+
+        now = time() if fetched_at is None else fetched_at
+        if expires_at is None:
+            expires_at = now + _max_age(headers or {}, self.default_max_age, self.min_refresh_interval)
+
+        # swap the whole dict at once, readers never see a partial key set
+        self.public_keys = public_keys
+        self.keys = keys
+        self.payload = payload
+        self.fetched_at = now
+        self.expires_at = expires_at
+
+    def load_snapshot(self):
+        # use the most recent snapshot available, even when it is stale:
+        # its keys are served while a refresh runs in the background
+        snapshots = []
+        for path in (self.snapshot_path, self.bundled_snapshot_path):
+            if path is None or not os.path.exists(path):
+                continue
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except Exception as e:
+                log.warning('Cannot read key snapshot', path=path, error=e)
+
+        if not snapshots:
+            return False
+
+        snapshot = max(snapshots, key=lambda s: s['fetched_at'])
+        self.load(snapshot['jwks'], fetched_at=snapshot['fetched_at'], expires_at=snapshot['expires_at'])
+        return True
+
+    def save_snapshot(self, path, payload=None):
+        snapshot = {
+            'url': self.url,
+            'fetched_at': self.fetched_at,
+            'expires_at': self.expires_at,
+            'jwks': payload or self.payload
+        }
+        try:
+            # write then rename, concurrent readers never see a partial file
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            log.warning('Cannot write key snapshot', path=path, error=e)
+
+    def _force_refresh(self, now, pending=True):
+        # at most one forced refresh per min_refresh_interval, whatever the number of callers.
+        # Callers arriving while it is pending join it. pending=False when the caller
+        # has its own way to join the fetch (utils.jwt_apple_async)
+        with self._lock:
+            if self._forced_refresh_pending:
+                return True
+            if now - self.last_forced_refresh < self.min_refresh_interval:
+                return False
+            self.last_forced_refresh = now
+            self._forced_refresh_pending = pending
+            return True
+
+    def _refresh_in_background(self, stale_fetched_at):
+        with self._lock:
+            if self._in_flight is not None or self.fetched_at != stale_fetched_at:
+                return
+            if self._background_refresh is not None and self._background_refresh.is_alive():
+                return
+            self._background_refresh = threading.Thread(target=self._safe_refresh, args=(stale_fetched_at,), daemon=True)
+            self._background_refresh.start()
+
+    def _safe_refresh(self, stale_fetched_at):
+        try:
+            self.refresh(stale_fetched_at)
+        except Exception as e:
+            # keep serving the stale keys, try again a bit later
+            log.warning('Cannot refresh keys', url=self.url, error=e)
+            self.expires_at = time() + self.min_refresh_interval
@@ -0,0 +1,221 @@
+# Asyncio twin of utils.jwt_apple, for hosts serving many challenges on one
+# event loop (aiohttp / ASGI service on ECS)
+#
+# - same token cache, providers, key caches and rules as utils.jwt_apple
+# - keys are fetched with aiohttp when it is installed (requirements-async.txt),
+#   otherwise with utils.http_client in the default executor: the loop never waits
+#   on the network. One aiohttp session per event loop keeps the connections open,
+#   close() closes it when the host shuts down
+# - refreshes are single flight: concurrent tasks await the same fetch, tasks
+#   whose kid is known keep going with the stale keys
+# - signature checks are CPU bound, they run in an executor (the default one,
+#   or the one passed by the caller)
+
+from time import time
+from urllib.parse import urlparse
+import asyncio
+import contextvars
+import functools
+import weakref
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from utils import http_client, jwks, jwt_apple, log, metrics
+from utils.jwt_apple import TokenError
+
+# fetches in progress, by key cache
+_refreshes = {}
+# background refreshes, the loop only keeps weak references to its tasks
+_background = set()
+# event loop -> aiohttp session, created on the first fetch
+_sessions = weakref.WeakKeyDictionary()
+
+
+def _session():
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        timeout = aiohttp.ClientTimeout(total=http_client.DEADLINE,
+                                        sock_connect=http_client.CONNECT_TIMEOUT,
+                                        sock_read=http_client.READ_TIMEOUT)
+        session = _sessions[loop] = aiohttp.ClientSession(timeout=timeout)
+    return session
+
+
+async def close():
+    # closes the aiohttp session of the running loop, if any
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+async def _get_with_aiohttp(url):
+    # same timeouts, retries and circuit breaker as http_client.get()
+    host = urlparse(url).netloc
+    breaker = http_client._breaker(host)
+    if not breaker.allow():
+        raise http_client.CircuitOpenError(f'Circuit open for {host}, not calling {url}')
+
+    session = _session()
+    start = time()
+    attempt = 0
+    while True:
+        try:
+            async with session.get(url) as response:
+                if response.status not in http_client.RETRY_STATUS:
+                    response.raise_for_status()
+                    payload = await response.json(content_type=None)
+                    breaker.success()
+                    return (payload, response.headers)
+                error = aiohttp.ClientResponseError(response.request_info, (), status=response.status,
+                                                    message=f'{response.status} returned by {url}')
+
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            error = e
+
+        except aiohttp.ClientResponseError:
+            # 4xx, no need to retry
+            breaker.failure()
+            raise
+
+        attempt += 1
+        delay = http_client._retry_delay(attempt)
+        if attempt > http_client.RETRIES or time() - start + delay >= http_client.DEADLINE:
+            breaker.failure()
+            raise error
+
+        log.warning('Retrying', url=url, delay=delay, error=error)
+        await asyncio.sleep(delay)
+
+
+async def get_json(url):
+    # returns (payload, headers)
+    if aiohttp is not None:
+        return await _get_with_aiohttp(url)
+
+    response = await asyncio.get_running_loop().run_in_executor(None, http_client.get, url)
+    return (response.json(), response.headers)
+
+
+async def _fetch(cache):
+    cache.fetch_count += 1
+    metrics.count('key_fetch')
+    with metrics.stage('key_fetch'):
+        (payload, headers) = await get_json(cache.url)
+    # building the public keys is CPU bound too
+    await asyncio.get_running_loop().run_in_executor(None, cache.install, payload, headers)
+
+
+async def refresh(cache, stale_fetched_at=None):
+    # same as KeyCache.refresh(), without blocking the loop
+    task = _refreshes.get(cache)
+    if task is None:
+        if stale_fetched_at is not None and cache.fetched_at != stale_fetched_at:
+            return
+        task = _refreshes[cache] = asyncio.ensure_future(_fetch(cache))
+        task.add_done_callback(lambda _: _refreshes.pop(cache, None))
+
+    # shielded: a caller giving up does not cancel the fetch for the others
+    await asyncio.wait_for(asyncio.shield(task), jwks.FLIGHT_TIMEOUT)
+
+
+async def _safe_refresh(cache, stale_fetched_at):
+    try:
+        await refresh(cache, stale_fetched_at)
+    except Exception as e:
+        # keep serving the stale keys, try again a bit later
+        log.warning('Cannot refresh keys', url=cache.url, error=e)
+        cache.expires_at = time() + cache.min_refresh_interval
+
+
+def _refresh_in_background(cache, stale_fetched_at):
+    if cache in _refreshes:
+        return
+    task = asyncio.ensure_future(_safe_refresh(cache, stale_fetched_at))
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+async def public_key(cache, kid):
+    # same as KeyCache.public_key(), without blocking the loop
+    cache.check_snapshot()
+
+    fetched_at = cache.fetched_at
+    if kid in cache.keys:
+        if time() >= cache.expires_at:
+            _refresh_in_background(cache, fetched_at)
+        return cache.cached_public_key(kid)
+
+    if cache.is_unknown(kid):
+        return None
+
+    if not cache.keys:
+        # nothing to serve yet, we have to wait for the keys
+        await refresh(cache, fetched_at)
+
+    elif cache in _refreshes or cache._force_refresh(time(), pending=False):
+        # unknown kid, the provider probably rotated its keys
+        log.info('Unknown key id, refreshing keys', kid=kid, url=cache.url)
+        try:
+            await refresh(cache, fetched_at)
+        except Exception as e:
+            # the provider is slow or down, carry on with the keys we have
+            log.warning('Cannot refresh keys', url=cache.url, error=e)
+
+    if kid not in cache.keys:
+        cache.unknown_kids.set(kid, True)
+    return cache.cached_public_key(kid)
+
+
+async def _verifier(token, provider, key):
+    # makes sure the key is there, returns what is left to do in the executor
+    if key is not None:
+        return functools.partial(jwt_apple._decode_apple_user_token, token, key, provider)
+
+    (header, encoded_header, encoded_claims, signature) = jwt_apple._split_token(token)
+    if 'kid' not in header:
+        raise TokenError("Token is missing Key ID (kid)", 'MISSING_KID')
+
+    with metrics.stage('key_lookup'):
+        if provider.needs_discovery():
+            await asyncio.get_running_loop().run_in_executor(None, provider.discover)
+        verifying_key = await public_key(provider.keys, header['kid'])
+
+    if jwt_apple.RS256_FAST_PATH and header.get('alg') == 'RS256':
+        if verifying_key is None:
+            jwt_apple._missing_key(provider.keys, header['kid'])
+        return functools.partial(jwt_apple._verify_signature, verifying_key,
+                                 encoded_header, encoded_claims, signature, provider)
+    if header['kid'] not in provider.keys.keys:
+        raise TokenError("Public Key Set has no matching Key ID (kid)", 'UNKNOWN_KID')
+    return functools.partial(jwt_apple._decode_apple_user_token, token, None, provider)
+
+
+async def decode_apple_user_token(apple_user_token, key=None, executor=None):
+    return await decode_token(apple_user_token, jwt_apple.APPLE, key, executor)
+
+
+async def decode_token(token, provider, key=None, executor=None):
+
+    jwt_apple._check(token, provider, key)
+
+    digest = jwt_apple._token_digest(token, key, provider)
+
+    claims = jwt_apple._cached_claims(digest)
+    if claims is not None:
+        return claims
+
+    try:
+        verify = await _verifier(token, provider, key)
+    except TokenError as e:
+        jwt_apple._reject(digest, e)
+        raise
+
+    # the executor runs in a copy of the context: its stages and counters
+    # are reported with this invocation
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        executor, context.run, jwt_apple._verify_and_cache, digest, verify)
@@ -0,0 +1,87 @@
+# Structured logging, one compact JSON line per record
+#
+# - lambda_handler writes one line per invocation: trigger source, outcome,
+#   latency and error class
+# - full payloads (event and response) are only logged for a sampled fraction
+#   of invocations (LOG_SAMPLE_RATE, between 0 and 1), or at DEBUG level
+# - sensitive fields (tokens, emails, ...) are redacted before being written
+# - nothing is formatted when the level is disabled (LOG_LEVEL): pass values
+#   as keyword arguments, not as pre-formatted f-strings
+
+from time import time
+import json
+import os
+import random
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVELS = {'DEBUG': DEBUG, 'INFO': INFO, 'WARNING': WARNING, 'ERROR': ERROR}
+
+LEVEL = LEVELS.get(os.environ.get('LOG_LEVEL', 'INFO').upper(), INFO)
+SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', '0'))
+
+# where the lines are written, None for stdout (CloudWatch on Lambda)
+STREAM = None
+
+REDACTED = '***'
+REDACTED_FIELDS = frozenset(('challengeAnswer', 'testing_key', 'token', 'email', 'phone_number',
+                             'name', 'given_name', 'family_name', 'c_hash', 'nonce',
+                             # UserMigration events: the plaintext password, and what the client sends along
+                             'password', 'validationData', 'clientMetadata'))
+
+
+def redact(value):
+    if isinstance(value, dict):
+        return {k: REDACTED if k in REDACTED_FIELDS else redact(v) for (k, v) in value.items()}
+    if isinstance(value, list):
+        return [redact(v) for v in value]
+    return value
+
+
+def _emit(level, message, fields):
+    record = {'ts': round(time(), 3), 'level': level, 'msg': message}
+    record.update(redact(fields))
+    print(json.dumps(record, separators=(',', ':'), default=str), file=STREAM)
+
+
+def debug(message, **fields):
+    if LEVEL <= DEBUG:
+        _emit('DEBUG', message, fields)
+
+
+def info(message, **fields):
+    if LEVEL <= INFO:
+        _emit('INFO', message, fields)
+
+
+def warning(message, **fields):
+    if LEVEL <= WARNING:
+        _emit('WARNING', message, fields)
+
+
+def error(message, **fields):
+    if LEVEL <= ERROR:
+        _emit('ERROR', message, fields)
+
+
+def sampled():
+    # should this invocation log its full payloads ?
+    return LEVEL <= DEBUG or (SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE)
+
+
+def invocation(trigger, outcome, latency_ms, error_class=None, event=None, response=None):
+    level = ERROR if error_class is not None else INFO
+    if LEVEL > level:
+        return
+
+    fields = {'trigger': trigger, 'outcome': outcome, 'latency_ms': round(latency_ms, 3)}
+    if error_class is not None:
+        fields['error'] = error_class
+    if event is not None:
+        fields['event'] = event
+    if response is not None:
+        fields['response'] = response
+
+    _emit('ERROR' if level == ERROR else 'INFO', 'invocation', fields)
@@ -0,0 +1,121 @@
+# Per-invocation metrics, written as CloudWatch Embedded Metric Format (EMF)
+#
+# - stage durations (client_id, key_lookup, signature, claims, ...), counters
+#   (token cache hit / miss, key fetches) and the rejection reason
+# - disabled unless METRICS_ENABLED=true: stage() then returns a shared no-op
+#   context manager, count() and set_property() return immediately
+# - one EMF line per invocation, with the trigger source as dimension, so CloudWatch
+#   computes p50 / p99 per trigger type. Use set_sink() to send them elsewhere (local runs)
+# - the current invocation is held in a context variable, threads and asyncio
+#   tasks serving other invocations do not mix their metrics
+
+from contextlib import nullcontext
+from contextvars import ContextVar
+from time import perf_counter, time
+import json
+import os
+
+ENABLED = os.environ.get('METRICS_ENABLED', 'false').lower() == 'true'
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'MemoriesCognitoTriggers')
+
+_current = ContextVar('metrics', default=None)
+_NULL_STAGE = nullcontext()
+
+
+def _print_sink(record):
+    print(json.dumps(record, separators=(',', ':')))
+
+
+SINK = _print_sink
+
+
+def set_sink(sink):
+    # sink is called with one EMF record (a dict) per invocation
+    global SINK
+    SINK = sink
+
+
+class Metrics:
+
+    def __init__(self, trigger):
+        self.trigger = trigger
+        self.stages = {}
+        self.counters = {}
+        self.properties = {}
+
+
+class _Stage:
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        elapsed = (perf_counter() - self.start) * 1000
+        self.metrics.stages[self.name] = self.metrics.stages.get(self.name, 0) + elapsed
+        return False
+
+
+def start(trigger):
+    if not ENABLED:
+        return None
+    metrics = Metrics(trigger)
+    _current.set(metrics)
+    return metrics
+
+
+def stage(name):
+    metrics = _current.get()
+    if metrics is None:
+        return _NULL_STAGE
+    return _Stage(metrics, name)
+
+
+def count(name, value=1):
+    metrics = _current.get()
+    if metrics is None:
+        return
+    metrics.counters[name] = metrics.counters.get(name, 0) + value
+
+
+def set_property(name, value):
+    metrics = _current.get()
+    if metrics is None:
+        return
+    metrics.properties[name] = value
+
+
+def emf(metrics, outcome, latency_ms):
+    record = {'trigger': metrics.trigger, 'outcome': outcome, 'latency': latency_ms}
+    definitions = [{'Name': 'latency', 'Unit': 'Milliseconds'}]
+
+    for (name, duration) in metrics.stages.items():
+        record[f'stage_{name}'] = duration
+        definitions.append({'Name': f'stage_{name}', 'Unit': 'Milliseconds'})
+
+    for (name, value) in metrics.counters.items():
+        record[name] = value
+        definitions.append({'Name': name, 'Unit': 'Count'})
+
+    record.update(metrics.properties)
+    record['_aws'] = {
+        'Timestamp': int(time() * 1000),
+        'CloudWatchMetrics': [{
+            'Namespace': NAMESPACE,
+            'Dimensions': [['trigger']],
+            'Metrics': definitions
+        }]
+    }
+    return record
+
+
+def flush(outcome, latency_ms):
+    metrics = _current.get()
+    if metrics is None:
+        return
+    _current.set(None)
+    SINK(emf(metrics, outcome, latency_ms))
@@ -0,0 +1,104 @@
+# Users of the legacy backend, migrated into the user pool on their first sign-in
+#
+# - Cognito calls the UserMigration triggers for users it does not know, on
+#   password sign-ins (UserMigration_Authentication) and forgotten passwords
+#   (UserMigration_ForgotPassword). CUSTOM_AUTH sign-ins (Apple, Google, ...) never
+#   do: these users are imported beforehand, see tools/provision_users.py
+# - legacy users are read from a DynamoDB table (LEGACY_USERS_TABLE, see utils.config),
+#   one item per user name: pk, password_hash, and one string attribute per
+#   Cognito user attribute (email, given_name, ...)
+# - password_hash is pbkdf2_sha256$<iterations>$<salt>$<hash>, salt and hash base64
+#   encoded. Users without one cannot migrate with a password
+# - disabled unless LEGACY_USERS_TABLE is set: unknown users are then rejected,
+#   as for the other triggers
+
+import base64
+import hashlib
+import hmac
+
+from utils import log, metrics, stores
+
+# Cognito computes these, a migration cannot set them
+RESERVED_ATTRIBUTES = frozenset(('pk', 'password_hash', 'sub', 'cognito:user_status'))
+PBKDF2_ALGORITHM = 'pbkdf2_sha256'
+
+
+class InvalidPassword(Exception):
+    # Cognito returns the message to the client, the same one as for its own users
+    def __init__(self):
+        super().__init__('Incorrect username or password.')
+
+
+class LegacyUsers(stores.DynamoDBTable):
+
+    def get(self, user_name):
+        # {attribute: value} of this user, None when the legacy backend does not know it
+        item = self.client.get_item(TableName=self.table_name, Key={'pk': {'S': user_name}}).get('Item')
+        if item is None:
+            return None
+        return {name: value['S'] for (name, value) in item.items() if 'S' in value}
+
+
+def _build(settings):
+    if not settings.legacy_users_table:
+        return None
+    return LegacyUsers(settings.legacy_users_table)
+
+
+_store = stores.Configured(_build)
+
+# the legacy users of this container, None when migration is disabled
+get_store = _store.get
+reset = _store.reset
+
+
+def hash_password(password, salt, iterations=600000):
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+    return f'{PBKDF2_ALGORITHM}${iterations}${base64.b64encode(salt).decode()}${base64.b64encode(digest).decode()}'
+
+
+def check_password(password, password_hash):
+    try:
+        (algorithm, iterations, salt, expected) = password_hash.split('$')
+        if algorithm != PBKDF2_ALGORITHM:
+            return False
+        digest = hashlib.pbkdf2_hmac('sha256', password.encode(), base64.b64decode(salt), int(iterations))
+    except Exception as e:
+        log.warning('Cannot read legacy password hash', error=e)
+        return False
+    return hmac.compare_digest(digest, base64.b64decode(expected))
+
+
+def user_attributes(user):
+    attributes = {name: value for (name, value) in user.items() if name not in RESERVED_ATTRIBUTES}
+    # the legacy backend verified the emails, users are not asked again
+    if 'email' in attributes:
+        attributes.setdefault('email_verified', 'true')
+    return attributes
+
+
+def migrate(event, password=None, store=None):
+    # fills the response of a UserMigration event, False when the legacy backend
+    # does not know the user. password is checked when given (UserMigration_Authentication)
+    store = store or get_store()
+    if store is None:
+        return False
+
+    with metrics.stage('legacy_lookup'):
+        user = store.get(event['userName'])
+    if user is None:
+        return False
+
+    if password is not None:
+        with metrics.stage('password'):
+            if not check_password(password, user.get('password_hash', '')):
+                metrics.set_property('rejection_reason', 'Invalid legacy password')
+                raise InvalidPassword()
+
+    event['response']['userAttributes'] = user_attributes(user)
+    event['response']['finalUserStatus'] = 'CONFIRMED'
+    # users migrated by signing in do not get a welcome message
+    event['response']['messageAction'] = 'SUPPRESS'
+    metrics.count('user_migrated')
+    log.info('User migrated', user=event['userName'], trigger=event['triggerSource'])
+    return True
@@ -0,0 +1,94 @@
+# Profiles a sample of the invocations, to see where the time goes on real traffic
+#
+# - disabled unless PROFILE_SAMPLE_RATE is set (between 0 and 1): lambda_handler
+#   then only compares a float, cProfile and pstats are imported on the first
+#   sampled invocation. PROFILE_TRIGGERS restricts it to some trigger sources
+# - each sampled invocation writes, in PROFILE_DIR (/tmp/profiles by default):
+#     <trigger>-<timestamp>.prof       pstats, for python -m pstats or snakeviz
+#     <trigger>-<timestamp>.collapsed  collapsed stacks, for flamegraph.pl or speedscope
+#   and logs one summary line, with the slowest functions
+# - cProfile only records caller -> callee pairs: each function appears once in the
+#   collapsed stacks, under its most expensive chain of callers
+# - at most PROFILE_MAX_FILES profiles per container, /tmp is small
+
+from time import time
+import os
+import random
+
+from utils import log
+
+SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+TRIGGERS = frozenset(t.strip() for t in os.environ.get('PROFILE_TRIGGERS', '').split(',') if t.strip())
+DIRECTORY = os.environ.get('PROFILE_DIR', '/tmp/profiles')
+MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', '20'))
+# functions listed in the summary line
+SUMMARY_SIZE = 5
+
+written = 0
+
+
+def sampled(trigger):
+    # should this invocation be profiled ?
+    return (written < MAX_FILES and (not TRIGGERS or trigger in TRIGGERS)
+            and random.random() < SAMPLE_RATE)
+
+
+def start(trigger):
+    # a running profiler, None when this invocation is not sampled
+    if not sampled(trigger):
+        return None
+
+    import cProfile
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # another profiler is already running in this thread
+        return None
+    return profiler
+
+
+def _name(function):
+    (filename, line, name) = function
+    return name if filename == '~' else f'{os.path.basename(filename)}:{line}({name})'
+
+
+def collapsed(stats):
+    # "root;caller;function self_us" lines, from the pstats caller -> callee pairs
+    lines = []
+    for (function, (_, _, self_time, _, callers)) in stats.stats.items():
+        if self_time <= 0:
+            continue
+        stack = [function]
+        while callers:
+            # the caller that spent the most time calling this function, cycles cut
+            caller = max(callers, key=lambda c: callers[c][3])
+            if caller in stack:
+                break
+            stack.append(caller)
+            callers = stats.stats[caller][4] if caller in stats.stats else {}
+        lines.append(f"{';'.join(_name(f) for f in reversed(stack))} {int(self_time * 1e6)}")
+    return lines
+
+
+def stop(profiler, trigger):
+    # writes the profile files and the summary line, never fails the invocation
+    global written
+    profiler.disable()
+    try:
+        import pstats
+
+        os.makedirs(DIRECTORY, exist_ok=True)
+        path = os.path.join(DIRECTORY, f'{trigger}-{int(time() * 1000)}')
+        stats = pstats.Stats(profiler)
+        stats.dump_stats(f'{path}.prof')
+        with open(f'{path}.collapsed', 'w') as f:
+            f.write('\n'.join(collapsed(stats)) + '\n')
+        written += 1
+
+        slowest = sorted(stats.stats.items(), key=lambda s: s[1][3], reverse=True)[:SUMMARY_SIZE]
+        log.info('Profile written', trigger=trigger, path=f'{path}.prof', total_ms=round(stats.total_tt * 1000, 3),
+                 slowest=[f'{_name(f)} {round(s[3] * 1000, 3)} ms' for (f, s) in slowest])
+    except Exception as e:
+        log.warning('Cannot write profile', trigger=trigger, error=e)
@@ -0,0 +1,186 @@
+# Identity providers whose tokens are accepted as challenge answers
+#
+# - a provider has its own issuers, audiences (client ids / bundle ids), key
+#   cache and refresh schedule
+# - providers without a jwks_uri find it in their OpenID discovery document,
+#   cached like the keys (Cache-Control max-age, a day by default). Once expired,
+#   it is refreshed in the background: verifications keep the cached jwks_uri
+# - the providers in use are configured with ID_PROVIDERS (see utils.config),
+#   Apple is registered by utils.jwt_apple, Google here, other OpenID Connect
+#   providers come from OIDC_PROVIDERS (a JSON list, see configure())
+# - every provider in use but Apple needs audiences: without them, tokens issued to
+#   any other client of the provider would be accepted. configure() refuses it
+# - prefetch() loads the keys of the configured providers during the init
+#   phase, invocations never wait for them
+
+from time import time
+import json
+import threading
+
+from utils import config, http_client, log
+from utils.jwks import MIN_REFRESH_INTERVAL, KeyCache, _max_age
+
+DISCOVERY_MAX_AGE = 60 * 60 * 24
+KEY_MAX_AGE = 60 * 60 * 24
+# how long prefetch() waits for all the providers
+PREFETCH_TIMEOUT = 2
+
+GOOGLE_ISSUERS = ('https://accounts.google.com', 'accounts.google.com')
+GOOGLE_DISCOVERY_URL = 'https://accounts.google.com/.well-known/openid-configuration'
+GOOGLE_KEY_SNAPSHOT = '/tmp/google_jwks.json'
+
+# name (lower case) -> Provider
+PROVIDERS = {}
+
+
+class Provider:
+
+    def __init__(self, name, issuers, audiences=(), jwks_uri=None, discovery_url=None,
+                 key_max_age=KEY_MAX_AGE, min_refresh_interval=MIN_REFRESH_INTERVAL, snapshot_path=None):
+        self.name = name
+        self.issuers = tuple(issuers)
+        self.audiences = list(audiences)
+        self.jwks_uri = jwks_uri
+        self.discovery_url = discovery_url
+        self.key_max_age = key_max_age
+        self.min_refresh_interval = min_refresh_interval
+        self.snapshot_path = snapshot_path
+        self.issuer_error = f'Not a {name} JWT token'
+
+        self.discovery = None
+        self.discovery_expires_at = 0
+        self._keys = None
+        self._discovery_lock = threading.Lock()
+        self._background_lock = threading.Lock()
+        self._background_discovery = None
+
+    def _key_cache(self, url):
+        return KeyCache(url, default_max_age=self.key_max_age, min_refresh_interval=self.min_refresh_interval,
+                        snapshot_path=self.snapshot_path)
+
+    @property
+    def keys(self):
+        # the KeyCache of this provider, fetches the discovery document the first time only
+        if self._keys is None:
+            self.discover()
+        elif self.jwks_uri is None and time() >= self.discovery_expires_at:
+            self._discover_in_background()
+        return self._keys
+
+    def needs_discovery(self):
+        # True when the next access to keys goes to the network
+        return self._keys is None
+
+    def _discover_in_background(self):
+        with self._background_lock:
+            if self._background_discovery is not None and self._background_discovery.is_alive():
+                return
+            # discover() keeps the keys it has when the provider is slow or down
+            self._background_discovery = threading.Thread(target=self.discover, daemon=True)
+            self._background_discovery.start()
+
+    def discover(self):
+        with self._discovery_lock:
+            if self.jwks_uri is not None:
+                if self._keys is None:
+                    self._keys = self._key_cache(self.jwks_uri)
+                return
+
+            if self._keys is not None and time() < self.discovery_expires_at:
+                return
+
+            try:
+                response = http_client.get(self.discovery_url)
+                document = response.json()
+                jwks_uri = document['jwks_uri']
+            except Exception as e:
+                if self._keys is None:
+                    raise
+                # keep the keys we have, try again a bit later
+                log.warning('Cannot refresh discovery document', url=self.discovery_url, error=e)
+                self.discovery_expires_at = time() + self._keys.min_refresh_interval
+                return
+
+            if self._keys is None or self._keys.url != jwks_uri:
+                self._keys = self._key_cache(jwks_uri)
+            self.discovery = document
+            self.discovery_expires_at = time() + _max_age(response.headers, DISCOVERY_MAX_AGE, self.min_refresh_interval)
+
+    def prefetch(self):
+        # make sure the keys are in memory: snapshot, or network
+        keys = self.keys
+        keys.check_snapshot()
+        if not keys.keys or time() >= keys.expires_at:
+            keys.refresh(keys.fetched_at)
+
+
+def register(provider):
+    PROVIDERS[provider.name.lower()] = provider
+    return provider
+
+
+_configured_for = None
+
+
+def _settings():
+    # providers are registered again when the configuration changes (tests)
+    settings = config.get()
+    if settings is not _configured_for:
+        configure(settings)
+    return settings
+
+
+def get(name):
+    # the provider for this name, None when it is unknown or not configured
+    if name.lower() not in _settings().id_providers:
+        return None
+    return PROVIDERS.get(name.lower())
+
+
+def configured():
+    return [PROVIDERS[name] for name in _settings().id_providers if name in PROVIDERS]
+
+
+def configure(settings):
+    # registers Google and the OIDC_PROVIDERS, with their audiences from the configuration
+    global _configured_for
+
+    register(Provider('Google', GOOGLE_ISSUERS, settings.google_audience,
+                      discovery_url=GOOGLE_DISCOVERY_URL, snapshot_path=GOOGLE_KEY_SNAPSHOT))
+
+    # [{"name": "...", "issuer": "...", "audiences": [...], "jwks_uri": "...", "max_age": 3600}]
+    for definition in json.loads(settings.oidc_providers or '[]'):
+        issuer = definition['issuer']
+        register(Provider(definition['name'], [issuer], definition.get('audiences', []),
+                          jwks_uri=definition.get('jwks_uri'),
+                          discovery_url=definition.get('discovery_url',
+                                                       f"{issuer.rstrip('/')}/.well-known/openid-configuration"),
+                          key_max_age=definition.get('max_age', KEY_MAX_AGE)))
+
+    # fail closed: an unchecked audience accepts the tokens of every client of the provider
+    for name in settings.id_providers:
+        if name != 'apple' and name in PROVIDERS and not PROVIDERS[name].audiences:
+            raise ValueError(f'Identity provider {PROVIDERS[name].name} has no audiences, '
+                             f'set {"GOOGLE_AUDIENCE" if name == "google" else "its audiences in OIDC_PROVIDERS"}')
+    _configured_for = settings
+
+
+def prefetch(providers=None, timeout=PREFETCH_TIMEOUT):
+    # fetches the keys of all the providers at the same time, returns the names of the ready ones
+    providers = configured() if providers is None else providers
+    ready = []
+
+    def fetch(provider):
+        try:
+            provider.prefetch()
+            ready.append(provider.name)
+        except Exception as e:
+            log.warning('Cannot prefetch keys', provider=provider.name, error=e)
+
+    threads = [threading.Thread(target=fetch, args=(p,), daemon=True) for p in providers]
+    for thread in threads:
+        thread.start()
+    deadline = time() + timeout
+    for thread in threads:
+        thread.join(max(0, deadline - time()))
+    return ready
@@ -0,0 +1,160 @@
+# Sign-in attempts per user: a token bucket keyed by userPoolId + userName
+#
+# - each challenge answer takes a token from the bucket of its user, buckets
+#   hold RATE_LIMIT_ATTEMPTS tokens and refill over RATE_LIMIT_WINDOW seconds
+# - VerifyAuthChallengeResponse takes a token before any parsing or crypto work,
+#   DefineAuthChallenge fails the authentication instead of starting another
+#   challenge when the bucket is empty (it looks, it does not take)
+# - MemoryStore is per container: bounded, an idle bucket is dropped once it is
+#   full again. DynamoDBStore is shared by all containers: read, then put with
+#   a condition on the previous state, retried when another container won.
+#   TieredStore puts the first in front of the second, so a container that
+#   already knows a user is over the limit does not ask DynamoDB again
+# - disabled unless RATE_LIMIT_STORE is set (memory or dynamodb, see utils.config)
+
+from time import time
+import threading
+
+from utils import log, metrics, stores
+from utils.ttl_cache import TTLCache
+
+MEMORY_STORE_SIZE = 50000
+# DynamoDB conditional puts lost to other containers before giving up
+MAX_CONFLICTS = 3
+
+
+def refill(tokens, updated_at, now, capacity, window):
+    # tokens in a bucket last seen with `tokens` at `updated_at`
+    return min(capacity, tokens + (now - updated_at) * capacity / window)
+
+
+class MemoryStore:
+    # calls are cheap, fine to make from the event loop
+    blocking = False
+
+    def __init__(self, capacity, window, maxsize=MEMORY_STORE_SIZE):
+        self.capacity = capacity
+        self.window = window
+        # key -> (tokens, updated_at), a missing bucket is a full one
+        self.buckets = TTLCache(maxsize, window)
+        self._lock = threading.Lock()
+
+    def take(self, key, cost=1, now=None):
+        # False when the bucket has less than one token left, cost 0 only looks
+        now = time() if now is None else now
+        with self._lock:
+            bucket = self.buckets.get(key)
+            tokens = self.capacity if bucket is None else refill(*bucket, now, self.capacity, self.window)
+            if tokens < 1:
+                return False
+            if cost:
+                self.buckets.set(key, (tokens - cost, now))
+            return True
+
+
+class DynamoDBStore(stores.DynamoDBTable):
+    # one item per user: pk (string), tokens and updated_at (numbers),
+    # expires_at (number, the table TTL attribute, when the bucket is full again)
+
+    def __init__(self, table_name, capacity, window, client=None):
+        super().__init__(table_name, client)
+        self.capacity = capacity
+        self.window = window
+
+    def take(self, key, cost=1, now=None):
+        from botocore.exceptions import ClientError
+
+        for _ in range(MAX_CONFLICTS):
+            now = time() if now is None else now
+            item = self.client.get_item(TableName=self.table_name, Key={'pk': {'S': key}},
+                                        ConsistentRead=True).get('Item')
+            if item is None:
+                tokens = self.capacity
+                condition = {'ConditionExpression': 'attribute_not_exists(pk)'}
+            else:
+                previous = item['updated_at']['N']
+                tokens = refill(float(item['tokens']['N']), float(previous), now, self.capacity, self.window)
+                condition = {'ConditionExpression': 'updated_at = :previous',
+                             'ExpressionAttributeValues': {':previous': {'N': previous}}}
+
+            if tokens < 1:
+                return False
+            if not cost:
+                return True
+
+            tokens -= cost
+            expires_at = now + (self.capacity - tokens) * self.window / self.capacity
+            try:
+                self.client.put_item(TableName=self.table_name,
+                                     Item={'pk': {'S': key}, 'tokens': {'N': f'{tokens:.6f}'},
+                                           'updated_at': {'N': f'{now:.6f}'},
+                                           'expires_at': {'N': str(int(expires_at) + 1)}},
+                                     **condition)
+                return True
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+            # another container took a token first, try again with its state
+            now = None
+
+        # too much contention on this user, count it as over the limit
+        return False
+
+
+class TieredStore(stores.TieredStore):
+
+    def take(self, key, cost=1, now=None):
+        # the local bucket only sees the attempts made in this container:
+        # when it is empty, the shared one is empty too
+        if not self.local.take(key, cost, now):
+            return False
+        return self.shared.take(key, cost, now)
+
+
+def new_store(kind, table_name=None, capacity=5, window=300):
+    if kind == 'memory':
+        return MemoryStore(capacity, window)
+    if kind == 'dynamodb':
+        if not table_name:
+            raise ValueError('RATE_LIMIT_TABLE is required with the dynamodb rate limit store')
+        return TieredStore(MemoryStore(capacity, window), DynamoDBStore(table_name, capacity, window))
+    raise ValueError(f'Unknown rate limit store {kind}, expecting memory or dynamodb')
+
+
+def _build(settings):
+    if not settings.rate_limit_store:
+        return None
+    return new_store(settings.rate_limit_store, settings.rate_limit_table,
+                     settings.rate_limit_attempts, settings.rate_limit_window)
+
+
+_store = stores.Configured(_build)
+
+# the store configured for this container, None when rate limiting is disabled
+get_store = _store.get
+reset = _store.reset
+
+
+def user_key(event):
+    return f"{event['userPoolId']}:{event['userName']}"
+
+
+def allow(event, cost=1, store=None):
+    # False when the user of this event is over the limit
+    store = store or get_store()
+    if store is None:
+        return True
+
+    with metrics.stage('rate_limit'):
+        allowed = store.take(user_key(event), cost)
+
+    if not allowed:
+        metrics.count('rate_limited')
+        metrics.set_property('rejection_reason', 'Too many attempts')
+        log.info('Too many sign-in attempts', user=event['userName'])
+    return allowed
+
+
+async def allow_async(event, cost=1, executor=None):
+    # same as allow(), DynamoDB calls run in the executor
+    return await stores.call_async(get_store(), allow, event, cost, executor=executor)
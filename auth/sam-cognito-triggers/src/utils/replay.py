@@ -0,0 +1,119 @@
+# Replay protection: an Apple identity token signs a user in once
+#
+# - each verified token is recorded until it expires (exp + clock skew), a token
+#   seen before is rejected with the REPLAYED code
+# - tokens are keyed by iss + sub + nonce when the app sent a nonce (the same sign-in
+#   request cannot be replayed with another token), by token digest otherwise
+# - MemoryStore is per container: O(1) lookups, bounded size (least recently
+#   seen tokens are dropped first). DynamoDBStore is shared by all containers,
+#   with a conditional put and a TTL attribute. TieredStore puts the first in
+#   front of the second, so local replays never reach DynamoDB
+# - disabled unless REPLAY_STORE is set (memory or dynamodb, see utils.config)
+
+from time import time
+import hashlib
+
+from utils import log, metrics, stores
+from utils.jwt_apple import CLOCK_SKEW, TokenError
+from utils.ttl_cache import TTLCache
+
+MEMORY_STORE_SIZE = 50000
+# nothing is kept longer than this, whatever the token exp
+MAX_TTL = 60 * 60 * 24
+
+
+class MemoryStore:
+    # calls are cheap, fine to make from the event loop
+    blocking = False
+
+    def __init__(self, maxsize=MEMORY_STORE_SIZE, max_ttl=MAX_TTL):
+        self.seen = TTLCache(maxsize, max_ttl)
+
+    def add(self, key, expires_at):
+        # False when the key has been added before, and has not expired yet
+        return self.seen.add(key, True, expires_at - time())
+
+    def discard(self, key):
+        self.seen.delete(key)
+
+
+class DynamoDBStore(stores.DynamoDBTable):
+    # one item per token: pk (string) and expires_at (number, the table TTL attribute)
+
+    def add(self, key, expires_at):
+        from botocore.exceptions import ClientError
+
+        now = int(time())
+        try:
+            # DynamoDB deletes expired items lazily: an expired item does not count
+            self.client.put_item(TableName=self.table_name,
+                                 Item={'pk': {'S': key}, 'expires_at': {'N': str(int(expires_at))}},
+                                 ConditionExpression='attribute_not_exists(pk) OR expires_at < :now',
+                                 ExpressionAttributeValues={':now': {'N': str(now)}})
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+
+class TieredStore(stores.TieredStore):
+
+    def add(self, key, expires_at):
+        if not self.local.add(key, expires_at):
+            return False
+        try:
+            return self.shared.add(key, expires_at)
+        except Exception:
+            # not recorded, the client can try again with the same token
+            self.local.discard(key)
+            raise
+
+
+def new_store(kind, table_name=None):
+    if kind == 'memory':
+        return MemoryStore()
+    if kind == 'dynamodb':
+        if not table_name:
+            raise ValueError('REPLAY_TABLE is required with the dynamodb replay store')
+        return TieredStore(MemoryStore(), DynamoDBStore(table_name))
+    raise ValueError(f'Unknown replay store {kind}, expecting memory or dynamodb')
+
+
+def _build(settings):
+    if not settings.replay_store:
+        return None
+    return new_store(settings.replay_store, settings.replay_table)
+
+
+_store = stores.Configured(_build)
+
+# the store configured for this container, None when replay protection is disabled
+get_store = _store.get
+reset = _store.reset
+
+
+def replay_key(token, claims):
+    if claims.get('nonce') and claims.get('sub'):
+        return f"{claims.get('iss')}:{claims['sub']}:{claims['nonce']}"
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def check(token, claims, store=None):
+    # raises TokenError when the token (or its nonce) has been used before
+    store = store or get_store()
+    if store is None:
+        return
+
+    with metrics.stage('replay'):
+        first_use = store.add(replay_key(token, claims), claims.get('exp', 0) + CLOCK_SKEW)
+
+    if not first_use:
+        metrics.count('replay_rejected')
+        log.info('Token replayed', sub=claims.get('sub'))
+        raise TokenError("Token has already been used", 'REPLAYED')
+
+
+async def check_async(token, claims, executor=None):
+    # same as check(), DynamoDB calls run in the executor
+    await stores.call_async(get_store(), check, token, claims, executor=executor)
@@ -0,0 +1,71 @@
+# Responses built once, merged into the events
+#
+# - CreateAuthChallenge and PreSignUp answer every event with the same fields:
+#   a Template holds them, read only, built once (per configuration)
+# - apply() merges them into the event response, nested objects are copied
+#   (one dict copy each) so neither handlers nor hosts can modify the template
+# - fragment is the same fields serialized once: dumps() splices it into the
+#   JSON of the event, for hosts serializing the results themselves. The event
+#   response is not modified
+
+from types import MappingProxyType
+import json
+
+SEPARATORS = (',', ':')
+# serialized responses remembered per template, for the fields coming with the events
+SERIALIZED_CACHE_SIZE = 16
+
+
+class Template:
+
+    def __init__(self, fields):
+        # private plain dicts, copied into the responses: the fastest copies
+        self._flat = {name: value for (name, value) in fields.items() if not isinstance(value, dict)}
+        self._nested = tuple((name, dict(value)) for (name, value) in fields.items() if isinstance(value, dict))
+        self.fields = MappingProxyType({**self._flat,
+                                        **{name: MappingProxyType(value) for (name, value) in self._nested}})
+        self._names = frozenset(fields)
+        # "name":value,... without the braces
+        self.fragment = json.dumps(fields, separators=SEPARATORS)[1:-1]
+        self._serialized = {}
+
+    def apply(self, event):
+        response = event['response']
+        response.update(self._flat)
+        for (name, value) in self._nested:
+            response[name] = value.copy()
+        return event
+
+    def dumps(self, event):
+        # the JSON of apply(event), without encoding the template fields again
+        response = event.pop('response')
+        try:
+            serialized = json.dumps(event, separators=SEPARATORS)
+        finally:
+            event['response'] = response
+
+        # Cognito sends the response fields with null values, usually the template replaces them all
+        if response.keys() <= self._names:
+            members = self.fragment
+        else:
+            members = self._members(response)
+
+        return f"{serialized[:-1]}{',' if len(event) > 1 else ''}\"response\":{{{members}}}}}"
+
+    def _members(self, response):
+        # the fields the template does not replace come with the event (PreSignUp autoVerifyPhone):
+        # same values on each event, serialized once
+        key = tuple(response.items())
+        try:
+            return self._serialized[key]
+        except KeyError:
+            pass
+        except TypeError:
+            # unhashable values, nothing to remember
+            key = None
+
+        others = {name: value for (name, value) in response.items() if name not in self._names}
+        members = f"{json.dumps(others, separators=SEPARATORS)[1:-1]},{self.fragment}"
+        if key is not None and len(self._serialized) < SERIALIZED_CACHE_SIZE:
+            self._serialized[key] = members
+        return members
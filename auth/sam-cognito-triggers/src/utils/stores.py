@@ -0,0 +1,71 @@
+# Building blocks of the optional stores (utils.replay, utils.rate_limit, utils.migration)
+#
+# - dynamodb_client(): one boto3 DynamoDB client per container, created on first use.
+#   boto3 is slow to import, the triggers that do not use DynamoDB never pay for it
+# - DynamoDBTable: a store on one table, with a given client (tests) or the shared one
+# - TieredStore: a per container store in front of a DynamoDB one, the subclasses
+#   decide when the local one answers alone
+# - Configured: the store of this container, built from the configuration on first
+#   use, None when the feature is disabled. reset() forgets it, for tests
+# - call_async(): calls a store function in the executor when the store makes
+#   network calls (blocking), right away in the event loop otherwise
+
+from utils import config
+
+_client = None
+
+
+def dynamodb_client():
+    global _client
+    if _client is None:
+        import boto3
+        _client = boto3.client('dynamodb')
+    return _client
+
+
+class DynamoDBTable:
+    blocking = True
+
+    def __init__(self, table_name, client=None):
+        self.table_name = table_name
+        self._client = client
+
+    @property
+    def client(self):
+        return self._client or dynamodb_client()
+
+
+class TieredStore:
+
+    def __init__(self, local, shared):
+        self.local = local
+        self.shared = shared
+        self.blocking = shared.blocking
+
+
+class Configured:
+
+    def __init__(self, build):
+        # build(settings) -> the store, None when the feature is disabled
+        self.build = build
+        self.store = None
+
+    def get(self):
+        if self.store is None:
+            self.store = self.build(config.get())
+        return self.store
+
+    def reset(self):
+        self.store = None
+
+
+async def call_async(store, function, *args, executor=None):
+    # function(*args, store), without blocking the event loop
+    if store is None or not store.blocking:
+        return function(*args, store)
+
+    import asyncio
+    import contextvars
+
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(executor, context.run, function, *args, store)
@@ -0,0 +1,84 @@
+# Bounded LRU cache where each entry has its own time to live
+#
+# - get() returns None for missing and expired entries
+# - add() only stores missing and expired entries, atomically
+# - when the cache is full, the least recently used entry is evicted
+# - hits and misses are counted, to report the cache efficiency
+
+from collections import OrderedDict
+from time import time
+import threading
+
+
+class TTLCache:
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if time() < expires_at:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+            self.misses += 1
+            return None
+
+    def set(self, key, value, ttl=None):
+        # ttl defaults to the cache ttl, and never goes beyond it
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (value, time() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def add(self, key, value, ttl=None):
+        # same as set(), only when the key is missing or expired.
+        # Returns False when the key is already there
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        now = time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now < entry[1]:
+                return False
+            if ttl <= 0:
+                return True
+
+            self._entries[key] = (value, now + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+    def __len__(self):
+        return len(self._entries)
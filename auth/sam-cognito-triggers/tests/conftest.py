@@ -0,0 +1,98 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from utils import config, http_client, jwks, jwt_apple, jwt_apple_async, migration, rate_limit, replay
+from tools.fake_apple import RSA_KEY_1, RSA_KEY_2, JWKSServer
+
+EVENTS = os.path.join(os.path.dirname(__file__), '..', 'events')
+# the app client of the sample events
+CLIENT_ID = '1irha5mrk1jjp86ikl7bhkj7gf'
+
+
+def load_event(name, **fields):
+    with open(os.path.join(EVENTS, f'{name}.json')) as f:
+        return {**json.load(f), **fields}
+
+
+def verify_event(answer, **fields):
+    # a Verify event answering 'Provider:::token'
+    event = load_event('verify_auth_challenge', **fields)
+    event['request']['challengeAnswer'] = answer
+    return event
+
+
+def run_async(coroutine):
+    # asyncio.run(), closing the aiohttp session of the loop before it is closed, as the hosts do
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            await jwt_apple_async.close()
+
+    return asyncio.run(main())
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """ Each test starts without any verified token in cache, nor open circuit """
+
+    jwt_apple.TOKEN_CACHE.clear()
+    jwt_apple.REJECTION_CACHE.clear()
+    http_client.BREAKERS.clear()
+    yield
+    jwt_apple.TOKEN_CACHE.clear()
+    jwt_apple.REJECTION_CACHE.clear()
+    http_client.BREAKERS.clear()
+
+
+@pytest.fixture(autouse=True)
+def reset_config():
+    """ Tests change the environment, each test resolves the configuration again """
+
+    config.reset()
+    replay.reset()
+    rate_limit.reset()
+    migration.reset()
+    yield
+    config.reset()
+    replay.reset()
+    rate_limit.reset()
+    migration.reset()
+
+
+@pytest.fixture()
+def key_cache(mocker):
+    """ Replaces the Apple key cache with an empty one, that cannot reach Apple """
+
+    mocker.patch('utils.jwks.http_client.get', side_effect=ConnectionError('no network in tests'))
+    cache = jwks.KeyCache('https://appleid.apple.com/auth/keys')
+    mocker.patch.object(jwt_apple, 'APPLE_KEYS', cache)
+    return cache
+
+
+@pytest.fixture()
+def jwks_server():
+    """ Local server publishing the fake Apple keys """
+
+    server = JWKSServer([RSA_KEY_1, RSA_KEY_2]).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture()
+def apple_keys(jwks_server, mocker):
+    """ Apple key cache, fetching keys from the local JWKS server """
+
+    cache = jwks.KeyCache(jwks_server.url)
+    mocker.patch.object(jwt_apple, 'APPLE_KEYS', cache)
+    return cache
+
+
+@pytest.fixture()
+def client_id(mocker):
+    """ The triggers accept the app client of the sample events """
+
+    mocker.patch.dict(os.environ, {'COGNITO_CLIENT_ID': CLIENT_ID})
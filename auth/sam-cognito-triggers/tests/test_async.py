@@ -0,0 +1,150 @@
+from time import time
+import asyncio
+
+import pytest
+from pytest_mock import mocker
+
+from src import app
+from utils import jwt_apple, jwt_apple_async
+from tests.conftest import load_event, run_async, verify_event
+from tools.fake_apple import RSA_KEY_1, RSA_KEY_2, jwks, apple_token
+
+CONCURRENCY = 1000
+
+
+async def verify_concurrently(tokens):
+    return await asyncio.gather(*[jwt_apple_async.decode_apple_user_token(t) for t in tokens],
+                                return_exceptions=True)
+
+
+@pytest.fixture(params=['aiohttp', 'executor'])
+def apple_keys(request, apple_keys, jwks_server, mocker):
+    """ The Apple key cache of conftest on a slow server, with or without aiohttp """
+
+    if request.param == 'executor':
+        mocker.patch.object(jwt_apple_async, 'aiohttp', None)
+    jwks_server.delay = 0.2
+    return apple_keys
+
+
+def test_cold_cache_fetches_once(apple_keys, jwks_server):
+
+    tokens = [apple_token(RSA_KEY_1, nonce=str(i)) for i in range(CONCURRENCY)]
+
+    claims = run_async(verify_concurrently(tokens))
+
+    assert all(isinstance(c, dict) for c in claims)
+    assert jwks_server.requests == 1
+    assert apple_keys.fetch_count == 1
+
+
+def test_loop_not_blocked_by_fetch(apple_keys):
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        task = asyncio.ensure_future(ticker())
+        await jwt_apple_async.decode_apple_user_token(apple_token(RSA_KEY_1))
+        task.cancel()
+        return ticks
+
+    # the fetch takes 0.2 seconds, the loop kept running meanwhile
+    assert run_async(run()) > 5
+
+
+def test_stale_keys_served_while_refreshing(apple_keys, jwks_server):
+
+    apple_keys.load(jwks([RSA_KEY_1]))
+    apple_keys.expires_at = time() - 1
+
+    async def run():
+        claims = await verify_concurrently([apple_token(RSA_KEY_1, nonce=str(i)) for i in range(100)])
+        # answered with the stale keys, the refresh has not completed yet
+        assert apple_keys.expires_at < time()
+        await asyncio.sleep(0.5)
+        return claims
+
+    claims = run_async(run())
+
+    assert all(isinstance(c, dict) for c in claims)
+    assert jwks_server.requests == 1
+    assert apple_keys.expires_at > time()
+
+
+def test_unknown_kid_refreshes_once(apple_keys, jwks_server):
+
+    apple_keys.load(jwks([RSA_KEY_1]))
+    tokens = [apple_token(RSA_KEY_2, nonce=str(i)) for i in range(100)]
+
+    claims = run_async(verify_concurrently(tokens))
+
+    assert all(isinstance(c, dict) for c in claims)
+    assert jwks_server.requests == 1
+    # the sync verifier is not stuck waiting for a forced refresh
+    assert apple_keys._forced_refresh_pending is False
+
+
+def test_aiohttp_session_is_reused(jwks_server):
+
+    async def run():
+        await jwt_apple_async.get_json(jwks_server.url)
+        session = jwt_apple_async._session()
+        await jwt_apple_async.get_json(jwks_server.url)
+        return (session, jwt_apple_async._session())
+
+    (first, second) = run_async(run())
+
+    assert first is second
+    assert first.closed
+    assert jwks_server.requests == 2
+
+
+def test_rejected_token_is_cached(key_cache, mocker):
+
+    key_cache.load(jwks([RSA_KEY_1]))
+    (header, claims, _) = apple_token(RSA_KEY_1).split('.')
+    (_, _, signature) = apple_token(RSA_KEY_2).split('.')
+    tampered = f'{header}.{claims}.{signature}'
+    verify = mocker.spy(jwt_apple, '_verify_signature')
+
+    for _ in range(2):
+        with pytest.raises(jwt_apple.TokenError) as e:
+            run_async(jwt_apple_async.decode_apple_user_token(tampered))
+        assert e.value.code == 'INVALID_SIGNATURE'
+
+    assert verify.call_count == 1
+
+
+def test_unknown_kid_rejected(key_cache):
+
+    key_cache.load(jwks([RSA_KEY_1]))
+
+    with pytest.raises(jwt_apple.TokenError) as e:
+        run_async(jwt_apple_async.decode_apple_user_token(apple_token(RSA_KEY_2)))
+    assert e.value.code == 'UNKNOWN_KID'
+
+
+def test_async_handler(client_id, key_cache):
+
+    key_cache.load(jwks([RSA_KEY_1]))
+
+    valid = verify_event('Apple:::' + apple_token(RSA_KEY_1))
+    expired = verify_event('Apple:::' + apple_token(RSA_KEY_1, exp_in=-3600))
+
+    async def run():
+        return await asyncio.gather(app.lambda_handler_async(valid),
+                                    app.lambda_handler_async(expired),
+                                    app.lambda_handler_async(load_event('create_auth_challenge')),
+                                    return_exceptions=True)
+
+    (valid, expired, create) = run_async(run())
+
+    assert valid['response']['answerCorrect'] is True
+    assert isinstance(expired, jwt_apple.TokenError)
+    assert create['response']['challengeMetadata'] == 'IDP_TOKEN'
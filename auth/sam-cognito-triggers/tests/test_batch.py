@@ -0,0 +1,81 @@
+import json
+import os
+
+import pytest
+from pytest_mock import mocker
+
+from src import app
+from utils import batch, jwt_apple
+from tools.fake_apple import RSA_KEY_1, RSA_KEY_2, jwks, apple_token
+
+
+@pytest.fixture()
+def tokens(key_cache):
+    """ A dump of tokens: valid, expired, unknown key, garbage, and an empty line """
+
+    key_cache.load(jwks([RSA_KEY_1]))
+    return [
+        apple_token(RSA_KEY_1, sub='user1'),
+        'Apple:::' + apple_token(RSA_KEY_1, sub='user2'),
+        apple_token(RSA_KEY_1, exp_in=-3600),
+        '',
+        apple_token(RSA_KEY_2),
+        'not a token',
+    ]
+
+
+def check(results):
+    assert [r['line'] for r in results] == [1, 2, 3, 5, 6]
+    assert [r['valid'] for r in results] == [True, True, False, False, False]
+    assert [r.get('sub') for r in results[:2]] == ['user1', 'user2']
+    assert [r.get('code') for r in results[2:]] == ['EXPIRED', 'UNKNOWN_KID', 'INVALID_TOKEN']
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 64])
+def test_threads(tokens, chunk_size):
+
+    results = list(batch.verify_tokens(iter(tokens), workers=3, chunk_size=chunk_size))
+    check(results)
+
+
+def test_processes_share_the_key_snapshot(tokens, tmp_path, mocker):
+
+    snapshot = str(tmp_path / 'jwks.json')
+    fetch = mocker.patch.object(jwt_apple.APPLE_KEYS, 'refresh')
+
+    results = list(batch.verify_tokens(iter(tokens), workers=2, mode='process', chunk_size=2, snapshot_path=snapshot))
+
+    check(results)
+    assert json.load(open(snapshot))['jwks']['keys'][0]['kid'] == 'key1'
+    assert fetch.call_count == 0
+
+
+def test_results_are_streamed(key_cache, mocker):
+
+    key_cache.load(jwks([RSA_KEY_1]))
+    token = apple_token(RSA_KEY_1)
+    read = []
+
+    def lines():
+        for i in range(1000):
+            read.append(i)
+            yield token
+
+    results = batch.verify_tokens(lines(), workers=2, chunk_size=10)
+    _ = next(results)
+
+    # only the chunks in flight have been read
+    assert len(read) <= 10 * 2 * batch.QUEUE_DEPTH + 10
+    results.close()
+
+
+def test_cli(tokens, tmp_path, capsys, mocker):
+
+    dump = tmp_path / 'tokens.txt'
+    dump.write_text('\n'.join(tokens))
+
+    mocker.patch.object(app.log, 'STREAM')
+    ret = app.main(['verify-tokens', str(dump), '--workers', '2'])
+
+    assert ret == 1
+    check([json.loads(line) for line in capsys.readouterr().out.splitlines()])
@@ -0,0 +1,56 @@
+import os
+import subprocess
+import sys
+
+# cumulative time to import the handler module, as reported by python -X importtime,
+# relative to the import of a stdlib only module on the same machine: wall clock limits
+# depend on the runner. app takes about half the time of http.client, importing requests
+# or jwcrypto again would take several times more. COLD_IMPORT_BUDGET_RATIO overrides it
+REFERENCE_MODULE = 'http.client'
+COLD_IMPORT_BUDGET_RATIO = float(os.environ.get('COLD_IMPORT_BUDGET_RATIO', '1.0'))
+# best of RUNS imports of each module, against the noise of shared runners
+RUNS = 3
+
+# only the VerifyAuthChallengeResponse trigger needs these
+HEAVY_MODULES = ('jwcrypto', 'requests', 'cryptography', 'utils.jwt_apple')
+
+SRC = os.path.join(os.path.dirname(__file__), '..', 'src')
+
+
+def import_times(module):
+    """ Imports the module in a fresh interpreter, returns {module: (self us, cumulative us)} """
+
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=SRC, capture_output=True, text=True, check=True)
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        (self_us, cumulative_us, name) = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def report(times):
+    slowest = sorted(times.items(), key=lambda t: t[1][0], reverse=True)[:10]
+    return '\n'.join(f'{self_us:>8} us  {name}' for (name, (self_us, _)) in slowest)
+
+
+def test_heavy_modules_are_not_imported():
+
+    times = import_times('app')
+
+    loaded = [name for name in times if name.startswith(HEAVY_MODULES)]
+    assert loaded == [], f'imported at cold start : {loaded}'
+
+
+def test_cold_import_budget():
+
+    runs = [(import_times('app'), import_times(REFERENCE_MODULE)) for _ in range(RUNS)]
+    (times, _) = min(runs, key=lambda run: run[0]['app'][1])
+    app_us = times['app'][1]
+    reference_us = min(reference[REFERENCE_MODULE][1] for (_, reference) in runs)
+
+    assert app_us < reference_us * COLD_IMPORT_BUDGET_RATIO, \
+        f'app: {app_us} us, {REFERENCE_MODULE}: {reference_us} us\n' + report(times)
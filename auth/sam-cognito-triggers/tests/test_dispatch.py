@@ -0,0 +1,81 @@
+import os
+
+import pytest
+from pytest_mock import mocker
+
+from src import app
+from utils import config
+from utils.events import MalformedEvent
+from tests.conftest import load_event
+
+pytestmark = pytest.mark.usefixtures('client_id')
+
+
+@pytest.mark.parametrize('name,change,message', [
+    ('define_auth_srpa', lambda e: e.pop('request'), 'request is missing'),
+    ('define_auth_srpa', lambda e: e['request'].update(session=None), 'request.session is missing'),
+    ('define_auth_srpa', lambda e: e['request'].update(session='[]'), 'request.session must be list, got str'),
+    ('define_auth_srpa', lambda e: e['request'].update(session=[{}]), 'request.session[0].challengeName is missing'),
+    ('define_auth_srpa', lambda e: e['request'].update(session=['SRP_A']),
+     'request.session[0] must be an object, got str'),
+    ('define_auth_srpa', lambda e: e['request']['session'][0].update(challengeResult='true'),
+     'request.session[0].challengeResult must be bool, got str'),
+    ('verify_auth_challenge', lambda e: e['request'].pop('challengeAnswer'), 'request.challengeAnswer is missing'),
+    ('create_auth_challenge', lambda e: e['callerContext'].pop('clientId'), 'callerContext.clientId is missing'),
+    ('create_auth_challenge', lambda e: e.update(response=None), 'response is missing'),
+])
+def test_malformed_event(name, change, message):
+
+    event = load_event(name)
+    change(event)
+
+    with pytest.raises(MalformedEvent) as e:
+        app.lambda_handler(event, None)
+    assert message in str(e.value)
+    assert event['triggerSource'] in str(e.value)
+
+
+def test_not_an_object():
+
+    with pytest.raises(MalformedEvent):
+        app.lambda_handler([], None)
+
+
+def test_config_resolved_once(mocker):
+
+    app.lambda_handler(load_event('create_auth_challenge'), None)
+
+    mocker.patch.dict(os.environ, {'COGNITO_CLIENT_ID': 'another client'})
+    app.lambda_handler(load_event('create_auth_challenge'), None)
+
+    assert config.get().cognito_client_id == '1irha5mrk1jjp86ikl7bhkj7gf'
+
+
+def test_register_trigger(mocker):
+
+    mocker.patch.dict(app.TRIGGERS)
+
+    def post_authentication(event):
+        event['response']['seen'] = True
+        return event
+
+    app.register('PostAuthentication_Authentication', post_authentication, {'newDeviceUsed': bool})
+    event = load_event('create_auth_challenge')
+    event.update(triggerSource='PostAuthentication_Authentication')
+
+    with pytest.raises(MalformedEvent):
+        app.lambda_handler(event, None)
+
+    event['request']['newDeviceUsed'] = False
+    assert app.lambda_handler(event, None)['response']['seen'] is True
+
+
+def test_admin_create_user():
+
+    # the event Cognito sends for the users created by tools/provision_users.py
+    event = load_event('signup')
+    assert event['triggerSource'] == 'PreSignUp_AdminCreateUser'
+
+    result = app.lambda_handler(event, None)
+
+    assert result['response'] == {'autoConfirmUser': True, 'autoVerifyEmail': True, 'autoVerifyPhone': False}
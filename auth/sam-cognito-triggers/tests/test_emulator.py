@@ -0,0 +1,73 @@
+import pytest
+from pytest_mock import mocker
+
+from src import app
+from tools.cognito_emulator import CognitoEmulator, Challenge, NotAuthorizedException, \
+    UserLambdaValidationException, load_test
+from tools.fake_apple import RSA_KEY_1, RSA_KEY_2, jwks, apple_token
+
+
+@pytest.fixture()
+def emulator(client_id, key_cache, mocker):
+    """ Cognito emulator calling the trigger handler, with the fake Apple keys """
+
+    key_cache.load(jwks([RSA_KEY_1]))
+    return CognitoEmulator(app.lambda_handler)
+
+
+def test_amplify_flow(emulator, mocker):
+
+    handler = mocker.spy(emulator, 'handler')
+
+    challenge = emulator.initiate_auth('appleUserID', srp=True)
+    assert isinstance(challenge, Challenge)
+    assert challenge.parameters['providers'] == 'Apple'
+    assert challenge.metadata == 'IDP_TOKEN'
+
+    tokens = emulator.respond_to_auth_challenge(challenge, 'Apple:::' + apple_token(RSA_KEY_1))
+    assert 'IdToken' in tokens
+
+    triggers = [call.args[0]['triggerSource'] for call in handler.call_args_list]
+    assert triggers == ['DefineAuthChallenge_Authentication',
+                        'CreateAuthChallenge_Authentication',
+                        'VerifyAuthChallengeResponse_Authentication',
+                        'DefineAuthChallenge_Authentication']
+
+    # the last define receives the whole session
+    session = handler.call_args_list[-1].args[0]['request']['session']
+    assert [s['challengeName'] for s in session] == ['SRP_A', 'CUSTOM_CHALLENGE']
+    assert session[-1]['challengeResult'] is True
+
+
+def test_cli_flow(emulator):
+
+    tokens = emulator.sign_in('appleUserID', 'Apple:::' + apple_token(RSA_KEY_1), srp=False)
+    assert 'AccessToken' in tokens
+
+
+def test_wrong_answer(emulator):
+
+    with pytest.raises(NotAuthorizedException):
+        _ = emulator.sign_in('appleUserID', 'Facebook:::' + apple_token(RSA_KEY_1))
+
+
+def test_unknown_user(client_id, key_cache):
+
+    emulator = CognitoEmulator(app.lambda_handler, users={'appleUserID': {'sub': 'appleUserID'}})
+
+    with pytest.raises(UserLambdaValidationException) as e:
+        _ = emulator.initiate_auth('someoneElse')
+    assert '[USER_NOT_FOUND]' in str(e.value)
+
+
+def test_load_test(emulator):
+
+    answers = ['Apple:::' + apple_token(RSA_KEY_1, nonce=str(i)) for i in range(40)]
+    answers[0] = 'Apple:::' + apple_token(RSA_KEY_2)
+
+    stats = load_test(emulator, answers, concurrency=8)
+
+    assert stats['sign_ins'] == 40
+    assert stats['failures'] == 1
+    assert stats['sign_ins_per_sec'] > 0
+    assert stats['p50_ms'] <= stats['p99_ms']
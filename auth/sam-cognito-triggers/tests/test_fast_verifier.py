@@ -0,0 +1,108 @@
+from time import time
+import asyncio
+import base64
+import json
+
+import pytest
+from pytest_mock import mocker
+from jwcrypto import jwk
+
+from utils import jwt_apple, jwt_apple_async
+from tools.fake_apple import RSA_KEY_1, RSA_KEY_2, jwks, apple_token
+
+EC_KEY = jwk.JWK.generate(kty='EC', crv='P-256', kid='ec1')
+
+
+@pytest.fixture()
+def loaded_keys(key_cache):
+    """ Apple key cache loaded with the fake Apple keys, and an EC key """
+
+    key_cache.load(jwks([RSA_KEY_1, RSA_KEY_2, EC_KEY]))
+    return key_cache
+
+
+def test_rs256_does_not_use_jwcrypto(loaded_keys, mocker):
+
+    token = apple_token(RSA_KEY_1, email='c4kp2nq8nx@privaterelay.appleid.com')
+    fallback = mocker.patch('utils.jwt_apple.jwt.JWT')
+
+    claims = jwt_apple.decode_apple_user_token(token)
+
+    assert claims['email'] == 'c4kp2nq8nx@privaterelay.appleid.com'
+    assert fallback.call_count == 0
+
+
+def test_invalid_signature(loaded_keys):
+
+    # signed by key2 but pretending to be signed by key1
+    (header, _, _) = apple_token(RSA_KEY_1).split('.')
+    (_, claims, signature) = apple_token(RSA_KEY_2).split('.')
+
+    with pytest.raises(Exception) as e:
+        _ = jwt_apple.decode_apple_user_token(f'{header}.{claims}.{signature}')
+    assert 'invalid signature' in str(e.value)
+
+
+@pytest.mark.parametrize('claims, error', [
+    ({'exp_in': -3600}, 'Token expired'),
+    ({'iat': 99999999999}, 'Token not yet valid'),
+    ({'nbf_in': 3600}, 'Token not yet valid'),
+    ({'nbf': 'tomorrow'}, 'Token has an invalid claim'),
+    ({'iss': 'https://accounts.google.com'}, 'Not an Apple JWT token'),
+    ({'exp': 'tomorrow'}, 'Token has an invalid claim'),
+])
+def test_invalid_claims(loaded_keys, claims, error):
+
+    if 'nbf_in' in claims:
+        claims = {'nbf': int(time()) + claims['nbf_in']}
+    with pytest.raises(Exception) as e:
+        _ = jwt_apple.decode_apple_user_token(apple_token(RSA_KEY_1, **claims))
+    assert error in str(e.value)
+
+
+def test_audience(loaded_keys, mocker):
+
+    mocker.patch.object(jwt_apple, 'APPLE_AUDIENCE', ['com.stormacq.app.memories.Memories'])
+
+    with pytest.raises(Exception) as e:
+        _ = jwt_apple.decode_apple_user_token(apple_token(RSA_KEY_1))
+    assert 'not issued for this app' in str(e.value)
+
+    claims = jwt_apple.decode_apple_user_token(apple_token(RSA_KEY_1, aud='com.stormacq.app.memories.Memories'))
+    assert claims['aud'] == 'com.stormacq.app.memories.Memories'
+
+
+def test_other_algorithms_fall_back_to_jwcrypto(loaded_keys, mocker):
+
+    token = apple_token(RSA_KEY_2, alg='PS256')
+    fallback = mocker.spy(jwt_apple.jwt, 'JWT')
+
+    claims = jwt_apple.decode_apple_user_token(token)
+
+    assert claims['iss'] == 'https://appleid.apple.com'
+    assert fallback.call_count == 1
+
+
+def test_rs256_with_a_key_of_another_type(loaded_keys):
+
+    # RS256 announced, with the kid of an EC key
+    (header, claims, signature) = apple_token(RSA_KEY_1).split('.')
+    header = base64.urlsafe_b64encode(json.dumps({'alg': 'RS256', 'kid': 'ec1'}).encode()).rstrip(b'=').decode()
+    token = f'{header}.{claims}.{signature}'
+
+    with pytest.raises(jwt_apple.TokenError) as e:
+        jwt_apple.decode_apple_user_token(token)
+    assert e.value.code == 'INVALID_KEY'
+
+    jwt_apple.REJECTION_CACHE.clear()
+    with pytest.raises(jwt_apple.TokenError) as e:
+        asyncio.run(jwt_apple_async.decode_apple_user_token(token))
+    assert e.value.code == 'INVALID_KEY'
+
+
+def test_es256_still_verified_by_jwcrypto(loaded_keys):
+
+    claims = jwt_apple.decode_apple_user_token(apple_token(EC_KEY, alg='ES256'))
+    assert claims['iss'] == 'https://appleid.apple.com'
+    jwt_apple.TOKEN_CACHE.clear()
+    assert asyncio.run(jwt_apple_async.decode_apple_user_token(apple_token(EC_KEY, alg='ES256')))
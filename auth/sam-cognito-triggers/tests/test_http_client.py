@@ -0,0 +1,94 @@
+from time import time
+
+import pytest
+import requests
+from pytest_mock import mocker
+
+from utils import http_client, jwks
+
+
+def test_connections_are_reused(jwks_server):
+
+    for _ in range(3):
+        response = http_client.get(jwks_server.url)
+        assert len(response.json()['keys']) == 2
+
+    assert jwks_server.requests == 3
+    assert len(set(jwks_server.client_ports)) == 1
+
+
+def test_read_timeout(jwks_server, mocker):
+
+    mocker.patch.object(http_client, 'READ_TIMEOUT', 0.1)
+    jwks_server.delay = 0.5
+
+    start = time()
+    with pytest.raises(requests.Timeout):
+        _ = http_client.get(jwks_server.url, retries=0)
+    assert time() - start < 0.4
+
+
+def test_deadline_bounds_retries(jwks_server, mocker):
+
+    mocker.patch.object(http_client, 'READ_TIMEOUT', 0.2)
+    mocker.patch.object(http_client, 'DEADLINE', 0.5)
+    jwks_server.delay = 0.3
+
+    start = time()
+    with pytest.raises(requests.Timeout):
+        _ = http_client.get(jwks_server.url, retries=10)
+    assert time() - start < 0.9
+
+
+def test_server_errors_are_retried(jwks_server):
+
+    jwks_server.errors = [503, 500]
+
+    response = http_client.get(jwks_server.url)
+
+    assert response.status_code == 200
+    assert jwks_server.requests == 3
+
+
+def test_client_errors_are_not_retried(jwks_server):
+
+    jwks_server.errors = [404]
+
+    with pytest.raises(requests.HTTPError):
+        _ = http_client.get(jwks_server.url)
+    assert jwks_server.requests == 1
+
+
+def test_circuit_breaker(jwks_server, mocker):
+
+    jwks_server.errors = [503] * 100
+
+    for _ in range(http_client.BREAKER_THRESHOLD):
+        with pytest.raises(requests.HTTPError):
+            _ = http_client.get(jwks_server.url, retries=0)
+
+    # the circuit is open, the server is not called anymore
+    with pytest.raises(http_client.CircuitOpenError):
+        _ = http_client.get(jwks_server.url)
+    assert jwks_server.requests == http_client.BREAKER_THRESHOLD
+
+    # after the reset timeout, one call goes through and closes the circuit
+    jwks_server.errors = []
+    mocker.patch('utils.http_client.time', return_value=time() + http_client.BREAKER_RESET_TIMEOUT)
+    assert http_client.get(jwks_server.url).status_code == 200
+    assert http_client.get(jwks_server.url).status_code == 200
+
+
+def test_key_cache_falls_back_when_provider_is_slow(jwks_server, mocker):
+
+    cache = jwks.KeyCache(jwks_server.url)
+    cache.refresh()
+    assert sorted(cache.keys) == ['key1', 'key2']
+
+    mocker.patch.object(http_client, 'READ_TIMEOUT', 0.1)
+    mocker.patch.object(http_client, 'RETRIES', 0)
+    jwks_server.delay = 0.5
+
+    # unknown kid: the refresh times out, and the cached keys are still used
+    assert cache.get('key3') is None
+    assert cache.get('key1') is not None
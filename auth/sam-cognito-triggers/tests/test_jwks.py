@@ -0,0 +1,161 @@
+import json
+from time import time
+
+import pytest
+from pytest_mock import mocker
+
+from utils import jwks, jwt_apple
+from tools.fake_apple import RSA_KEY_1, RSA_KEY_2, FakeResponse, apple_token
+
+
+def test_keys_are_indexed_by_kid(key_cache, mocker):
+
+    get = mocker.patch('utils.jwks.http_client.get', return_value=FakeResponse([RSA_KEY_1, RSA_KEY_2]))
+
+    claims = jwt_apple.decode_apple_user_token(apple_token(RSA_KEY_2))
+    assert claims['iss'] == 'https://appleid.apple.com'
+
+    claims = jwt_apple.decode_apple_user_token(apple_token(RSA_KEY_1))
+    assert claims['iss'] == 'https://appleid.apple.com'
+
+    assert sorted(key_cache.keys) == ['key1', 'key2']
+    assert get.call_count == 1
+
+
+def test_cache_control_max_age(key_cache, mocker):
+
+    mocker.patch('utils.jwks.http_client.get', return_value=FakeResponse([RSA_KEY_1], 'public, max-age=120'))
+    key_cache.refresh()
+    assert key_cache.expires_at - key_cache.fetched_at == 120
+
+    # not refreshed more often than min_refresh_interval
+    mocker.patch('utils.jwks.http_client.get', return_value=FakeResponse([RSA_KEY_1], 'no-store'))
+    key_cache.refresh()
+    assert key_cache.expires_at - key_cache.fetched_at == jwks.MIN_REFRESH_INTERVAL
+
+    mocker.patch('utils.jwks.http_client.get', return_value=FakeResponse([RSA_KEY_1], 'max-age=0'))
+    key_cache.refresh()
+    assert key_cache.expires_at - key_cache.fetched_at == jwks.MIN_REFRESH_INTERVAL
+
+    mocker.patch('utils.jwks.http_client.get', return_value=FakeResponse([RSA_KEY_1], ''))
+    key_cache.refresh()
+    assert key_cache.expires_at - key_cache.fetched_at == jwks.DEFAULT_MAX_AGE
+
+
+def test_stale_keys_are_served_while_refreshing(key_cache, mocker):
+
+    key_cache.load(FakeResponse([RSA_KEY_1]).payload, fetched_at=time() - jwks.DEFAULT_MAX_AGE - 1)
+    refresh = mocker.patch.object(key_cache, '_refresh_in_background')
+    get = mocker.patch('utils.jwks.http_client.get')
+
+    claims = jwt_apple.decode_apple_user_token(apple_token(RSA_KEY_1))
+
+    assert claims['sub'] == '001870.e6c20667df3c4b12ab923e3c9043caa4.1316'
+    assert refresh.call_count == 1
+    assert get.call_count == 0
+
+
+def test_unknown_kid_forces_refresh(key_cache, mocker):
+
+    key_cache.load(FakeResponse([RSA_KEY_1]).payload)
+    get = mocker.patch('utils.jwks.http_client.get', return_value=FakeResponse([RSA_KEY_1, RSA_KEY_2]))
+
+    claims = jwt_apple.decode_apple_user_token(apple_token(RSA_KEY_2))
+
+    assert claims['iss'] == 'https://appleid.apple.com'
+    assert get.call_count == 1
+
+
+def test_forced_refresh_minimum_interval(key_cache, mocker):
+
+    key_cache.load(FakeResponse([RSA_KEY_1]).payload)
+    get = mocker.patch('utils.jwks.http_client.get', return_value=FakeResponse([RSA_KEY_1]))
+
+    for _ in range(5):
+        with pytest.raises(Exception) as e:
+            _ = jwt_apple.decode_apple_user_token(apple_token(RSA_KEY_2))
+        assert 'no matching Key ID' in str(e.value)
+
+    assert get.call_count == 1
+
+
+def test_no_cache_keys_are_not_refreshed_on_each_invocation(key_cache, mocker):
+
+    get = mocker.patch('utils.jwks.http_client.get', return_value=FakeResponse([RSA_KEY_1], 'no-cache'))
+    refresh = mocker.patch.object(key_cache, '_refresh_in_background')
+
+    for i in range(5):
+        jwt_apple.decode_apple_user_token(apple_token(RSA_KEY_1, nonce=str(i)))
+
+    assert get.call_count == 1
+    refresh.assert_not_called()
+
+
+def test_forced_refresh_ended_by_another_fetch(key_cache, mocker):
+
+    key_cache.load(FakeResponse([RSA_KEY_1]).payload)
+    get = mocker.patch('utils.jwks.http_client.get', return_value=FakeResponse([RSA_KEY_1]))
+    stale_fetched_at = key_cache.fetched_at
+    now = time()
+
+    assert key_cache._force_refresh(now) is True
+    # the keys were refreshed between the caller reading fetched_at and its refresh
+    key_cache.load(FakeResponse([RSA_KEY_1]).payload, fetched_at=stale_fetched_at + 1)
+    key_cache.refresh(stale_fetched_at)
+
+    assert key_cache._forced_refresh_pending is False
+    assert key_cache._force_refresh(now + 1) is False
+    assert get.call_count == 0
+
+
+def test_flight_timeout_is_below_the_function_timeout():
+
+    assert jwks.http_client.DEADLINE < jwks.FLIGHT_TIMEOUT < 3
+
+
+def test_refresh_writes_snapshot(tmp_path, mocker):
+
+    snapshot = tmp_path / 'jwks.json'
+    cache = jwks.KeyCache('https://appleid.apple.com/auth/keys', snapshot_path=str(snapshot))
+    mocker.patch('utils.jwks.http_client.get', return_value=FakeResponse([RSA_KEY_1]))
+
+    cache.refresh()
+
+    content = json.loads(snapshot.read_text())
+    assert content['fetched_at'] == cache.fetched_at
+    assert content['expires_at'] == cache.expires_at
+    assert content['jwks']['keys'][0]['kid'] == 'key1'
+
+
+def test_cold_start_from_snapshot(tmp_path, mocker):
+
+    snapshot = tmp_path / 'jwks.json'
+    warm = jwks.KeyCache('https://appleid.apple.com/auth/keys')
+    warm.load(FakeResponse([RSA_KEY_1]).payload)
+    warm.save_snapshot(str(snapshot))
+
+    cold = jwks.KeyCache('https://appleid.apple.com/auth/keys', bundled_snapshot_path=str(snapshot))
+    mocker.patch.object(jwt_apple, 'APPLE_KEYS', cold)
+    get = mocker.patch('utils.jwks.http_client.get')
+
+    claims = jwt_apple.decode_apple_user_token(apple_token(RSA_KEY_1))
+
+    assert claims['iss'] == 'https://appleid.apple.com'
+    assert get.call_count == 0
+
+
+def test_stale_snapshot_is_served_while_refreshing(tmp_path, mocker):
+
+    old, new = tmp_path / 'old.json', tmp_path / 'new.json'
+    stale = jwks.KeyCache('https://appleid.apple.com/auth/keys')
+    stale.load(FakeResponse([RSA_KEY_1]).payload, fetched_at=time() - 2 * jwks.DEFAULT_MAX_AGE)
+    stale.save_snapshot(str(old))
+    stale.load(FakeResponse([RSA_KEY_1, RSA_KEY_2]).payload, fetched_at=time() - jwks.DEFAULT_MAX_AGE - 1)
+    stale.save_snapshot(str(new))
+
+    cold = jwks.KeyCache('https://appleid.apple.com/auth/keys', snapshot_path=str(old), bundled_snapshot_path=str(new))
+    refresh = mocker.patch.object(cold, '_refresh_in_background')
+
+    # the most recent snapshot wins, and its keys are used despite being stale
+    assert cold.get('key2') is not None
+    assert refresh.call_count == 1
@@ -0,0 +1,100 @@
+import json
+import os
+
+import pytest
+from pytest_mock import mocker
+
+from src import app
+from utils import log
+
+
+@pytest.fixture()
+def cognito_create_auth_challenge():
+    """ Generates Cognito Create Auth Challenge Event"""
+
+    return {
+        "version": "1",
+        "region": "eu-central-1",
+        "userPoolId": "eu-central-1_5J1OjXlBa",
+        "userName": "username",
+        "callerContext": {
+            "awsSdkVersion": "aws-sdk-unknown-unknown",
+            "clientId": "1irha5mrk1jjp86ikl7bhkj7gf"
+        },
+        "triggerSource": "CreateAuthChallenge_Authentication",
+        "request": {
+            "userAttributes": {
+                "sub": "95d7645e-fab5-42ba-99e5-dfc4338f7916",
+                "email_verified": "true",
+                "email": "username@email.com"
+            },
+            "challengeName": "CUSTOM_CHALLENGE",
+            "session": [],
+            "userNotFound": False
+        },
+        "response": {}
+    }
+
+
+def log_lines(capsys):
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+
+def test_one_line_per_invocation(client_id, cognito_create_auth_challenge, capsys, mocker):
+
+    mocker.patch.object(log, 'LEVEL', log.INFO)
+    mocker.patch.object(log, 'SAMPLE_RATE', 0)
+
+    _ = app.lambda_handler(cognito_create_auth_challenge, "")
+
+    lines = log_lines(capsys)
+    assert len(lines) == 1
+    assert lines[0]['msg'] == 'invocation'
+    assert lines[0]['trigger'] == 'CreateAuthChallenge_Authentication'
+    assert lines[0]['outcome'] == 'ok'
+    assert lines[0]['latency_ms'] >= 0
+    assert 'event' not in lines[0]
+
+
+def test_error_class_is_logged(cognito_create_auth_challenge, capsys, mocker):
+
+    mocker.patch.dict(os.environ, {'COGNITO_CLIENT_ID': 'another client'})
+    mocker.patch.object(log, 'LEVEL', log.ERROR)
+
+    with pytest.raises(Exception):
+        _ = app.lambda_handler(cognito_create_auth_challenge, "")
+
+    lines = log_lines(capsys)
+    assert len(lines) == 1
+    assert lines[0]['outcome'] == 'error'
+    assert lines[0]['error'] == 'Exception'
+
+
+def test_sampled_payloads_are_redacted(client_id, cognito_create_auth_challenge, capsys, mocker):
+
+    mocker.patch.object(log, 'LEVEL', log.INFO)
+    mocker.patch.object(log, 'SAMPLE_RATE', 1)
+
+    _ = app.lambda_handler(cognito_create_auth_challenge, "")
+
+    lines = log_lines(capsys)
+    assert lines[0]['event']['request']['userAttributes']['email'] == log.REDACTED
+    assert lines[0]['event']['response'] == {}
+    assert lines[0]['response']['challengeMetadata'] == 'IDP_TOKEN'
+
+    # the event returned to Cognito is not redacted
+    assert cognito_create_auth_challenge['request']['userAttributes']['email'] == 'username@email.com'
+
+
+def test_nothing_is_formatted_when_disabled(client_id, cognito_create_auth_challenge, capsys, mocker):
+
+    mocker.patch.object(log, 'LEVEL', log.WARNING)
+    emit = mocker.spy(log, '_emit')
+    redact = mocker.spy(log, 'redact')
+
+    _ = app.lambda_handler(cognito_create_auth_challenge, "")
+    log.debug('not formatted', claims={'email': 'username@email.com'})
+
+    assert emit.call_count == 0
+    assert redact.call_count == 0
+    assert capsys.readouterr().out == ''
@@ -0,0 +1,89 @@
+import pytest
+from pytest_mock import mocker
+
+from src import app
+from utils import metrics
+from tools.fake_apple import RSA_KEY_1, jwks, apple_token
+
+
+@pytest.fixture()
+def cognito_verify_auth_challenge():
+    """ Generates Cognito Verify Auth Challenge Event"""
+
+    return {
+        "version": "1",
+        "region": "eu-central-1",
+        "userPoolId": "eu-central-1_5J1OjXlBa",
+        "userName": "username2",
+        "callerContext": {
+            "awsSdkVersion": "aws-sdk-unknown-unknown",
+            "clientId": "1irha5mrk1jjp86ikl7bhkj7gf"
+        },
+        "triggerSource": "VerifyAuthChallengeResponse_Authentication",
+        "request": {
+            "userAttributes": {},
+            "privateChallengeParameters": {},
+            "challengeAnswer": "",
+            "userNotFound": False
+        },
+        "response": {
+            "answerCorrect": None
+        }
+    }
+
+
+@pytest.fixture()
+def records(client_id, key_cache, mocker):
+    """ Enables metrics, and collects the EMF records """
+
+    mocker.patch.object(metrics, 'ENABLED', True)
+    key_cache.load(jwks([RSA_KEY_1]))
+
+    records = []
+    mocker.patch.object(metrics, 'SINK', records.append)
+    return records
+
+
+def test_verify_stages(cognito_verify_auth_challenge, records):
+
+    cognito_verify_auth_challenge['request']['challengeAnswer'] = 'Apple:::' + apple_token(RSA_KEY_1)
+    _ = app.lambda_handler(cognito_verify_auth_challenge, "")
+
+    assert len(records) == 1
+    record = records[0]
+    assert record['trigger'] == 'VerifyAuthChallengeResponse_Authentication'
+    assert record['outcome'] == 'ok'
+    assert record['token_cache_miss'] == 1
+    for stage in ('client_id', 'key_lookup', 'signature', 'claims'):
+        assert record[f'stage_{stage}'] >= 0
+
+    emf = record['_aws']['CloudWatchMetrics'][0]
+    assert emf['Dimensions'] == [['trigger']]
+    names = [m['Name'] for m in emf['Metrics']]
+    assert 'latency' in names
+    assert 'stage_signature' in names
+    assert 'token_cache_miss' in names
+
+
+def test_rejection_reason(cognito_verify_auth_challenge, records):
+
+    cognito_verify_auth_challenge['request']['challengeAnswer'] = 'Apple:::' + apple_token(RSA_KEY_1, exp_in=-3600)
+
+    for _ in range(2):
+        with pytest.raises(Exception):
+            _ = app.lambda_handler(cognito_verify_auth_challenge, "")
+
+    assert [r['outcome'] for r in records] == ['error', 'error']
+    assert [r['rejection_reason'] for r in records] == ['Token expired', 'Token expired']
+    assert records[1]['token_cache_hit'] == 1
+
+
+def test_disabled(cognito_verify_auth_challenge, records, mocker):
+
+    mocker.patch.object(metrics, 'ENABLED', False)
+
+    cognito_verify_auth_challenge['request']['challengeAnswer'] = 'Apple:::' + apple_token(RSA_KEY_1)
+    _ = app.lambda_handler(cognito_verify_auth_challenge, "")
+
+    assert records == []
+    assert metrics.stage('signature') is metrics._NULL_STAGE
@@ -0,0 +1,204 @@
+import json
+import os
+
+import pytest
+from pytest_mock import mocker
+
+from src import app
+from utils import log, migration
+from tools import provision_users
+from tools.local_cognito import LocalCognito
+from tools.local_dynamodb import LocalDynamoDB
+
+TABLE = 'legacy_users'
+USER_POOL_ID = 'eu-central-1_5J1OjXlBa'
+
+
+def migration_event(trigger='UserMigration_Authentication', user_name='legacy', password='secret'):
+    request = {'validationData': None, 'clientMetadata': {}}
+    if trigger == 'UserMigration_Authentication':
+        request['password'] = password
+    return {
+        'version': '1',
+        'region': 'eu-central-1',
+        'userPoolId': USER_POOL_ID,
+        'userName': user_name,
+        'callerContext': {'awsSdkVersion': 'aws-sdk-unknown-unknown', 'clientId': '1irha5mrk1jjp86ikl7bhkj7gf'},
+        'triggerSource': trigger,
+        'request': request,
+        'response': {'userAttributes': None, 'finalUserStatus': None, 'messageAction': None}
+    }
+
+
+@pytest.fixture()
+def legacy_users(client_id, mocker):
+    """ Legacy backend with one user, migration enabled """
+
+    mocker.patch.dict(os.environ, {'LEGACY_USERS_TABLE': TABLE})
+    dynamodb = LocalDynamoDB({TABLE: 'pk'})
+    dynamodb.put_item(TableName=TABLE, Item={
+        'pk': {'S': 'legacy'}, 'email': {'S': 'legacy@example.com'}, 'given_name': {'S': 'Legacy'},
+        'password_hash': {'S': migration.hash_password('secret', b'salt', iterations=1000)}
+    })
+    migration.get_store()._client = dynamodb
+    return dynamodb
+
+
+@pytest.fixture()
+def users_file(client_id, tmp_path):
+    """ Ten users to import, and a blank line. The pool calls the PreSignUp trigger of the app """
+
+    path = tmp_path / 'users.jsonl'
+    lines = [json.dumps({'username': f'user-{i}', 'attributes': {'email': f'user-{i}@example.com'}})
+             for i in range(10)]
+    path.write_text('\n'.join(lines[:5] + [''] + lines[5:]) + '\n')
+    return str(path)
+
+
+def test_migration(legacy_users):
+
+    result = app.lambda_handler(migration_event(), None)
+
+    assert result['response']['userAttributes'] == {'email': 'legacy@example.com', 'given_name': 'Legacy',
+                                                    'email_verified': 'true'}
+    assert result['response']['finalUserStatus'] == 'CONFIRMED'
+    assert result['response']['messageAction'] == 'SUPPRESS'
+
+
+def test_forgot_password_migration(legacy_users):
+
+    result = app.lambda_handler(migration_event('UserMigration_ForgotPassword'), None)
+    assert result['response']['finalUserStatus'] == 'CONFIRMED'
+
+
+def test_wrong_password(legacy_users):
+
+    with pytest.raises(migration.InvalidPassword):
+        app.lambda_handler(migration_event(password='guess'), None)
+
+
+def test_password_is_never_logged(legacy_users, capsys, mocker):
+
+    # DEBUG logs the full payloads of every invocation
+    mocker.patch.object(log, 'LEVEL', log.DEBUG)
+
+    app.lambda_handler(migration_event(), None)
+    with pytest.raises(migration.InvalidPassword):
+        app.lambda_handler(migration_event(password='hunter2'), None)
+
+    out = capsys.readouterr().out
+    assert '"password":"***"' in out
+    assert 'secret' not in out and 'hunter2' not in out
+
+
+def test_unknown_user(legacy_users):
+
+    with pytest.raises(Exception) as e:
+        app.lambda_handler(migration_event(user_name='stranger'), None)
+    assert '[USER_NOT_FOUND]' in str(e.value)
+
+
+def test_migration_disabled(client_id):
+
+    with pytest.raises(Exception) as e:
+        app.lambda_handler(migration_event(), None)
+    assert '[USER_NOT_FOUND]' in str(e.value)
+
+
+def test_provision(users_file):
+
+    cognito = LocalCognito(USER_POOL_ID, pre_signup=app.lambda_handler)
+    stats = provision_users.provision(cognito, USER_POOL_ID, users_file, batch_size=3, concurrency=4)
+
+    assert (stats['created'], stats['existing'], stats['failed']) == (10, 0, 0)
+    assert cognito.users['user-7']['attributes'] == {'email': 'user-7@example.com'}
+    assert cognito.users['user-7']['message_action'] == 'SUPPRESS'
+    # as the users signing up through the app: no NEW_PASSWORD_REQUIRED challenge
+    assert {user['status'] for user in cognito.users.values()} == {'CONFIRMED'}
+
+
+def test_provision_finishes_existing_users(users_file):
+
+    cognito = LocalCognito(USER_POOL_ID, pre_signup=app.lambda_handler)
+    # created by an interrupted run, and a user confirmed already
+    cognito.admin_create_user(UserPoolId=USER_POOL_ID, Username='user-3')
+    cognito.admin_create_user(UserPoolId=USER_POOL_ID, Username='user-4')
+    cognito.admin_set_user_password(UserPoolId=USER_POOL_ID, Username='user-4', Password='p', Permanent=True)
+    cognito.calls = 0
+
+    stats = provision_users.provision(cognito, USER_POOL_ID, users_file, concurrency=1)
+
+    assert (stats['created'], stats['existing']) == (8, 2)
+    assert {user['status'] for user in cognito.users.values()} == {'CONFIRMED'}
+    # create and set the password for the new users, create, get (and set for user-3) for the others
+    assert cognito.calls == 8 * 2 + 2 * 2 + 1
+
+
+def test_provision_with_throttling(users_file):
+
+    cognito = LocalCognito(USER_POOL_ID, throttle_every=3, pre_signup=app.lambda_handler)
+    stats = provision_users.provision(cognito, USER_POOL_ID, users_file, concurrency=4, backoff=0)
+
+    assert stats['created'] == 10
+    assert stats['throttled'] == cognito.throttled > 0
+    assert {user['status'] for user in cognito.users.values()} == {'CONFIRMED'}
+
+
+def test_provision_resumes(users_file, mocker):
+
+    cognito = LocalCognito(USER_POOL_ID, pre_signup=app.lambda_handler)
+    # the run stops in the middle of the second batch
+    create_user = provision_users.create_user
+    calls = []
+
+    def interrupted(client, *args):
+        calls.append(args)
+        if len(calls) == 6:
+            raise KeyboardInterrupt()
+        return create_user(client, *args)
+
+    mocker.patch.object(provision_users, 'create_user', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        provision_users.provision(cognito, USER_POOL_ID, users_file, batch_size=4, concurrency=1)
+    assert provision_users.read_checkpoint(users_file + '.checkpoint') == 4
+
+    mocker.stopall()
+    stats = provision_users.provision(cognito, USER_POOL_ID, users_file, batch_size=4, concurrency=1)
+
+    assert stats['skipped'] == 4
+    # user-4 and user-6 were created by the interrupted batch
+    assert (stats['created'], stats['existing']) == (4, 2)
+    assert len(cognito.users) == 10
+
+
+def test_provision_without_pre_signup_trigger(users_file, mocker):
+
+    mocker.patch.dict(app.TRIGGERS)
+    del app.TRIGGERS['PreSignUp_AdminCreateUser']
+    cognito = LocalCognito(USER_POOL_ID, pre_signup=app.lambda_handler)
+
+    stats = provision_users.provision(cognito, USER_POOL_ID, users_file)
+
+    # the unhandled trigger answers without a response, Cognito refuses the users
+    assert stats['failed'] == 10
+    assert cognito.users == {}
+    with open(users_file + '.failed') as f:
+        assert all('InvalidLambdaResponseException' in json.loads(line)['error'] for line in f)
+
+
+def test_provision_failures(users_file):
+
+    stats = provision_users.provision(LocalCognito('another pool'), USER_POOL_ID, users_file)
+
+    assert stats['failed'] == 10
+    with open(users_file + '.failed') as f:
+        failures = [json.loads(line) for line in f]
+    assert 'does not exist' in failures[0]['error']
+
+
+def test_pooled_client():
+
+    client = provision_users.new_client(concurrency=32, region='eu-central-1')
+
+    assert client.meta.config.max_pool_connections == 32
+    assert client.meta.config.retries['total_max_attempts'] == 1
@@ -0,0 +1,95 @@
+import base64
+import json
+
+import pytest
+from pytest_mock import mocker
+
+from src import app
+from utils import jwt_apple
+from tests.conftest import verify_event
+from tools.fake_apple import RSA_KEY_1, RSA_KEY_2, apple_token, jwks
+
+
+def b64(data):
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b'=').decode()
+
+
+def forged_token(header):
+    return f"{b64(header)}.{b64({'iss': 'https://appleid.apple.com'})}.c2lnbmF0dXJl"
+
+
+@pytest.fixture()
+def apple_keys(apple_keys):
+    """ The Apple key cache of conftest with the first key only, the server publishes both """
+
+    apple_keys.load(jwks([RSA_KEY_1]))
+    return apple_keys
+
+
+@pytest.mark.parametrize('token,code', [
+    ('a' * (jwt_apple.MAX_TOKEN_SIZE + 1), 'TOKEN_TOO_LARGE'),
+    ('not a token', 'INVALID_TOKEN'),
+    ('a.b', 'INVALID_TOKEN'),
+    ('a.b.c.d', 'INVALID_TOKEN'),
+    ('e30.e30.e30=', 'INVALID_TOKEN'),
+    ('bm90IGpzb24.e30.e30', 'INVALID_TOKEN'),
+    (forged_token({'alg': 'none', 'kid': 'key1'}), 'INVALID_ALGORITHM'),
+    (forged_token({'alg': 'HS256', 'kid': 'key1'}), 'INVALID_ALGORITHM'),
+    (forged_token({'alg': 'RS256'}), 'MISSING_KID'),
+    (forged_token({'alg': 'RS256', 'kid': 'k' * 1000}), 'INVALID_KID'),
+])
+def test_rejected_before_verification(key_cache, mocker, token, code):
+
+    verify = mocker.spy(jwt_apple, '_decode_apple_user_token')
+
+    with pytest.raises(jwt_apple.TokenError) as e:
+        jwt_apple.decode_apple_user_token(token)
+
+    assert e.value.code == code
+    verify.assert_not_called()
+    # nothing cached, nothing fetched
+    assert jwt_apple.REJECTION_CACHE.stats()['size'] == 0
+    assert key_cache.fetch_count == 0
+
+
+def test_unknown_kid_refreshes_once(apple_keys, jwks_server):
+
+    for i in range(20):
+        with pytest.raises(jwt_apple.TokenError) as e:
+            jwt_apple.decode_apple_user_token(forged_token({'alg': 'RS256', 'kid': 'rotated'}))
+        assert e.value.code == 'UNKNOWN_KID'
+
+    # one forced refresh, then the kid is known to be unknown
+    assert jwks_server.requests == 1
+    assert apple_keys.is_unknown('rotated')
+
+
+def test_new_kid_accepted_after_refresh(apple_keys, jwks_server):
+
+    # key2 is published by the server, but not in cache yet
+    claims = jwt_apple.decode_apple_user_token(apple_token(RSA_KEY_2))
+
+    assert claims['iss'] == 'https://appleid.apple.com'
+    assert not apple_keys.is_unknown('key2')
+
+
+def test_garbage_does_not_evict_verified_tokens(apple_keys, mocker):
+
+    mocker.patch.object(jwt_apple, 'TOKEN_CACHE', jwt_apple.TTLCache(10, jwt_apple.TOKEN_CACHE_TTL))
+
+    token = apple_token(RSA_KEY_1)
+    jwt_apple.decode_apple_user_token(token)
+
+    for i in range(100):
+        with pytest.raises(jwt_apple.TokenError):
+            jwt_apple.decode_apple_user_token(apple_token(RSA_KEY_1, iss=f'https://issuer{i}.example.com'))
+
+    verify = mocker.spy(jwt_apple, '_decode_apple_user_token')
+    jwt_apple.decode_apple_user_token(token)
+    verify.assert_not_called()
+
+
+def test_oversized_answer(client_id):
+
+    result = app.lambda_handler(verify_event('Apple:::' + 'a' * 100000), None)
+    assert result['response']['answerCorrect'] is False
@@ -0,0 +1,66 @@
+import json
+import os
+
+import pytest
+from pytest_mock import mocker
+
+from src import app
+from utils import profiling
+from tests.conftest import verify_event
+from tools.fake_apple import RSA_KEY_1, jwks, apple_token
+
+
+@pytest.fixture()
+def profiled(client_id, key_cache, mocker, tmp_path):
+    """ Every invocation profiled, profiles written in a temporary directory """
+
+    mocker.patch.object(profiling, 'SAMPLE_RATE', 1.0)
+    mocker.patch.object(profiling, 'DIRECTORY', str(tmp_path))
+    mocker.patch.object(profiling, 'written', 0)
+    key_cache.load(jwks([RSA_KEY_1]))
+    return tmp_path
+
+
+def test_profile_written(profiled, capsys):
+
+    app.lambda_handler(verify_event('Apple:::' + apple_token(RSA_KEY_1)), None)
+
+    files = sorted(os.listdir(profiled))
+    assert [os.path.splitext(f)[1] for f in files] == ['.collapsed', '.prof']
+    assert files[0].startswith('VerifyAuthChallengeResponse_Authentication-')
+
+    # one line per stack, the verification is under the handler
+    with open(profiled / files[0]) as f:
+        stacks = f.read().splitlines()
+    assert all(line.rsplit(' ', 1)[1].isdigit() for line in stacks)
+    assert any(line.startswith('app.py') and '_decode_apple_user_token' in line for line in stacks)
+
+    summary = [json.loads(line) for line in capsys.readouterr().out.splitlines() if 'Profile written' in line]
+    assert len(summary) == 1
+    assert len(summary[0]['slowest']) == profiling.SUMMARY_SIZE
+
+
+def test_profiles_are_limited(profiled, mocker):
+
+    mocker.patch.object(profiling, 'MAX_FILES', 2)
+    for _ in range(5):
+        app.lambda_handler(verify_event('Apple:::' + apple_token(RSA_KEY_1)), None)
+
+    assert len(os.listdir(profiled)) == 4
+
+
+def test_profile_triggers(profiled, mocker):
+
+    mocker.patch.object(profiling, 'TRIGGERS', frozenset(['PreSignUp_SignUp']))
+    app.lambda_handler(verify_event('Apple:::' + apple_token(RSA_KEY_1)), None)
+
+    assert os.listdir(profiled) == []
+
+
+def test_disabled_by_default(client_id, key_cache, mocker):
+
+    start = mocker.spy(profiling, 'start')
+    key_cache.load(jwks([RSA_KEY_1]))
+
+    app.lambda_handler(verify_event('Apple:::' + apple_token(RSA_KEY_1)), None)
+    start.assert_not_called()
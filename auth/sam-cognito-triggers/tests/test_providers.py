@@ -0,0 +1,179 @@
+from time import time
+import asyncio
+import json
+import os
+
+import pytest
+from pytest_mock import mocker
+
+from src import app
+from utils import jwt_apple, jwt_apple_async, providers
+from utils.providers import Provider
+from tests.conftest import load_event, run_async, verify_event
+from tools.fake_apple import RSA_KEY_1, RSA_KEY_2, JWKSServer, jwks, apple_token
+
+GOOGLE_CLIENT_ID = '1234-abcd.apps.googleusercontent.com'
+
+
+def google_token(key=RSA_KEY_2, **claims):
+    return apple_token(key, **{'iss': 'https://accounts.google.com', 'aud': GOOGLE_CLIENT_ID, **claims})
+
+
+@pytest.fixture()
+def google_server():
+    """ Local server publishing the fake Google keys, and their discovery document """
+
+    server = JWKSServer([RSA_KEY_2], issuer='https://accounts.google.com').start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture()
+def google(google_server):
+    """ A Google provider, finding its keys through the discovery document """
+
+    return Provider('Google', providers.GOOGLE_ISSUERS, [GOOGLE_CLIENT_ID], discovery_url=google_server.discovery_url)
+
+
+@pytest.fixture()
+def two_providers(client_id, apple_keys, google_server, mocker, tmp_path):
+    """ Apple and Google accepted by the triggers """
+
+    mocker.patch.dict(os.environ, {'ID_PROVIDERS': 'Apple,Google', 'GOOGLE_AUDIENCE': GOOGLE_CLIENT_ID})
+    mocker.patch.object(providers, 'GOOGLE_DISCOVERY_URL', google_server.discovery_url)
+    mocker.patch.object(providers, 'GOOGLE_KEY_SNAPSHOT', str(tmp_path / 'google_jwks.json'))
+    mocker.patch.dict(providers.PROVIDERS)
+
+
+def test_discovery_is_cached(google, google_server):
+
+    for i in range(5):
+        claims = jwt_apple.decode_token(google_token(nonce=str(i)), google)
+        assert claims['aud'] == GOOGLE_CLIENT_ID
+
+    assert google_server.discovery_requests == 1
+    assert google_server.requests == 1
+    assert google.keys.url == google_server.url
+
+
+def test_stale_discovery_is_refreshed_in_the_background(google, google_server):
+
+    jwt_apple.decode_token(google_token(nonce='1'), google)
+    google.discovery_expires_at = 0
+    # below the read timeout of http_client, the discovery is not retried
+    google_server.delay = 0.5
+
+    # the cached jwks_uri is used, verifications do not wait for the discovery document
+    start = time()
+    jwt_apple.decode_token(google_token(nonce='2'), google)
+    jwt_apple.decode_token(google_token(nonce='3'), google)
+    assert time() - start < 0.25
+
+    google._background_discovery.join()
+    assert google_server.discovery_requests == 2
+    assert google.discovery_expires_at > time()
+
+
+def test_audience_list(google):
+
+    claims = jwt_apple.decode_token(google_token(aud=['another client', GOOGLE_CLIENT_ID]), google)
+    assert GOOGLE_CLIENT_ID in claims['aud']
+
+
+@pytest.mark.parametrize('claims,code', [
+    ({'iss': 'https://appleid.apple.com'}, 'INVALID_ISSUER'),
+    ({'aud': 'another client'}, 'INVALID_AUDIENCE'),
+])
+def test_provider_rules(google, claims, code):
+
+    with pytest.raises(jwt_apple.TokenError) as e:
+        jwt_apple.decode_token(google_token(**claims), google)
+    assert e.value.code == code
+
+
+def test_token_cache_per_provider(google, apple_keys):
+
+    token = apple_token(RSA_KEY_2)
+
+    assert jwt_apple.decode_apple_user_token(token)['iss'] == 'https://appleid.apple.com'
+    # verified for Apple, still not a Google token
+    with pytest.raises(jwt_apple.TokenError) as e:
+        jwt_apple.decode_token(token, google)
+    assert e.value.code == 'INVALID_ISSUER'
+    assert 'Not a Google JWT token' in str(e.value)
+
+
+def test_oidc_providers_from_configuration(client_id, apple_keys, google_server, mocker):
+
+    definition = {'name': 'Corporate', 'issuer': 'https://sso.example.com', 'audiences': ['memories'],
+                  'jwks_uri': google_server.url}
+    mocker.patch.dict(os.environ, {'ID_PROVIDERS': 'Apple,Corporate', 'OIDC_PROVIDERS': json.dumps([definition])})
+    mocker.patch.dict(providers.PROVIDERS)
+
+    token = apple_token(RSA_KEY_2, iss='https://sso.example.com', aud='memories')
+    result = app.lambda_handler(verify_event('Corporate:::' + token), None)
+
+    assert result['response']['answerCorrect'] is True
+    # no discovery needed, the keys location is known
+    assert google_server.discovery_requests == 0
+
+
+def test_handler_accepts_configured_providers(two_providers):
+
+    assert app.lambda_handler(verify_event('Apple:::' + apple_token(RSA_KEY_1)), None)['response']['answerCorrect']
+    assert app.lambda_handler(verify_event('Google:::' + google_token()), None)['response']['answerCorrect']
+    assert app.lambda_handler(verify_event('Facebook:::' + google_token()), None)['response']['answerCorrect'] is False
+
+    create = app.lambda_handler(load_event('create_auth_challenge'), None)
+    assert create['response']['publicChallengeParameters']['providers'] == 'Apple, Google'
+
+
+def test_google_not_configured(client_id, key_cache, mocker):
+
+
+    result = app.lambda_handler(verify_event('Google:::' + google_token()), None)
+    assert result['response']['answerCorrect'] is False
+
+
+@pytest.mark.parametrize('environ', [
+    {'ID_PROVIDERS': 'Apple,Google'},
+    {'ID_PROVIDERS': 'Apple,Corporate', 'OIDC_PROVIDERS': json.dumps([{'name': 'Corporate',
+                                                                       'issuer': 'https://sso.example.com'}])},
+])
+def test_providers_without_audience_are_refused(client_id, apple_keys, environ, mocker):
+
+    mocker.patch.dict(os.environ, environ)
+    mocker.patch.dict(providers.PROVIDERS)
+
+    # any client of the provider could sign in: fail closed
+    with pytest.raises(ValueError) as e:
+        app.lambda_handler(verify_event('Apple:::' + apple_token(RSA_KEY_1)), None)
+    assert 'has no audiences' in str(e.value)
+
+
+def test_prefetch(two_providers, jwks_server, google_server):
+
+    ready = providers.prefetch()
+
+    assert sorted(ready) == ['Apple', 'Google']
+    assert jwks_server.requests == 1
+    assert google_server.requests == 1
+
+    # invocations find the keys in memory
+    app.lambda_handler(verify_event('Apple:::' + apple_token(RSA_KEY_1)), None)
+    app.lambda_handler(verify_event('Google:::' + google_token()), None)
+    assert jwks_server.requests == 1
+    assert google_server.requests == 1
+    assert google_server.discovery_requests == 1
+
+
+def test_async_discovery(google, google_server):
+
+    async def run():
+        return await asyncio.gather(*[jwt_apple_async.decode_token(google_token(nonce=str(i)), google)
+                                      for i in range(50)])
+
+    claims = run_async(run())
+
+    assert len(claims) == 50
+    assert google_server.requests == 1
@@ -0,0 +1,164 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import os
+
+import pytest
+from pytest_mock import mocker
+
+from src import app
+from utils import jwt_apple, rate_limit
+from utils.rate_limit import DynamoDBStore, MemoryStore, TieredStore
+from tests.conftest import load_event, verify_event
+from tools.fake_apple import RSA_KEY_1, jwks, apple_token
+from tools.local_dynamodb import LocalDynamoDB
+
+TABLE = 'rate_limit'
+
+
+def attempt(answer, **fields):
+    # answerCorrect, False for the answers rejected with an error
+    try:
+        return app.lambda_handler(verify_event(answer, **fields), None)['response']['answerCorrect']
+    except jwt_apple.TokenError:
+        return False
+
+
+@pytest.fixture()
+def dynamodb():
+    """ Local stand-in for the rate limit table """
+
+    return LocalDynamoDB({TABLE: 'pk'})
+
+
+@pytest.fixture()
+def limited(client_id, key_cache, mocker):
+    """ Three attempts per user and per minute, per container """
+
+    mocker.patch.dict(os.environ, {'RATE_LIMIT_STORE': 'memory', 'RATE_LIMIT_ATTEMPTS': '3', 'RATE_LIMIT_WINDOW': '60'})
+    key_cache.load(jwks([RSA_KEY_1]))
+
+
+def test_memory_store():
+
+    store = MemoryStore(capacity=2, window=60)
+    assert [store.take('a', now=1000) for _ in range(3)] == [True, True, False]
+    # other users have their own bucket
+    assert store.take('b', now=1000) is True
+
+    # one token back every 30 seconds
+    assert store.take('a', now=1029) is False
+    assert store.take('a', now=1030) is True
+    assert store.take('a', now=1030) is False
+
+
+def test_memory_store_look_does_not_take():
+
+    store = MemoryStore(capacity=1, window=60)
+    assert store.take('a', cost=0) is True
+    assert store.take('a', cost=0) is True
+    assert store.take('a') is True
+    assert store.take('a', cost=0) is False
+
+
+def test_memory_store_is_bounded():
+
+    store = MemoryStore(capacity=5, window=60, maxsize=100)
+    for i in range(10000):
+        store.take(str(i))
+
+    assert len(store.buckets) == 100
+
+
+def test_dynamodb_store(dynamodb):
+
+    store = DynamoDBStore(TABLE, capacity=2, window=60, client=dynamodb)
+    assert [store.take('a', now=1000) for _ in range(3)] == [True, True, False]
+    assert store.take('a', now=1030) is True
+
+    item = dynamodb.get_item(TableName=TABLE, Key={'pk': {'S': 'a'}})['Item']
+    # empty bucket, full again in 60 seconds
+    assert float(item['tokens']['N']) == 0
+    assert int(item['expires_at']['N']) == 1091
+
+
+def test_dynamodb_store_concurrent_takes(dynamodb):
+
+    store = DynamoDBStore(TABLE, capacity=10, window=3600, client=dynamodb)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: store.take('a'), range(40)))
+
+    # never more than the capacity, conflicts retried or refused
+    assert 0 < results.count(True) <= 10
+
+
+def test_tiered_store_shared_across_containers(dynamodb):
+
+    first = TieredStore(MemoryStore(2, 60), DynamoDBStore(TABLE, 2, 60, dynamodb))
+    second = TieredStore(MemoryStore(2, 60), DynamoDBStore(TABLE, 2, 60, dynamodb))
+
+    assert first.take('a', now=1000) is True
+    assert second.take('a', now=1000) is True
+    assert first.take('a', now=1000) is False
+    assert second.take('a', now=1000) is False
+
+
+def test_tiered_store_local_rejection(dynamodb):
+
+    store = TieredStore(MemoryStore(2, 60), DynamoDBStore(TABLE, 2, 60, dynamodb))
+    for _ in range(10):
+        store.take('a', now=1000)
+
+    # 2 reads and writes, then the local bucket is empty
+    assert dynamodb.calls == 4
+
+
+def test_verify_rejects_before_verification(limited, mocker):
+
+    verify = mocker.spy(jwt_apple, 'decode_token')
+
+    assert [attempt('Apple:::garbage') for _ in range(5)] == [False] * 5
+    assert verify.call_count == 3
+
+    # the limit is per user
+    token = apple_token(RSA_KEY_1)
+    assert attempt('Apple:::' + token) is False
+    assert attempt('Apple:::' + token, userName='someone else') is True
+
+
+def test_define_fails_authentication_over_limit(limited):
+
+    for _ in range(3):
+        attempt('Apple:::garbage')
+
+    result = app.lambda_handler(load_event('define_auth_cli', userName='username2'), None)
+
+    assert result['response']['failAuthentication'] is True
+    assert result['response']['issueTokens'] is False
+
+
+def test_define_issues_tokens_after_last_attempt(limited):
+
+    for _ in range(2):
+        attempt('Apple:::garbage')
+    assert attempt('Apple:::' + apple_token(RSA_KEY_1)) is True
+
+    # the bucket is empty, the correct answer still signs the user in
+    result = app.lambda_handler(load_event('define_auth_succeeded', userName='username2'), None)
+
+    assert result['response']['issueTokens'] is True
+
+
+def test_async_handler_with_dynamodb(client_id, key_cache, dynamodb, mocker):
+
+    mocker.patch.dict(os.environ, {'RATE_LIMIT_STORE': 'dynamodb', 'RATE_LIMIT_TABLE': TABLE, 'RATE_LIMIT_ATTEMPTS': '3'})
+    key_cache.load(jwks([RSA_KEY_1]))
+    rate_limit.get_store().shared._client = dynamodb
+
+    async def run():
+        return await asyncio.gather(*[app.lambda_handler_async(verify_event('Apple:::' + apple_token(RSA_KEY_1)))
+                                      for _ in range(10)])
+
+    results = asyncio.run(run())
+
+    assert [r['response']['answerCorrect'] for r in results].count(True) == 3
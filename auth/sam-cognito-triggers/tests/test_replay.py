@@ -0,0 +1,154 @@
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+import asyncio
+import json
+import os
+
+import pytest
+from pytest_mock import mocker
+
+from src import app
+from utils import jwt_apple, replay
+from utils.replay import DynamoDBStore, MemoryStore, TieredStore
+from tests.conftest import verify_event
+from tools.fake_apple import RSA_KEY_1, jwks, apple_token
+from tools.local_dynamodb import LocalDynamoDB
+
+TABLE = 'replay'
+
+
+@pytest.fixture()
+def dynamodb():
+    """ Local stand-in for the replay table """
+
+    return LocalDynamoDB({TABLE: 'pk'})
+
+
+@pytest.fixture()
+def memory_store(client_id, key_cache, mocker):
+    """ Replay protection enabled, per container """
+
+    mocker.patch.dict(os.environ, {'REPLAY_STORE': 'memory'})
+    key_cache.load(jwks([RSA_KEY_1]))
+
+
+def test_memory_store():
+
+    store = MemoryStore(maxsize=2)
+    assert store.add('a', time() + 60) is True
+    assert store.add('a', time() + 60) is False
+
+    # expired entries can be added again
+    assert store.add('b', time() - 1) is True
+    assert store.add('b', time() + 60) is True
+
+
+def test_memory_store_is_bounded():
+
+    store = MemoryStore(maxsize=100)
+    for i in range(10000):
+        store.add(str(i), time() + 60)
+
+    assert len(store.seen) == 100
+
+
+def test_dynamodb_store(dynamodb):
+
+    store = DynamoDBStore(TABLE, dynamodb)
+    assert store.add('a', time() + 60) is True
+    assert store.add('a', time() + 60) is False
+
+    # the item expired, but the table TTL did not delete it yet
+    assert store.add('b', time() - 10) is True
+    assert store.add('b', time() + 60) is True
+    assert dynamodb.get_item(TableName=TABLE, Key={'pk': {'S': 'b'}})['Item']['expires_at']['N'] > str(int(time()))
+
+
+def test_tiered_store_only_calls_dynamodb_once(dynamodb):
+
+    store = TieredStore(MemoryStore(), DynamoDBStore(TABLE, dynamodb))
+    results = [store.add('a', time() + 60) for _ in range(10)]
+
+    assert results == [True] + [False] * 9
+    assert dynamodb.calls == 1
+
+
+def test_tiered_store_shared_across_containers(dynamodb):
+
+    first = TieredStore(MemoryStore(), DynamoDBStore(TABLE, dynamodb))
+    second = TieredStore(MemoryStore(), DynamoDBStore(TABLE, dynamodb))
+
+    assert first.add('a', time() + 60) is True
+    assert second.add('a', time() + 60) is False
+
+
+def test_tiered_store_shared_failure(dynamodb, mocker):
+
+    store = TieredStore(MemoryStore(), DynamoDBStore(TABLE, dynamodb))
+    mocker.patch.object(dynamodb, 'put_item', side_effect=ConnectionError('DynamoDB unreachable'))
+
+    with pytest.raises(ConnectionError):
+        store.add('a', time() + 60)
+
+    # the token was not recorded, a retry is not a replay
+    mocker.stopall()
+    assert store.add('a', time() + 60) is True
+
+
+def test_replay_key():
+
+    assert replay.replay_key('token', {'iss': 'apple', 'sub': 'user', 'nonce': 'n1'}) == 'apple:user:n1'
+    # no nonce, the token itself
+    assert replay.replay_key('token', {'sub': 'user'}) != replay.replay_key('other token', {'sub': 'user'})
+
+
+def test_replayed_token_rejected(memory_store):
+
+    event = verify_event('Apple:::' + apple_token(RSA_KEY_1))
+    assert app.lambda_handler(json.loads(json.dumps(event)), None)['response']['answerCorrect'] is True
+
+    with pytest.raises(jwt_apple.TokenError) as e:
+        app.lambda_handler(event, None)
+    assert e.value.code == 'REPLAYED'
+
+
+def test_replayed_nonce_rejected(memory_store):
+
+    app.lambda_handler(verify_event('Apple:::' + apple_token(RSA_KEY_1, nonce='n1')), None)
+
+    with pytest.raises(jwt_apple.TokenError) as e:
+        app.lambda_handler(verify_event('Apple:::' + apple_token(RSA_KEY_1, exp_in=900, nonce='n1')), None)
+    assert e.value.code == 'REPLAYED'
+
+
+def test_concurrent_replays_accept_one(memory_store):
+
+    token = apple_token(RSA_KEY_1)
+
+    def verify(_):
+        try:
+            return app.lambda_handler(verify_event('Apple:::' + token), None)['response']['answerCorrect']
+        except jwt_apple.TokenError:
+            return False
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        results = list(executor.map(verify, range(64)))
+
+    assert results.count(True) == 1
+
+
+def test_async_handler_with_dynamodb(client_id, key_cache, dynamodb, mocker):
+
+    mocker.patch.dict(os.environ, {'REPLAY_STORE': 'dynamodb', 'REPLAY_TABLE': TABLE})
+    key_cache.load(jwks([RSA_KEY_1]))
+    replay.get_store().shared._client = dynamodb
+    token = apple_token(RSA_KEY_1)
+
+    async def run():
+        return await asyncio.gather(*[app.lambda_handler_async(verify_event('Apple:::' + token)) for _ in range(10)],
+                                    return_exceptions=True)
+
+    results = asyncio.run(run())
+
+    assert len([r for r in results if isinstance(r, dict)]) == 1
+    assert all(r.code == 'REPLAYED' for r in results if isinstance(r, Exception))
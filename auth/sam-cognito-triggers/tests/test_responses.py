@@ -0,0 +1,73 @@
+import copy
+import json
+import os
+
+import pytest
+from pytest_mock import mocker
+
+from src import app
+from utils.responses import Template
+from tests.conftest import load_event
+
+
+
+@pytest.fixture()
+def environment(client_id, mocker):
+    """ Apple and Google accepted by the triggers """
+
+    mocker.patch.dict(os.environ, {'ID_PROVIDERS': 'Apple,Google'})
+
+
+def test_template_is_read_only():
+
+    template = Template({'publicChallengeParameters': {'challenge': 'c'}, 'challengeMetadata': 'IDP_TOKEN'})
+
+    with pytest.raises(TypeError):
+        template.fields['challengeMetadata'] = 'other'
+    with pytest.raises(TypeError):
+        template.fields['publicChallengeParameters']['challenge'] = 'other'
+
+    # each response has its own copy
+    event = template.apply({'response': {}})
+    event['response']['publicChallengeParameters']['challenge'] = 'other'
+    assert template.apply({'response': {}})['response']['publicChallengeParameters']['challenge'] == 'c'
+
+
+@pytest.mark.parametrize('name', ['create_auth_challenge', 'signup'])
+def test_dumps_is_apply(name):
+
+    template = Template({'publicChallengeParameters': {'challenge': 'c'}, 'autoConfirmUser': True})
+    event = load_event(name)
+
+    serialized = template.dumps(event)
+
+    # the event is not modified
+    assert event == load_event(name)
+    assert json.loads(serialized) == template.apply(copy.deepcopy(event))
+    # same result when the serialized response is remembered
+    assert template.dumps(event) == serialized
+
+
+def test_create_response_follows_configuration(environment, mocker):
+
+    result = app.lambda_handler(load_event('create_auth_challenge'), None)
+    assert result['response']['publicChallengeParameters']['providers'] == 'Apple, Google'
+    assert app.create_response() is app.create_response()
+
+    mocker.patch.dict(os.environ, {'ID_PROVIDERS': 'Apple'})
+    app.config.reset()
+    result = app.lambda_handler(load_event('create_auth_challenge'), None)
+    assert result['response']['publicChallengeParameters']['providers'] == 'Apple'
+
+
+@pytest.mark.parametrize('name,trigger', [('create_auth_challenge', None), ('signup', None),
+                                          ('signup', 'PreSignUp_SignUp'), ('define_auth_srpa', None)])
+def test_serialized_handler(environment, name, trigger):
+
+    event = load_event(name)
+    if trigger is not None:
+        event['triggerSource'] = trigger
+
+    serialized = app.lambda_handler_serialized(copy.deepcopy(event), None)
+
+    assert json.loads(serialized) == app.lambda_handler(event, None)
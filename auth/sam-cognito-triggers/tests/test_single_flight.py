@@ -0,0 +1,67 @@
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+import threading
+
+import pytest
+from pytest_mock import mocker
+
+from utils import jwt_apple
+from tools.fake_apple import RSA_KEY_1, RSA_KEY_2, jwks, apple_token
+
+CONCURRENCY = 200
+
+
+def verify_concurrently(tokens):
+    barrier = threading.Barrier(len(tokens))
+
+    def verify(token):
+        barrier.wait()
+        return jwt_apple.decode_apple_user_token(token)
+
+    with ThreadPoolExecutor(max_workers=len(tokens)) as executor:
+        return list(executor.map(verify, tokens))
+
+
+@pytest.fixture()
+def apple_keys(apple_keys, jwks_server):
+    """ The Apple key cache of conftest, on a slow server """
+
+    jwks_server.delay = 0.2
+    return apple_keys
+
+
+def test_cold_cache_fetches_once(apple_keys, jwks_server):
+
+    tokens = [apple_token(RSA_KEY_1, nonce=str(i)) for i in range(CONCURRENCY)]
+
+    claims = verify_concurrently(tokens)
+
+    assert len(claims) == CONCURRENCY
+    assert jwks_server.requests == 1
+    assert apple_keys.fetch_count == 1
+
+
+def test_expired_cache_fetches_once(apple_keys, jwks_server):
+
+    apple_keys.refresh()
+    apple_keys.expires_at = time() - 1
+    tokens = [apple_token(RSA_KEY_1, nonce=str(i)) for i in range(CONCURRENCY)]
+
+    # stale keys are used while the refresh is in flight
+    claims = verify_concurrently(tokens)
+    apple_keys._background_refresh.join()
+
+    assert len(claims) == CONCURRENCY
+    assert jwks_server.requests == 2
+    assert apple_keys.expires_at > time()
+
+
+def test_unknown_kid_fetches_once(apple_keys, jwks_server):
+
+    apple_keys.load(jwks([RSA_KEY_1]))
+    tokens = [apple_token(RSA_KEY_2, nonce=str(i)) for i in range(CONCURRENCY)]
+
+    claims = verify_concurrently(tokens)
+
+    assert len(claims) == CONCURRENCY
+    assert jwks_server.requests == 1
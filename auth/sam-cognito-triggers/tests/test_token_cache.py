@@ -0,0 +1,94 @@
+from time import time
+
+import pytest
+from pytest_mock import mocker
+from jwcrypto import jwk, jwt
+
+from utils import jwt_apple
+from utils.ttl_cache import TTLCache
+
+TESTING_KEY = jwk.JWK(generate='oct', size=256)
+
+
+def signed_token(exp):
+    token = jwt.JWT(header={"alg": "HS256"},
+                    claims={'iss': 'https://appleid.apple.com',
+                            'aud': 'com.stormacq.test',
+                            'exp': exp,
+                            'iat': int(time()),
+                            'sub': '001870.e6c20667df3c4b12ab923e3c9043caa4.1316'})
+    token.make_signed_token(TESTING_KEY)
+    return token.serialize()
+
+
+def test_ttl_cache_lru_eviction():
+
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+
+    # 'b' is the least recently used entry
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.stats() == {'size': 2, 'hits': 3, 'misses': 1}
+
+
+def test_ttl_cache_expiration(mocker):
+
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set('a', 1, ttl=5)
+    cache.set('b', 2, ttl=600)
+    cache.set('c', 3, ttl=-1)
+
+    now = time()
+    mocker.patch('utils.ttl_cache.time', return_value=now + 10)
+    assert cache.get('a') is None
+    assert cache.get('c') is None
+    assert cache.get('b') == 2
+
+    # entry ttl never goes beyond the cache ttl
+    mocker.patch('utils.ttl_cache.time', return_value=now + 61)
+    assert cache.get('b') is None
+
+
+def test_retry_does_not_verify_again(mocker):
+
+    token = signed_token(int(time()) + 600)
+    verify = mocker.spy(jwt_apple, '_decode_apple_user_token')
+
+    for _ in range(3):
+        claims = jwt_apple.decode_apple_user_token(token, TESTING_KEY.export())
+        assert claims['iss'] == 'https://appleid.apple.com'
+
+    assert verify.call_count == 1
+    assert jwt_apple.TOKEN_CACHE.stats()['hits'] == 2
+    assert jwt_apple.TOKEN_CACHE.stats()['misses'] == 1
+
+
+def test_cached_claims_do_not_outlive_token(mocker):
+
+    exp = int(time()) + 30
+    token = signed_token(exp)
+    verify = mocker.spy(jwt_apple, '_decode_apple_user_token')
+    _ = jwt_apple.decode_apple_user_token(token, TESTING_KEY.export())
+
+    # past the token expiration, the token is verified again
+    mocker.patch('utils.ttl_cache.time', return_value=exp + 1)
+    _ = jwt_apple.decode_apple_user_token(token, TESTING_KEY.export())
+    assert verify.call_count == 2
+
+
+def test_rejections_are_cached(mocker):
+
+    token = signed_token(int(time()) - 99999)
+    verify = mocker.spy(jwt_apple, '_decode_apple_user_token')
+
+    for _ in range(3):
+        with pytest.raises(jwt_apple.TokenError) as e:
+            _ = jwt_apple.decode_apple_user_token(token, TESTING_KEY.export())
+        assert 'Token expired' in str(e.value)
+
+    assert verify.call_count == 1
@@ -1,4 +1,5 @@
 import os
+from time import time
 
 import pytest
 from pytest_mock import mocker
@@ -52,8 +53,8 @@ def valid_token():
     token = jwt.JWT(header={"alg": "HS256"},
                     claims={'iss': 'https://appleid.apple.com',
                             'aud': 'com.stormacq.test',
-                            'exp': 1597496987 + 99999999, # very far away in the future
-                            'iat': 1597496387 + 99999999, # very far away in the future
+                            'exp': int(time()) + 600, # valid for the next 10 minutes
+                            'iat': int(time()),
                             'sub': '001870.e6c20667df3c4b12ab923e3c9043caa4.1316', 
                             'c_hash': 'mKb6-O6aDhcLC-Je2lGCcQ', 
                             'email': 'c4kp2nq8nx@privaterelay.appleid.com', 
@@ -0,0 +1,44 @@
+import pytest
+from pytest_mock import mocker
+
+from src import app
+from utils import jwt_apple
+from tests.conftest import verify_event
+from tools.fake_apple import RSA_KEY_1, apple_token
+
+pytestmark = pytest.mark.usefixtures('client_id')
+
+
+def test_warmup(apple_keys, jwks_server, mocker):
+
+    verify = mocker.spy(jwt_apple, '_verify_signature')
+    report = app.prefetch_keys()
+
+    assert report['providers'] == ['Apple']
+    assert report['warmed'] == ['Apple']
+    assert report['over_budget'] is False
+    assert verify.call_count == 1
+    # the dummy token is not cached
+    assert jwt_apple.REJECTION_CACHE.stats()['size'] == 0
+
+    event = verify_event('Apple:::' + apple_token(RSA_KEY_1))
+    assert app.lambda_handler(event, None)['response']['answerCorrect'] is True
+    assert jwks_server.requests == 1
+
+
+def test_warmup_over_budget(apple_keys, jwks_server, capsys):
+
+    report = app.prefetch_keys(budget_ms=0)
+
+    assert report['over_budget'] is True
+    assert report['warmed'] == []
+    assert 'Warmup over budget' in capsys.readouterr().out
+
+
+def test_warmup_without_keys(key_cache):
+
+    report = app.prefetch_keys()
+
+    assert report['providers'] == []
+    assert report['warmed'] == []
+    assert jwt_apple.warm_up() is False
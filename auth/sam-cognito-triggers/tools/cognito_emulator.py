@@ -0,0 +1,216 @@
+# Local emulator of the Cognito CUSTOM_AUTH flow, and a load generator on top of it
+#
+# The emulator plays Cognito's part: it builds the trigger events, grows the
+# session list after each challenge and calls the handler for each step, like
+#
+#   InitiateAuth           -> DefineAuthChallenge -> CreateAuthChallenge
+#   RespondToAuthChallenge -> VerifyAuthChallengeResponse -> DefineAuthChallenge
+#
+# Amplify starts the flow with an SRP_A step, the AWS CLI with an empty session.
+#
+#   make loadtest
+#   (or PYTHONPATH=src python -m tools.cognito_emulator --users 1000 --concurrency 16)
+
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+import argparse
+import os
+import sys
+
+USER_POOL_ID = 'eu-central-1_5J1OjXlBa'
+CLIENT_ID = '1irha5mrk1jjp86ikl7bhkj7gf'
+REGION = 'eu-central-1'
+
+# Cognito gives up after this many custom challenges
+MAX_CHALLENGES = 3
+
+
+class NotAuthorizedException(Exception):
+    pass
+
+
+class UserLambdaValidationException(Exception):
+    # the handler raised, Cognito returns its message to the client
+    pass
+
+
+class Challenge:
+    # what RespondToAuthChallenge needs, Cognito keeps it server side
+
+    def __init__(self, user_name, session, parameters, private_parameters, metadata):
+        self.user_name = user_name
+        self.session = session
+        self.parameters = parameters
+        self.private_parameters = private_parameters
+        self.metadata = metadata
+
+
+class CognitoEmulator:
+
+    def __init__(self, handler, users=None, user_pool_id=USER_POOL_ID, client_id=CLIENT_ID):
+        # users: user name -> attributes, None when every user exists
+        self.handler = handler
+        self.users = users
+        self.user_pool_id = user_pool_id
+        self.client_id = client_id
+
+    def _event(self, trigger, user_name, request, response):
+        return {
+            'version': '1',
+            'region': REGION,
+            'userPoolId': self.user_pool_id,
+            'userName': user_name,
+            'callerContext': {
+                'awsSdkVersion': 'aws-sdk-unknown-unknown',
+                'clientId': self.client_id
+            },
+            'triggerSource': trigger,
+            'request': request,
+            'response': response
+        }
+
+    def _invoke(self, event):
+        try:
+            return self.handler(event, None)
+        except Exception as e:
+            raise UserLambdaValidationException(str(e))
+
+    def _user(self, user_name):
+        if self.users is None:
+            return ({'sub': user_name, 'email_verified': 'true'}, False)
+        if user_name not in self.users:
+            return ({}, True)
+        return (self.users[user_name], False)
+
+    def _define(self, user_name, session):
+        (attributes, not_found) = self._user(user_name)
+        event = self._event('DefineAuthChallenge_Authentication', user_name,
+                            {'userAttributes': attributes, 'session': session, 'userNotFound': not_found},
+                            {'challengeName': None, 'issueTokens': None, 'failAuthentication': None})
+        return self._invoke(event)['response']
+
+    def _create(self, user_name, session, challenge_name):
+        (attributes, not_found) = self._user(user_name)
+        event = self._event('CreateAuthChallenge_Authentication', user_name,
+                            {'userAttributes': attributes, 'challengeName': challenge_name,
+                             'session': session, 'userNotFound': not_found},
+                            {'publicChallengeParameters': None, 'privateChallengeParameters': None,
+                             'challengeMetadata': None})
+        return self._invoke(event)['response']
+
+    def _verify(self, challenge, answer):
+        (attributes, not_found) = self._user(challenge.user_name)
+        event = self._event('VerifyAuthChallengeResponse_Authentication', challenge.user_name,
+                            {'userAttributes': attributes,
+                             'privateChallengeParameters': challenge.private_parameters,
+                             'challengeAnswer': answer, 'userNotFound': not_found},
+                            {'answerCorrect': None})
+        return self._invoke(event)['response']
+
+    def _next_step(self, user_name, session):
+        # ask DefineAuthChallenge what to do: issue tokens, fail, or present a new challenge
+        response = self._define(user_name, session)
+
+        if response.get('issueTokens') is True:
+            return {'AccessToken': f'access-token-{user_name}', 'IdToken': f'id-token-{user_name}'}
+
+        if response.get('failAuthentication') is True or response.get('challengeName') != 'CUSTOM_CHALLENGE':
+            raise NotAuthorizedException('Incorrect username or password.')
+
+        challenges = [s for s in session if s['challengeName'] == 'CUSTOM_CHALLENGE']
+        if len(challenges) >= MAX_CHALLENGES:
+            raise NotAuthorizedException('Incorrect username or password.')
+
+        response = self._create(user_name, session, 'CUSTOM_CHALLENGE')
+        return Challenge(user_name, session,
+                         response['publicChallengeParameters'],
+                         response['privateChallengeParameters'],
+                         response['challengeMetadata'])
+
+    def initiate_auth(self, user_name, srp=True):
+        # Amplify sends SRP_A first, the AWS CLI starts with an empty session
+        session = []
+        if srp:
+            session.append({'challengeName': 'SRP_A', 'challengeResult': True, 'challengeMetadata': None})
+        return self._next_step(user_name, session)
+
+    def respond_to_auth_challenge(self, challenge, answer):
+        response = self._verify(challenge, answer)
+        session = challenge.session + [{
+            'challengeName': 'CUSTOM_CHALLENGE',
+            'challengeResult': response['answerCorrect'] is True,
+            'challengeMetadata': challenge.metadata
+        }]
+        return self._next_step(challenge.user_name, session)
+
+    def sign_in(self, user_name, answer, srp=True):
+        # the whole flow, returns the tokens or raises
+        challenge = self.initiate_auth(user_name, srp)
+        if not isinstance(challenge, Challenge):
+            return challenge
+        return self.respond_to_auth_challenge(challenge, answer)
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def load_test(emulator, answers, concurrency, srp=True):
+    # answers: one challenge answer per sign-in, each sign-in uses its own user
+    def sign_in(i):
+        start = perf_counter()
+        try:
+            emulator.sign_in(f'user-{i}', answers[i], srp)
+            ok = True
+        except (NotAuthorizedException, UserLambdaValidationException):
+            ok = False
+        return (ok, perf_counter() - start)
+
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(sign_in, range(len(answers))))
+    elapsed = perf_counter() - start
+
+    latencies = sorted(latency for (_, latency) in results)
+    return {
+        'sign_ins': len(results),
+        'failures': len([ok for (ok, _) in results if not ok]),
+        'sign_ins_per_sec': round(len(results) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p90_ms': round(percentile(latencies, 0.90) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the Cognito custom auth flow, locally')
+    parser.add_argument('--users', type=int, default=1000, help='number of sign-ins')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--cli', action='store_true', help='start flows with an empty session, like the AWS CLI')
+    args = parser.parse_args(argv)
+
+    import app
+    from utils import jwt_apple, log
+    from utils.jwks import KeyCache
+    from tools.fake_apple import RSA_KEY_1, JWKSServer, apple_token
+
+    os.environ['COGNITO_CLIENT_ID'] = CLIENT_ID
+    log.LEVEL = log.WARNING
+
+    server = JWKSServer([RSA_KEY_1]).start()
+    try:
+        jwt_apple.APPLE_KEYS = KeyCache(server.url)
+        print(f'Signing {args.users} Apple tokens')
+        answers = [f'Apple:::{apple_token(RSA_KEY_1, nonce=str(i))}' for i in range(args.users)]
+
+        stats = load_test(CognitoEmulator(app.lambda_handler), answers, args.concurrency, srp=not args.cli)
+    finally:
+        server.stop()
+
+    for (name, value) in stats.items():
+        print(f'{name:>18} : {value}')
+    return 0 if stats['failures'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
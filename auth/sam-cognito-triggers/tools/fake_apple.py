@@ -0,0 +1,114 @@
+# A fake Apple identity provider, for tests, benchmarks and local runs: RSA keys,
+# JWKS, identity tokens and a local server publishing the keys
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep, time
+import json
+import threading
+
+from jwcrypto import jwk, jwt
+
+RSA_KEY_1 = jwk.JWK.generate(kty='RSA', size=2048, kid='key1')
+RSA_KEY_2 = jwk.JWK.generate(kty='RSA', size=2048, kid='key2')
+
+
+def jwks(keys):
+    return {'keys': [json.loads(k.export_public()) for k in keys]}
+
+
+class FakeResponse:
+
+    def __init__(self, keys, cache_control='max-age=3600'):
+        self.payload = jwks(keys)
+        self.headers = {'Cache-Control': cache_control}
+
+    def json(self):
+        return self.payload
+
+    def raise_for_status(self):
+        pass
+
+
+def apple_token(key, exp_in=600, alg='RS256', **claims):
+    token = jwt.JWT(header={"alg": alg, "kid": key.get("kid")},
+                    claims={'iss': 'https://appleid.apple.com',
+                            'aud': 'com.stormacq.test',
+                            'exp': int(time()) + exp_in,
+                            'iat': int(time()),
+                            'sub': '001870.e6c20667df3c4b12ab923e3c9043caa4.1316',
+                            **claims})
+    token.make_signed_token(key)
+    return token.serialize()
+
+
+class JWKSServer:
+    # local HTTP server publishing the JWKS, with injectable latency and errors,
+    # and an OpenID discovery document pointing to it
+
+    def __init__(self, keys, cache_control='max-age=3600', issuer='https://appleid.apple.com'):
+        self.body = json.dumps(jwks(keys)).encode()
+        self.issuer = issuer
+        self.discovery_requests = 0
+        self.cache_control = cache_control
+        self.delay = 0
+        self.errors = []
+        self.requests = 0
+        self.client_ports = []
+        self._lock = threading.Lock()
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_port}/auth/keys'
+        self.discovery_url = f'http://127.0.0.1:{self.server.server_port}/.well-known/openid-configuration'
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # headers and body are sent separately, avoid the delayed ACK stall
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                if self.path.endswith('/openid-configuration'):
+                    return self._discovery()
+
+                with stub._lock:
+                    stub.requests += 1
+                    stub.client_ports.append(self.client_address[1])
+                    status = stub.errors.pop(0) if stub.errors else 200
+
+                sleep(stub.delay)
+
+                body = stub.body if status == 200 else b'{}'
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('Cache-Control', stub.cache_control)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _discovery(self):
+                with stub._lock:
+                    stub.discovery_requests += 1
+                sleep(stub.delay)
+                body = json.dumps({'issuer': stub.issuer, 'jwks_uri': stub.url}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('Cache-Control', stub.cache_control)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
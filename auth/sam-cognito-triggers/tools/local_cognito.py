@@ -0,0 +1,93 @@
+# In-memory stand-in for the Cognito user pool admin APIs, for tests and local runs
+#
+# Implements the calls tools/provision_users.py makes (admin_create_user,
+# admin_set_user_password, admin_get_user) with the same arguments, errors and user
+# status as boto3: existing users raise UsernameExistsException, unknown ones
+# UserNotFoundException. Created users are FORCE_CHANGE_PASSWORD until they get a
+# permanent password, then CONFIRMED.
+# Throttling is simulated with throttle_every: each n-th call raises
+# TooManyRequestsException, as Cognito does past its admin API quotas.
+# With a pre_signup Lambda handler, admin_create_user invokes it with a
+# PreSignUp_AdminCreateUser event first, as the user pool of app/design.md does:
+# the user is not created when it raises (UserLambdaValidationException) or
+# returns no response (InvalidLambdaResponseException).
+
+import threading
+
+from botocore.exceptions import ClientError
+
+
+def _error(code, message, operation):
+    return ClientError({'Error': {'Code': code, 'Message': message}}, operation)
+
+
+class LocalCognito:
+
+    def __init__(self, user_pool_id, throttle_every=None, pre_signup=None):
+        self.user_pool_id = user_pool_id
+        self.throttle_every = throttle_every
+        self.pre_signup = pre_signup
+        # user name -> {'attributes': {...}, 'status': ...}
+        self.users = {}
+        self.calls = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def _call(self, operation, user_pool_id):
+        # counts the call, raises like Cognito for a wrong pool or over the quota
+        self.calls += 1
+        if user_pool_id != self.user_pool_id:
+            raise _error('ResourceNotFoundException', f'User pool {user_pool_id} does not exist.', operation)
+        if self.throttle_every and self.calls % self.throttle_every == 0:
+            self.throttled += 1
+            raise _error('TooManyRequestsException', 'Too many requests', operation)
+
+    def _pre_signup(self, user_name, attributes):
+        if self.pre_signup is None:
+            return
+        event = {
+            'version': '1',
+            'region': self.user_pool_id.split('_')[0],
+            'userPoolId': self.user_pool_id,
+            'userName': user_name,
+            'callerContext': {'awsSdkVersion': 'aws-sdk-unknown-unknown', 'clientId': 'CLIENT_ID_NOT_APPLICABLE'},
+            'triggerSource': 'PreSignUp_AdminCreateUser',
+            'request': {'userAttributes': dict(attributes), 'validationData': None},
+            'response': {'autoConfirmUser': False, 'autoVerifyEmail': False, 'autoVerifyPhone': False}
+        }
+        try:
+            result = self.pre_signup(event, None)
+        except Exception as e:
+            raise _error('UserLambdaValidationException', f'PreSignUp failed with error {e}.', 'AdminCreateUser')
+        if not isinstance(result, dict) or not isinstance(result.get('response'), dict):
+            raise _error('InvalidLambdaResponseException', 'Invalid lambda response.', 'AdminCreateUser')
+
+    def admin_create_user(self, UserPoolId, Username, UserAttributes=(), MessageAction=None, **_):
+        with self._lock:
+            self._call('AdminCreateUser', UserPoolId)
+            if Username in self.users:
+                raise _error('UsernameExistsException', 'User account already exists', 'AdminCreateUser')
+            attributes = {a['Name']: a['Value'] for a in UserAttributes}
+            self._pre_signup(Username, attributes)
+            self.users[Username] = {'attributes': attributes, 'status': 'FORCE_CHANGE_PASSWORD',
+                                    'message_action': MessageAction}
+        return {'User': {'Username': Username, 'UserStatus': 'FORCE_CHANGE_PASSWORD',
+                         'Attributes': [{'Name': n, 'Value': v} for (n, v) in attributes.items()]}}
+
+    def admin_set_user_password(self, UserPoolId, Username, Password, Permanent=False, **_):
+        with self._lock:
+            self._call('AdminSetUserPassword', UserPoolId)
+            user = self.users.get(Username)
+            if user is None:
+                raise _error('UserNotFoundException', 'User does not exist.', 'AdminSetUserPassword')
+            user['status'] = 'CONFIRMED' if Permanent else 'FORCE_CHANGE_PASSWORD'
+        return {}
+
+    def admin_get_user(self, UserPoolId, Username, **_):
+        with self._lock:
+            self._call('AdminGetUser', UserPoolId)
+            user = self.users.get(Username)
+            if user is None:
+                raise _error('UserNotFoundException', 'User does not exist.', 'AdminGetUser')
+        return {'Username': Username, 'UserStatus': user['status'],
+                'UserAttributes': [{'Name': n, 'Value': v} for (n, v) in user['attributes'].items()]}
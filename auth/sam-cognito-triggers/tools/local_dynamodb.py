@@ -0,0 +1,92 @@
+# In-memory stand-in for the DynamoDB client, for tests and local runs
+#
+# Implements the calls the triggers make (put_item, get_item, delete_item) with
+# the low level attribute value format ({'S': ...}, {'N': ...}), and the condition
+# expressions they use:
+#
+#   attribute_not_exists(pk) OR expires_at < :now
+#
+# i.e. attribute_not_exists(), attribute_exists() and comparisons with a value,
+# joined by AND / OR (AND binds first, no parentheses). Failed conditions raise
+# the same ClientError as boto3.
+
+import re
+import threading
+
+from botocore.exceptions import ClientError
+
+COMPARISON_REGEX = re.compile(r'^(\w+)\s*(<=|>=|<>|<|>|=)\s*(:\w+)$')
+FUNCTION_REGEX = re.compile(r'^(attribute_not_exists|attribute_exists)\((\w+)\)$')
+
+
+def _value(attribute):
+    # {'N': '12'} -> 12.0, {'S': 'a'} -> 'a'
+    ((kind, value),) = attribute.items()
+    return float(value) if kind == 'N' else value
+
+
+def _compare(left, operator, right):
+    if left is None:
+        return False
+    return {
+        '<': left < right, '<=': left <= right,
+        '>': left > right, '>=': left >= right,
+        '=': left == right, '<>': left != right
+    }[operator]
+
+
+def _term(term, item, values):
+    match = FUNCTION_REGEX.match(term)
+    if match is not None:
+        exists = item is not None and match.group(2) in item
+        return exists if match.group(1) == 'attribute_exists' else not exists
+
+    match = COMPARISON_REGEX.match(term)
+    if match is None:
+        raise ValueError(f'Unsupported condition: {term}')
+    (name, operator, placeholder) = match.groups()
+    left = _value(item[name]) if item is not None and name in item else None
+    return _compare(left, operator, _value(values[placeholder]))
+
+
+def evaluate(expression, item, values=None):
+    values = values or {}
+    return any(all(_term(term.strip(), item, values) for term in re.split(r'\s+AND\s+', clause))
+               for clause in re.split(r'\s+OR\s+', expression))
+
+
+class LocalDynamoDB:
+
+    def __init__(self, key_schema):
+        # key_schema: table name -> name of the partition key attribute
+        self.key_schema = key_schema
+        self.tables = {name: {} for name in key_schema}
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _key(self, table_name, item):
+        return _value(item[self.key_schema[table_name]])
+
+    def put_item(self, TableName, Item, ConditionExpression=None, ExpressionAttributeValues=None, **_):
+        with self._lock:
+            self.calls += 1
+            table = self.tables[TableName]
+            key = self._key(TableName, Item)
+            if ConditionExpression is not None and \
+                    not evaluate(ConditionExpression, table.get(key), ExpressionAttributeValues):
+                raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException',
+                                             'Message': 'The conditional request failed'}}, 'PutItem')
+            table[key] = dict(Item)
+        return {}
+
+    def get_item(self, TableName, Key, **_):
+        with self._lock:
+            self.calls += 1
+            item = self.tables[TableName].get(self._key(TableName, Key))
+        return {} if item is None else {'Item': dict(item)}
+
+    def delete_item(self, TableName, Key, **_):
+        with self._lock:
+            self.calls += 1
+            self.tables[TableName].pop(self._key(TableName, Key), None)
+        return {}
@@ -0,0 +1,177 @@
+# Imports the users of the legacy backend into the user pool, offline
+#
+#   PYTHONPATH=src python -m tools.provision_users users.jsonl --user-pool-id eu-central-1_XXXXXXXXX
+#
+# users.jsonl has one user per line: {"username": "...", "attributes": {"email": "...", ...}}
+#
+# - one boto3 client for the whole run, its connection pool sized for --concurrency:
+#   all the threads share the same kept-alive connections
+# - users are created --batch-size at a time, --concurrency calls in flight. The
+#   admin APIs are throttled (TooManyRequestsException): calls are retried with
+#   exponential backoff and full jitter, botocore's own retries are off
+# - after each batch, the number of lines done is written to <users file>.checkpoint,
+#   a new run resumes from there. Users of an interrupted batch are created again,
+#   and counted as existing
+# - users that cannot be created are appended to <users file>.failed, with the error
+# - users are created without invitation (MessageAction SUPPRESS), then given a
+#   random permanent password: they are CONFIRMED, as the users signing up through
+#   the app (PreSignUp). Left in FORCE_CHANGE_PASSWORD, Cognito would answer their
+#   sign-in with NEW_PASSWORD_REQUIRED. They sign in with Apple, the CUSTOM_AUTH
+#   flow never uses the password
+
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from time import perf_counter, sleep
+import argparse
+import json
+import os
+import random
+import secrets
+import sys
+
+from botocore.exceptions import ClientError
+
+BATCH_SIZE = 100
+CONCURRENCY = 8
+RETRIES = 8
+BACKOFF = 0.2
+MAX_BACKOFF = 10
+THROTTLING_ERRORS = frozenset(('TooManyRequestsException', 'ThrottlingException', 'LimitExceededException'))
+
+
+def new_client(concurrency=CONCURRENCY, region=None):
+    # boto3 is only needed by this tool, and the triggers reading DynamoDB
+    import boto3
+    from botocore.config import Config
+
+    config = Config(max_pool_connections=concurrency, retries={'total_max_attempts': 1},
+                    connect_timeout=2, read_timeout=10)
+    return boto3.client('cognito-idp', region_name=region, config=config)
+
+
+def _retry_delay(attempt, backoff):
+    # full jitter: a random delay up to the exponential backoff
+    return random.uniform(0, min(MAX_BACKOFF, backoff * 2 ** attempt))
+
+
+def _with_retries(call, retries=RETRIES, backoff=BACKOFF):
+    # (result of call(), number of throttled calls), raises ClientError for the other errors
+    throttled = 0
+    while True:
+        try:
+            return (call(), throttled)
+        except ClientError as e:
+            if e.response['Error']['Code'] not in THROTTLING_ERRORS or throttled >= retries:
+                raise
+        throttled += 1
+        sleep(_retry_delay(throttled, backoff))
+
+
+def random_password():
+    # never used nor shown, it only makes the user CONFIRMED. One character of
+    # each class, for the password policy of the pool
+    return f'{secrets.token_urlsafe(32)}aA1!'
+
+
+def create_user(client, user_pool_id, user, retries=RETRIES, backoff=BACKOFF):
+    # ('created' or 'existing', number of throttled calls), raises ClientError for the other errors
+    attributes = [{'Name': name, 'Value': str(value)} for (name, value) in user.get('attributes', {}).items()]
+    user_name = user['username']
+
+    def create():
+        try:
+            client.admin_create_user(UserPoolId=user_pool_id, Username=user_name,
+                                     UserAttributes=attributes, MessageAction='SUPPRESS')
+            return 'created'
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'UsernameExistsException':
+                return 'existing'
+            raise
+
+    (outcome, throttled) = _with_retries(create, retries, backoff)
+    if outcome == 'existing':
+        # created by an interrupted run, or by the user: only finish the former
+        (existing, more) = _with_retries(lambda: client.admin_get_user(UserPoolId=user_pool_id, Username=user_name),
+                                         retries, backoff)
+        throttled += more
+        if existing['UserStatus'] != 'FORCE_CHANGE_PASSWORD':
+            return (outcome, throttled)
+
+    (_, more) = _with_retries(lambda: client.admin_set_user_password(UserPoolId=user_pool_id, Username=user_name,
+                                                                     Password=random_password(), Permanent=True),
+                              retries, backoff)
+    return (outcome, throttled + more)
+
+
+def read_checkpoint(path):
+    if not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        return json.load(f)['lines']
+
+
+def write_checkpoint(path, lines):
+    # written next to the file, then renamed: an interrupted run never leaves half a checkpoint
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump({'lines': lines}, f)
+    os.replace(f'{path}.tmp', path)
+
+
+def provision(client, user_pool_id, users_path, batch_size=BATCH_SIZE, concurrency=CONCURRENCY,
+              retries=RETRIES, backoff=BACKOFF):
+    checkpoint_path = f'{users_path}.checkpoint'
+    done = read_checkpoint(checkpoint_path)
+    stats = {'created': 0, 'existing': 0, 'failed': 0, 'throttled': 0, 'skipped': done}
+
+    def create(line):
+        try:
+            user = json.loads(line)
+            (outcome, throttled) = create_user(client, user_pool_id, user, retries, backoff)
+            return (outcome, throttled, None)
+        except Exception as e:
+            return ('failed', 0, {'line': line.rstrip('\n'), 'error': str(e)})
+
+    start = perf_counter()
+    with open(users_path) as users, open(f'{users_path}.failed', 'a') as failures, \
+            ThreadPoolExecutor(max_workers=concurrency) as executor:
+        lines = islice(users, done, None)
+        while True:
+            batch = list(islice(lines, batch_size))
+            if not batch:
+                break
+
+            for (outcome, throttled, failure) in executor.map(create, [line for line in batch if line.strip()]):
+                stats[outcome] += 1
+                stats['throttled'] += throttled
+                if failure is not None:
+                    failures.write(json.dumps(failure) + '\n')
+
+            failures.flush()
+            done += len(batch)
+            write_checkpoint(checkpoint_path, done)
+
+    elapsed = perf_counter() - start
+    imported = stats['created'] + stats['existing']
+    stats['users_per_sec'] = round(imported / elapsed, 1) if elapsed > 0 else 0
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Import legacy users into the Cognito user pool')
+    parser.add_argument('users', help='users file, one JSON object per line')
+    parser.add_argument('--user-pool-id', required=True)
+    parser.add_argument('--region')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY)
+    args = parser.parse_args(argv)
+
+    client = new_client(args.concurrency, args.region)
+    stats = provision(client, args.user_pool_id, args.users, args.batch_size, args.concurrency)
+
+    for (name, value) in stats.items():
+        print(f'{name:>14} : {value}')
+    return 0 if stats['failed'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
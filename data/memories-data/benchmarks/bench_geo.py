@@ -0,0 +1,76 @@
+# Benchmarks the map clusters of GeoIndex, with and without NumPy
+#
+#   make bench
+#   (or PYTHONPATH=src python -m benchmarks.bench_geo --memories 10000)
+#
+# One owner, memories spread around a few cities (where people take pictures),
+# clustered for viewports from the world to a street
+
+from time import perf_counter
+import argparse
+import random
+import sys
+
+from memories import geo
+from memories.geo import GeoIndex
+from memories.model import CoordinateData, MemoryData
+
+CITIES = [(4.35, 50.85), (2.35, 48.86), (-0.13, 51.51), (-73.99, 40.73), (139.69, 35.69), (151.21, -33.87)]
+VIEWPORTS = {
+    'world z2': ((-180, -85, 180, 85), 2),
+    'europe z5': ((-10.0, 36.0, 25.0, 60.0), 5),
+    'city z11': ((4.2, 50.75, 4.5, 50.95), 11),
+    'street z16': ((4.34, 50.84, 4.36, 50.86), 16),
+}
+RUNS = 50
+
+
+def generate(count, seed=42):
+    rng = random.Random(seed)
+    for n in range(count):
+        (longitude, latitude) = rng.choice(CITIES)
+        # most pictures near the center, some on trips around
+        spread = 0.05 if rng.random() < 0.8 else 2.0
+        yield MemoryData('owner', f'{n:010d}', '2023', f'owner/{n}.jpg', rng.randint(0, 5), False, None,
+                         CoordinateData(longitude + rng.gauss(0, spread), latitude + rng.gauss(0, spread)))
+
+
+def measure(index, box, zoom):
+    latencies = []
+    for _ in range(RUNS):
+        start = perf_counter()
+        pins = index.clusters('owner', box, zoom)
+        latencies.append(perf_counter() - start)
+    latencies.sort()
+    return (len(pins), latencies[len(latencies) // 2], latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the map clusters')
+    parser.add_argument('--memories', type=int, default=10000)
+    args = parser.parse_args(argv)
+
+    index = GeoIndex()
+    start = perf_counter()
+    index.load(generate(args.memories))
+    print(f'{len(index)} memories indexed in {(perf_counter() - start) * 1000:.1f} ms')
+
+    numpy = geo.numpy
+    print(f'  {"viewport":<12} {"pins":>6} {"numpy p50 ms":>14} {"p99 ms":>8} {"python p50 ms":>14} {"p99 ms":>8}')
+    for (name, (box, zoom)) in VIEWPORTS.items():
+        results = []
+        for module in (numpy, None):
+            if module is None and numpy is None:
+                continue
+            geo.numpy = module
+            results.append(measure(index, box, zoom))
+        geo.numpy = numpy
+        line = f'  {name:<12} {results[0][0]:>6}'
+        for (_, p50, p99) in results:
+            line += f' {p50 * 1000:>14.2f} {p99 * 1000:>8.2f}'
+        print(line)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,122 @@
+# Benchmarks the list queries of the stores, to size the AppSync / DynamoDB backend
+#
+#   make bench
+#   (or PYTHONPATH=src python -m benchmarks.bench_store --rows 1000000 --owners 1000)
+#
+# Rows are generated, with a skewed number of memories per owner (the owner of
+# rank n has 1/n of the memories of the first one), then each query pages
+# through one owner: the heaviest, and one of median size.
+
+from time import perf_counter
+import argparse
+import random
+import resource
+import sys
+
+from memories.model import CoordinateData, MemoryData
+from memories.store import MemoryStore, SQLiteStore
+from memories.today import TodayFeed
+
+YEARS = [str(year) for year in range(2010, 2024)]
+# pages read per query, the first ones are enough to see the cost of a seek
+MAX_PAGES = 50
+
+
+def generate(rows, owners, seed=42):
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(owners)]
+    names = [f'owner-{rank}' for rank in range(owners)]
+    for owner in rng.choices(names, weights, k=rows):
+        year = rng.choice(YEARS)
+        moment = f'{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}{rng.randrange(240000):06d}'
+        yield MemoryData(owner, moment, year, f'{owner}/{year}{moment}.jpg', rng.randint(0, 5),
+                         rng.random() < 0.1, None, CoordinateData(rng.uniform(-180, 180), rng.uniform(-90, 90)))
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def measure(query):
+    # pages through a query, returns the latency of each page
+    latencies = []
+    next_token = None
+    for _ in range(MAX_PAGES):
+        start = perf_counter()
+        page = query(next_token)
+        latencies.append(perf_counter() - start)
+        next_token = page.next_token
+        if next_token is None:
+            break
+    return sorted(latencies)
+
+
+def run(store, owners, page_size):
+    heaviest = 'owner-0'
+    median = f'owner-{owners // 2}'
+    cases = {
+        'by_owner heaviest': lambda t: store.list_by_owner(heaviest, limit=page_size, next_token=t),
+        'by_owner median': lambda t: store.list_by_owner(median, limit=page_size, next_token=t),
+        'by_owner desc': lambda t: store.list_by_owner(heaviest, limit=page_size, next_token=t, descending=True),
+        'on this day': lambda t: store.list_by_owner(heaviest, moment={'beginsWith': '0308'},
+                                                     limit=page_size, next_token=t),
+        'by_year': lambda t: store.list_by_year(heaviest, '2020', limit=page_size, next_token=t),
+        'favourites': lambda t: store.list_favourites(heaviest, limit=page_size, next_token=t),
+    }
+    for (name, query) in cases.items():
+        latencies = measure(query)
+        print(f'  {name:<20} {len(latencies):>6} {percentile(latencies, 0.5) * 1e6:>10.1f} '
+              f'{percentile(latencies, 0.99) * 1e6:>10.1f}')
+
+
+def run_feed(rows, owners):
+    # the "on this day" lookups of TodayFeed, to compare with the beginsWith queries
+    feed = TodayFeed()
+    start = perf_counter()
+    feed.load(generate(rows, owners))
+    print(f'feed: {len(feed)} rows loaded in {perf_counter() - start:.1f} s')
+    print(f'  {"lookup":<20} {"days":>6} {"p50 us":>10} {"p99 us":>10}')
+
+    days = [f'{month:02d}{day:02d}' for month in range(1, 13) for day in range(1, 29)]
+    for name in ('first (sorts)', 'next'):
+        latencies = []
+        for day in days:
+            start = perf_counter()
+            feed.get('owner-0', day)
+            latencies.append(perf_counter() - start)
+        latencies.sort()
+        print(f'  {name:<20} {len(days):>6} {percentile(latencies, 0.5) * 1e6:>10.1f} '
+              f'{percentile(latencies, 0.99) * 1e6:>10.1f}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the MemoryData stores')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--owners', type=int, default=1000)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--backend', choices=['memory', 'sqlite', 'feed', 'all'], default='all')
+    parser.add_argument('--sqlite-path', default=':memory:')
+    args = parser.parse_args(argv)
+
+    backends = {'memory': MemoryStore, 'sqlite': lambda: SQLiteStore(args.sqlite_path)}
+    for (name, new_store) in backends.items():
+        if args.backend not in (name, 'all'):
+            continue
+
+        store = new_store()
+        start = perf_counter()
+        store.put_many(generate(args.rows, args.owners))
+        elapsed = perf_counter() - start
+        print(f'{name}: {len(store)} rows loaded in {elapsed:.1f} s ({len(store) / elapsed:.0f} rows/s), '
+              f'max RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024} MB')
+        print(f'  {"query":<20} {"pages":>6} {"p50 us":>10} {"p99 us":>10}')
+        run(store, args.owners, args.page_size)
+        del store
+
+    if args.backend in ('feed', 'all'):
+        run_feed(args.rows, args.owners)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
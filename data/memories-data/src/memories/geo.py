@@ -0,0 +1,292 @@
+# Spatial index of the memories coordinates, for MapView: bounding box queries and clusters
+#
+# - memories are indexed on the quadkey of their Web Mercator tile at MAX_ZOOM (about
+#   2 m wide at the equator): the x and y bits of the tile interleaved (Morton order).
+#   A tile at any zoom is a prefix of the quadkeys, i.e. one range of the sorted keys
+# - a bounding box (west, south, east, north) is covered by at most MAX_TILES tiles,
+#   at the finest zoom they fit in: each one is a bisect in the owner's sorted keys,
+#   the memories found are then checked against the box. Boxes crossing the
+#   antimeridian have west > east
+# - clusters(owner, box, zoom) groups the memories in cells of 2^CLUSTER_LEVELS by
+#   2^CLUSTER_LEVELS per map tile (32 pixels on 256 pixel tiles): one pin per cell,
+#   at the centroid of its memories, with their count and the best starred one
+# - NumPy is optional: with it, viewports holding NUMPY_MIN_MEMORIES or more are
+#   clustered on arrays (unique, bincount), rebuilt on the first clustering after a
+#   change. Without it, or for fewer memories, the same clusters are computed in Python
+# - memories without coordinates are not indexed, MapView does not show them either
+
+from bisect import bisect_left, bisect_right
+import math
+
+from memories.stream import INSERT, MODIFY, REMOVE, from_image, keys
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAX_ZOOM = 24
+MAX_LATITUDE = 85.0511287798
+# tiles covering a bounding box, more tiles means fewer memories outside the box to check
+MAX_TILES = 16
+# cells per tile side: 2^3 = 8, 32 pixels on a 256 pixel tile
+CLUSTER_LEVELS = 3
+# below this many memories in the tiles of a viewport, Python clusters them faster than NumPy
+NUMPY_MIN_MEMORIES = 2000
+
+
+def _spread(value):
+    # the bits of a 32 bit value, one every two bits
+    value &= 0xFFFFFFFF
+    value = (value | (value << 16)) & 0x0000FFFF0000FFFF
+    value = (value | (value << 8)) & 0x00FF00FF00FF00FF
+    value = (value | (value << 4)) & 0x0F0F0F0F0F0F0F0F
+    value = (value | (value << 2)) & 0x3333333333333333
+    return (value | (value << 1)) & 0x5555555555555555
+
+
+def tile_x(longitude, zoom):
+    n = 1 << zoom
+    return min(n - 1, max(0, int((longitude + 180) / 360 * n)))
+
+
+def tile_y(latitude, zoom):
+    n = 1 << zoom
+    sin = math.sin(math.radians(min(MAX_LATITUDE, max(-MAX_LATITUDE, latitude))))
+    return min(n - 1, max(0, int((0.5 - math.log((1 + sin) / (1 - sin)) / (4 * math.pi)) * n)))
+
+
+def quadkey(x, y):
+    # Bing quadkey digits: the y bit, then the x bit
+    return (_spread(y) << 1) | _spread(x)
+
+
+def point_key(longitude, latitude):
+    return quadkey(tile_x(longitude, MAX_ZOOM), tile_y(latitude, MAX_ZOOM))
+
+
+def _boxes(box):
+    # one or two boxes (crossing the antimeridian) with west <= east
+    (west, south, east, north) = box
+    if south > north:
+        raise ValueError(f'South {south} is above north {north}')
+    if west > east:
+        return [(west, south, 180.0, north), (-180.0, south, east, north)]
+    return [box]
+
+
+def _ranges(box):
+    # sorted, merged [start, end) ranges of quadkeys of the tiles covering the box
+    (west, south, east, north) = box
+    zoom = 0
+    for candidate in range(MAX_ZOOM + 1):
+        columns = tile_x(east, candidate) - tile_x(west, candidate) + 1
+        rows = tile_y(south, candidate) - tile_y(north, candidate) + 1
+        if columns * rows > MAX_TILES:
+            break
+        zoom = candidate
+
+    shift = 2 * (MAX_ZOOM - zoom)
+    starts = sorted(quadkey(x, y) << shift
+                    for x in range(tile_x(west, zoom), tile_x(east, zoom) + 1)
+                    for y in range(tile_y(north, zoom), tile_y(south, zoom) + 1))
+    ranges = []
+    for start in starts:
+        if ranges and ranges[-1][1] == start:
+            ranges[-1][1] = start + (1 << shift)
+        else:
+            ranges.append([start, start + (1 << shift)])
+    return ranges
+
+
+def _inside(coordinates, box):
+    (west, south, east, north) = box
+    return west <= coordinates.longitude <= east and south <= coordinates.latitude <= north
+
+
+class Cluster:
+    __slots__ = ('longitude', 'latitude', 'count', 'memory')
+
+    def __init__(self, longitude, latitude, count, memory):
+        self.longitude = longitude
+        self.latitude = latitude
+        self.count = count
+        # the best starred memory of the cluster, its image is the pin
+        self.memory = memory
+
+    def to_dict(self):
+        return {'longitude': self.longitude, 'latitude': self.latitude, 'count': self.count,
+                'memory': self.memory.to_dict()}
+
+    def __repr__(self):
+        return f'Cluster({self.longitude}, {self.latitude}, count={self.count})'
+
+
+class _Partition:
+    # the memories of one owner, sorted by quadkey
+
+    def __init__(self):
+        self.keys = []
+        self.items = []
+        # moment -> quadkey
+        self.moments = {}
+        # NumPy arrays of keys, longitudes, latitudes and stars, None after a change
+        self.arrays = None
+
+    def _position(self, key, moment):
+        position = bisect_left(self.keys, key)
+        while self.items[position].moment != moment:
+            position += 1
+        return position
+
+    def remove(self, moment):
+        key = self.moments.pop(moment, None)
+        if key is not None:
+            position = self._position(key, moment)
+            del self.keys[position]
+            del self.items[position]
+            self.arrays = None
+
+    def add(self, item, key):
+        self.remove(item.moment)
+        position = bisect_right(self.keys, key)
+        self.keys.insert(position, key)
+        self.items.insert(position, item)
+        self.moments[item.moment] = key
+        self.arrays = None
+
+    def load(self, items):
+        for item in items:
+            self.moments[item.moment] = point_key(item.coordinates.longitude, item.coordinates.latitude)
+        pairs = sorted(((self.moments[item.moment], item) for item in items), key=lambda pair: pair[0])
+        self.keys = [key for (key, _) in pairs]
+        self.items = [item for (_, item) in pairs]
+        self.arrays = None
+
+    def get_arrays(self):
+        if self.arrays is None:
+            self.arrays = (numpy.array(self.keys, dtype=numpy.uint64),
+                           numpy.array([item.coordinates.longitude for item in self.items]),
+                           numpy.array([item.coordinates.latitude for item in self.items]),
+                           numpy.array([item.star for item in self.items], dtype=numpy.int64))
+        return self.arrays
+
+
+class GeoIndex:
+
+    def __init__(self):
+        # owner -> _Partition
+        self._owners = {}
+
+    def put(self, item):
+        if item.coordinates is None:
+            self.delete(item.owner, item.moment)
+            return
+        key = point_key(item.coordinates.longitude, item.coordinates.latitude)
+        self._owners.setdefault(item.owner, _Partition()).add(item, key)
+
+    def delete(self, owner, moment):
+        partition = self._owners.get(owner)
+        if partition is not None:
+            partition.remove(moment)
+
+    def load(self, items):
+        # bulk load, each owner sorted once. Replaces the memories of the owners loaded
+        owners = {}
+        for item in items:
+            if item.coordinates is not None:
+                owners.setdefault(item.owner, {})[item.moment] = item
+        for (owner, memories) in owners.items():
+            partition = self._owners[owner] = _Partition()
+            partition.load(list(memories.values()))
+
+    def handle(self, event):
+        # Lambda handler of the table stream, as TodayFeed.handle()
+        for record in event['Records']:
+            event_name = record['eventName']
+            if event_name in (INSERT, MODIFY):
+                self.put(from_image(record['dynamodb']['NewImage']))
+            elif event_name == REMOVE:
+                self.delete(*keys(record))
+            else:
+                raise ValueError(f'Unknown stream event {event_name}')
+
+    def query(self, owner, box):
+        # the memories of this owner in the box (west, south, east, north), in quadkey order
+        partition = self._owners.get(owner)
+        if partition is None:
+            return []
+        found = []
+        for box in _boxes(box):
+            for (start, end) in _ranges(box):
+                (low, high) = (bisect_left(partition.keys, start), bisect_left(partition.keys, end))
+                found.extend(item for item in partition.items[low:high] if _inside(item.coordinates, box))
+        return found
+
+    def clusters(self, owner, box, zoom):
+        # the pins of the map at this zoom level, largest clusters first
+        partition = self._owners.get(owner)
+        if partition is None:
+            return []
+        shift = 2 * (MAX_ZOOM - min(MAX_ZOOM, zoom + CLUSTER_LEVELS))
+        # (box, [(low, high) positions of the memories in the tiles covering it]) for each box
+        spans = [(box, [(bisect_left(partition.keys, start), bisect_left(partition.keys, end))
+                        for (start, end) in _ranges(box)]) for box in _boxes(box)]
+        candidates = sum(high - low for (_, box_spans) in spans for (low, high) in box_spans)
+        if numpy is None or candidates < NUMPY_MIN_MEMORIES:
+            return self._clusters(partition, spans, shift)
+        return self._clusters_numpy(partition, spans, shift)
+
+    def _clusters(self, partition, spans, shift):
+        # cell -> [longitude sum, latitude sum, count, best memory]
+        cells = {}
+        for (box, box_spans) in spans:
+            for (low, high) in box_spans:
+                for position in range(low, high):
+                    item = partition.items[position]
+                    coordinates = item.coordinates
+                    if not _inside(coordinates, box):
+                        continue
+                    key = partition.keys[position] >> shift
+                    cell = cells.get(key)
+                    if cell is None:
+                        cells[key] = [coordinates.longitude, coordinates.latitude, 1, item]
+                        continue
+                    cell[0] += coordinates.longitude
+                    cell[1] += coordinates.latitude
+                    cell[2] += 1
+                    if item.star > cell[3].star:
+                        cell[3] = item
+
+        clusters = [Cluster(longitude / count, latitude / count, count, item)
+                    for (_, (longitude, latitude, count, item)) in sorted(cells.items(), key=lambda c: c[0])]
+        clusters.sort(key=lambda cluster: -cluster.count)
+        return clusters
+
+    def _clusters_numpy(self, partition, spans, shift):
+        (keys, longitudes, latitudes, stars) = partition.get_arrays()
+        selected = []
+        for ((west, south, east, north), box_spans) in spans:
+            positions = numpy.concatenate([numpy.arange(low, high) for (low, high) in box_spans])
+            inside = ((longitudes[positions] >= west) & (longitudes[positions] <= east)
+                      & (latitudes[positions] >= south) & (latitudes[positions] <= north))
+            selected.append(positions[inside])
+        positions = numpy.concatenate(selected)
+        if len(positions) == 0:
+            return []
+
+        (cells, groups, counts) = numpy.unique(keys[positions] >> numpy.uint64(shift),
+                                               return_inverse=True, return_counts=True)
+        sums_longitude = numpy.bincount(groups, weights=longitudes[positions])
+        sums_latitude = numpy.bincount(groups, weights=latitudes[positions])
+        # the first memory of each group, sorted by group then best star (stable: ties keep the key order)
+        order = numpy.lexsort((-stars[positions], groups))
+        firsts = positions[order[numpy.concatenate(([0], numpy.cumsum(counts)[:-1]))]]
+
+        clusters = [Cluster(float(sums_longitude[g] / counts[g]), float(sums_latitude[g] / counts[g]),
+                            int(counts[g]), partition.items[firsts[g]]) for g in range(len(cells))]
+        clusters.sort(key=lambda cluster: -cluster.count)
+        return clusters
+
+    def __len__(self):
+        return sum(len(partition.items) for partition in self._owners.values())
@@ -0,0 +1,78 @@
+# MemoryData and CoordinateData, as defined in app/amplify/backend/api/memories/schema.graphql
+#
+# - owner (partition key) and moment (sort key) identify a memory. The app stores
+#   the moment as MMddHHmmss and the year apart (see app/Model.swift): memories of
+#   the same day in different years share the moment prefix MMdd
+# - to_dict() / from_dict() use the AppSync field names, None for missing optional fields
+# - __slots__: stores and benchmarks hold millions of them
+
+REQUIRED_FIELDS = ('owner', 'moment', 'year', 'image', 'star', 'favourite')
+
+
+class CoordinateData:
+    __slots__ = ('longitude', 'latitude')
+
+    def __init__(self, longitude, latitude):
+        self.longitude = float(longitude)
+        self.latitude = float(latitude)
+
+    def to_dict(self):
+        return {'longitude': self.longitude, 'latitude': self.latitude}
+
+    @classmethod
+    def from_dict(cls, data):
+        return None if data is None else cls(data['longitude'], data['latitude'])
+
+    def __eq__(self, other):
+        return isinstance(other, CoordinateData) and \
+            (self.longitude, self.latitude) == (other.longitude, other.latitude)
+
+    def __repr__(self):
+        return f'CoordinateData({self.longitude}, {self.latitude})'
+
+
+class MemoryData:
+    __slots__ = ('owner', 'moment', 'year', 'description', 'image', 'star', 'favourite', 'coordinates')
+
+    def __init__(self, owner, moment, year, image, star=0, favourite=False, description=None, coordinates=None):
+        self.owner = owner
+        self.moment = moment
+        self.year = year
+        self.description = description
+        self.image = image
+        self.star = star
+        self.favourite = favourite
+        self.coordinates = coordinates
+
+        # the non-null fields of the schema (String!, Int!, Boolean!)
+        missing = [name for name in REQUIRED_FIELDS if getattr(self, name) is None]
+        if missing:
+            raise ValueError(f"MemoryData is missing required fields: {', '.join(missing)}")
+
+    @property
+    def key(self):
+        return (self.owner, self.moment)
+
+    def to_dict(self):
+        return {
+            'owner': self.owner,
+            'moment': self.moment,
+            'year': self.year,
+            'description': self.description,
+            'image': self.image,
+            'star': self.star,
+            'favourite': self.favourite,
+            'coordinates': None if self.coordinates is None else self.coordinates.to_dict()
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get('owner'), data.get('moment'), data.get('year'), data.get('image'),
+                   data.get('star'), data.get('favourite'), data.get('description'),
+                   CoordinateData.from_dict(data.get('coordinates')))
+
+    def __eq__(self, other):
+        return isinstance(other, MemoryData) and all(getattr(self, s) == getattr(other, s) for s in self.__slots__)
+
+    def __repr__(self):
+        return f'MemoryData({self.owner!r}, {self.moment!r}, year={self.year!r})'
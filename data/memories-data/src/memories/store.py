@@ -0,0 +1,322 @@
+# Local stores of MemoryData, with the access patterns of the AppSync API
+#
+# Indexes, each one sorted by moment inside its partitions:
+#
+#   primary           (owner, moment)               listMemoryData
+#   byOwnerYear       (owner, year), then moment
+#   byOwnerFavourite  (owner, favourite), then moment
+#
+# query() paginates like AppSync on DynamoDB:
+# - limit is the number of items read (100 by default) and the filter applies after
+#   it: a page can hold fewer items than the limit, even none, and have a next page
+# - nextToken is returned whenever limit items were read, even when nothing is left
+#   (the next page is then empty), and is None once the end is reached
+# - a nextToken is opaque and only valid for the query that returned it, other
+#   queries reject it with InvalidNextToken
+# - the token holds the last moment read (keyset pagination): each page is a seek,
+#   not an offset, and pages stay consistent while memories are added or deleted
+#
+# MemoryStore keeps everything in memory (sorted lists and bisect), SQLiteStore in a
+# SQLite database (WITHOUT ROWID table, one index per secondary index). Both return
+# the same pages, and accept each other's tokens.
+
+from bisect import bisect_left, bisect_right, insort
+import base64
+import hashlib
+import json
+import sqlite3
+
+from memories.model import CoordinateData, MemoryData
+
+PRIMARY = 'primary'
+BY_OWNER_YEAR = 'byOwnerYear'
+BY_OWNER_FAVOURITE = 'byOwnerFavourite'
+INDEXES = (PRIMARY, BY_OWNER_YEAR, BY_OWNER_FAVOURITE)
+
+# AppSync list queries read 100 items when the client sets no limit
+DEFAULT_LIMIT = 100
+
+# (low, low inclusive, high, high inclusive), None bounds are open
+NO_RANGE = (None, True, None, True)
+
+
+class InvalidNextToken(Exception):
+    pass
+
+
+class Page:
+
+    def __init__(self, items, next_token):
+        self.items = items
+        self.next_token = next_token
+
+    def to_dict(self):
+        # the AppSync response of a list query
+        return {'items': [item.to_dict() for item in self.items], 'nextToken': self.next_token}
+
+
+def key_range(condition):
+    # AppSync key condition on moment ({'beginsWith': '0308'}, {'between': [a, b]}, ...) -> bounds
+    if not condition:
+        return NO_RANGE
+    if len(condition) != 1:
+        raise ValueError(f'A key condition has one operator, got {sorted(condition)}')
+
+    ((operator, value),) = condition.items()
+    if operator == 'eq':
+        return (value, True, value, True)
+    if operator == 'lt':
+        return (None, True, value, False)
+    if operator == 'le':
+        return (None, True, value, True)
+    if operator == 'gt':
+        return (value, False, None, True)
+    if operator == 'ge':
+        return (value, True, None, True)
+    if operator == 'between':
+        (low, high) = value
+        return (low, True, high, True)
+    if operator == 'beginsWith':
+        if not value:
+            return NO_RANGE
+        # the first string after all the ones starting with value
+        return (value, True, value[:-1] + chr(ord(value[-1]) + 1), False)
+    raise ValueError(f'Unknown key condition {operator}')
+
+
+def _fingerprint(owner, index, key, moment, descending):
+    query = json.dumps([owner, index, key, moment, descending], sort_keys=True)
+    return hashlib.sha256(query.encode()).hexdigest()[:16]
+
+
+def encode_token(fingerprint, last_moment):
+    return base64.urlsafe_b64encode(json.dumps([fingerprint, last_moment]).encode()).decode()
+
+
+def decode_token(token, fingerprint):
+    # the last moment read by the previous page of this query
+    try:
+        (token_fingerprint, last_moment) = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except Exception:
+        raise InvalidNextToken('Invalid nextToken')
+    if token_fingerprint != fingerprint:
+        raise InvalidNextToken('Invalid nextToken: it belongs to another query')
+    return last_moment
+
+
+class Store:
+    # query() and its shortcuts, subclasses implement the storage and _scan()
+
+    def query(self, owner, index=PRIMARY, key=None, moment=None, limit=DEFAULT_LIMIT, next_token=None,
+              descending=False, filter=None):
+        # key: year or favourite for the secondary indexes, moment: key condition on moment
+        if index not in INDEXES:
+            raise ValueError(f'Unknown index {index}, expecting one of {", ".join(INDEXES)}')
+        if (index == PRIMARY) != (key is None):
+            raise ValueError(f'The {index} index needs {"no" if index == PRIMARY else "a"} partition key')
+        if limit < 1:
+            raise ValueError('limit must be at least 1')
+
+        fingerprint = _fingerprint(owner, index, key, moment, descending)
+        after = None if next_token is None else decode_token(next_token, fingerprint)
+        items = self._scan(owner, index, key, key_range(moment), after, descending, limit)
+
+        next_token = encode_token(fingerprint, items[-1].moment) if len(items) == limit else None
+        if filter is not None:
+            items = [item for item in items if filter(item)]
+        return Page(items, next_token)
+
+    def pages(self, owner, index=PRIMARY, key=None, **options):
+        # every page of a query, following the next tokens
+        next_token = None
+        while True:
+            page = self.query(owner, index, key, next_token=next_token, **options)
+            yield page
+            next_token = page.next_token
+            if next_token is None:
+                return
+
+    def list_by_owner(self, owner, moment=None, **options):
+        return self.query(owner, PRIMARY, None, moment, **options)
+
+    def list_by_year(self, owner, year, moment=None, **options):
+        return self.query(owner, BY_OWNER_YEAR, year, moment, **options)
+
+    def list_favourites(self, owner, favourite=True, moment=None, **options):
+        return self.query(owner, BY_OWNER_FAVOURITE, favourite, moment, **options)
+
+
+def _bounds(moments, bounds, after, descending):
+    # (start, end) slice of the sorted moments within bounds, after the last moment read
+    (low, low_inclusive, high, high_inclusive) = bounds
+    start = 0 if low is None else (bisect_left if low_inclusive else bisect_right)(moments, low)
+    end = len(moments) if high is None else (bisect_right if high_inclusive else bisect_left)(moments, high)
+    if after is not None:
+        if descending:
+            end = min(end, bisect_left(moments, after))
+        else:
+            start = max(start, bisect_right(moments, after))
+    return (start, end)
+
+
+class MemoryStore(Store):
+
+    def __init__(self):
+        # owner -> {moment: MemoryData}
+        self._items = {}
+        # owner -> {(index, key): sorted moments of this partition}
+        self._moments = {}
+
+    @staticmethod
+    def _partitions(item):
+        return ((PRIMARY, None), (BY_OWNER_YEAR, item.year), (BY_OWNER_FAVOURITE, item.favourite))
+
+    def _unindex(self, item):
+        partitions = self._moments[item.owner]
+        for partition in self._partitions(item):
+            moments = partitions[partition]
+            del moments[bisect_left(moments, item.moment)]
+            if not moments:
+                del partitions[partition]
+
+    def put(self, item):
+        items = self._items.setdefault(item.owner, {})
+        previous = items.get(item.moment)
+        if previous is not None:
+            self._unindex(previous)
+        items[item.moment] = item
+        partitions = self._moments.setdefault(item.owner, {})
+        for partition in self._partitions(item):
+            insort(partitions.setdefault(partition, []), item.moment)
+
+    def put_many(self, items):
+        # bulk load: the partitions of the owners loaded are rebuilt, sorted once
+        owners = set()
+        for item in items:
+            self._items.setdefault(item.owner, {})[item.moment] = item
+            owners.add(item.owner)
+
+        for owner in owners:
+            owner_items = self._items[owner]
+            partitions = self._moments[owner] = {}
+            for moment in sorted(owner_items):
+                for partition in self._partitions(owner_items[moment]):
+                    partitions.setdefault(partition, []).append(moment)
+
+    def get(self, owner, moment):
+        return self._items.get(owner, {}).get(moment)
+
+    def delete(self, owner, moment):
+        # the deleted item, None when there was none
+        item = self._items.get(owner, {}).pop(moment, None)
+        if item is not None:
+            self._unindex(item)
+        return item
+
+    def _scan(self, owner, index, key, bounds, after, descending, limit):
+        moments = self._moments.get(owner, {}).get((index, key))
+        if not moments:
+            return []
+        (start, end) = _bounds(moments, bounds, after, descending)
+        if descending:
+            selected = moments[max(start, end - limit):end][::-1]
+        else:
+            selected = moments[start:min(end, start + limit)]
+        items = self._items[owner]
+        return [items[moment] for moment in selected]
+
+    def __len__(self):
+        return sum(len(items) for items in self._items.values())
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS memory_data (
+    owner TEXT NOT NULL,
+    moment TEXT NOT NULL,
+    year TEXT NOT NULL,
+    description TEXT,
+    image TEXT NOT NULL,
+    star INTEGER NOT NULL,
+    favourite INTEGER NOT NULL,
+    longitude REAL,
+    latitude REAL,
+    PRIMARY KEY (owner, moment)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS by_owner_year ON memory_data (owner, year, moment);
+CREATE INDEX IF NOT EXISTS by_owner_favourite ON memory_data (owner, favourite, moment);
+'''
+
+COLUMNS = 'owner, moment, year, description, image, star, favourite, longitude, latitude'
+
+
+def _row(item):
+    coordinates = item.coordinates
+    return (item.owner, item.moment, item.year, item.description, item.image, item.star, int(item.favourite),
+            None if coordinates is None else coordinates.longitude,
+            None if coordinates is None else coordinates.latitude)
+
+
+def _item(row):
+    (owner, moment, year, description, image, star, favourite, longitude, latitude) = row
+    coordinates = None if longitude is None else CoordinateData(longitude, latitude)
+    return MemoryData(owner, moment, year, image, star, bool(favourite), description, coordinates)
+
+
+class SQLiteStore(Store):
+    # one connection, not shared between threads
+
+    def __init__(self, path=':memory:'):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def put(self, item):
+        with self.connection:
+            self.connection.execute(f'INSERT OR REPLACE INTO memory_data ({COLUMNS}) VALUES (?,?,?,?,?,?,?,?,?)',
+                                    _row(item))
+
+    def put_many(self, items):
+        # one transaction
+        with self.connection:
+            self.connection.executemany(f'INSERT OR REPLACE INTO memory_data ({COLUMNS}) '
+                                        f'VALUES (?,?,?,?,?,?,?,?,?)', (_row(item) for item in items))
+
+    def get(self, owner, moment):
+        row = self.connection.execute(f'SELECT {COLUMNS} FROM memory_data WHERE owner = ? AND moment = ?',
+                                      (owner, moment)).fetchone()
+        return None if row is None else _item(row)
+
+    def delete(self, owner, moment):
+        item = self.get(owner, moment)
+        if item is not None:
+            with self.connection:
+                self.connection.execute('DELETE FROM memory_data WHERE owner = ? AND moment = ?', (owner, moment))
+        return item
+
+    def _scan(self, owner, index, key, bounds, after, descending, limit):
+        clauses = ['owner = ?']
+        parameters = [owner]
+        if index == BY_OWNER_YEAR:
+            clauses.append('year = ?')
+            parameters.append(key)
+        elif index == BY_OWNER_FAVOURITE:
+            clauses.append('favourite = ?')
+            parameters.append(int(key))
+
+        (low, low_inclusive, high, high_inclusive) = bounds
+        if low is not None:
+            clauses.append(f'moment {">=" if low_inclusive else ">"} ?')
+            parameters.append(low)
+        if high is not None:
+            clauses.append(f'moment {"<=" if high_inclusive else "<"} ?')
+            parameters.append(high)
+        if after is not None:
+            clauses.append(f'moment {"<" if descending else ">"} ?')
+            parameters.append(after)
+
+        rows = self.connection.execute(f'SELECT {COLUMNS} FROM memory_data WHERE {" AND ".join(clauses)} '
+                                       f'ORDER BY moment {"DESC" if descending else "ASC"} LIMIT ?',
+                                       parameters + [limit])
+        return [_item(row) for row in rows]
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM memory_data').fetchone()[0]
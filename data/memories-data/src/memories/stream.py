@@ -0,0 +1,109 @@
+# DynamoDB stream records of the MemoryData table, and a local stand-in for the stream
+#
+# - the table stream is NEW_AND_OLD_IMAGES: INSERT records carry NewImage, REMOVE
+#   records OldImage, MODIFY records both. Images use the low level attribute
+#   value format ({'S': ...}, {'N': ...}, {'BOOL': ...}, {'M': ...}, {'NULL': True})
+# - from_image() / to_image() convert between images and MemoryData
+# - LocalStream wraps a store: each put or delete that changes it emits the record
+#   DynamoDB would, in order, to the subscribed handlers. Records go out one batch
+#   per call, in the shape of the Lambda event ({'Records': [...]})
+
+from memories.model import MemoryData
+from memories.store import MemoryStore
+
+INSERT = 'INSERT'
+MODIFY = 'MODIFY'
+REMOVE = 'REMOVE'
+
+
+def _serialize(value):
+    if value is None:
+        return {'NULL': True}
+    if isinstance(value, bool):
+        return {'BOOL': value}
+    if isinstance(value, (int, float)):
+        return {'N': repr(value)}
+    if isinstance(value, dict):
+        return {'M': {name: _serialize(v) for (name, v) in value.items()}}
+    return {'S': value}
+
+
+def _deserialize(attribute):
+    ((kind, value),) = attribute.items()
+    if kind == 'NULL':
+        return None
+    if kind == 'N':
+        return float(value) if '.' in value or 'e' in value.lower() else int(value)
+    if kind == 'M':
+        return {name: _deserialize(v) for (name, v) in value.items()}
+    return value
+
+
+def to_image(item):
+    # the attributes DynamoDB stores: the null ones are left out
+    return {name: _serialize(value) for (name, value) in item.to_dict().items() if value is not None}
+
+
+def from_image(image):
+    return MemoryData.from_dict({name: _deserialize(value) for (name, value) in image.items()})
+
+
+def keys(record):
+    # (owner, moment) of the item the record is about
+    keys = record['dynamodb']['Keys']
+    return (keys['owner']['S'], keys['moment']['S'])
+
+
+def new_record(event_name, old, new, sequence_number):
+    item = new if old is None else old
+    dynamodb = {
+        'Keys': {'owner': {'S': item.owner}, 'moment': {'S': item.moment}},
+        'SequenceNumber': str(sequence_number),
+        'StreamViewType': 'NEW_AND_OLD_IMAGES'
+    }
+    if new is not None:
+        dynamodb['NewImage'] = to_image(new)
+    if old is not None:
+        dynamodb['OldImage'] = to_image(old)
+    return {'eventName': event_name, 'eventSource': 'aws:dynamodb', 'dynamodb': dynamodb}
+
+
+class LocalStream:
+
+    def __init__(self, store=None):
+        self.store = MemoryStore() if store is None else store
+        self.handlers = []
+        self.sequence_number = 0
+
+    def subscribe(self, handler):
+        # handler(event) is called with {'Records': [...]}, as the Lambda function of the stream
+        self.handlers.append(handler)
+
+    def _emit(self, records):
+        if records:
+            for handler in self.handlers:
+                handler({'Records': records})
+
+    def _record(self, event_name, old, new):
+        self.sequence_number += 1
+        return new_record(event_name, old, new, self.sequence_number)
+
+    def _put(self, item):
+        old = self.store.get(item.owner, item.moment)
+        self.store.put(item)
+        if old is None:
+            return self._record(INSERT, None, item)
+        # DynamoDB emits no record when a put leaves the item unchanged
+        return None if old == item else self._record(MODIFY, old, item)
+
+    def put(self, item):
+        self._emit([record for record in [self._put(item)] if record is not None])
+
+    def put_many(self, items):
+        self._emit([record for record in map(self._put, items) if record is not None])
+
+    def delete(self, owner, moment):
+        old = self.store.delete(owner, moment)
+        if old is not None:
+            self._emit([self._record(REMOVE, old, None)])
+        return old
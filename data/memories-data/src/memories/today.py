@@ -0,0 +1,93 @@
+# The "on this day" feed of TodayView: the memories of a calendar day, all years
+#
+# - materialized per (owner, month-day): the feed of a day is one dict lookup,
+#   whatever the size of the owner's history. Memories are sorted (most recent year
+#   first, then by moment) on the first read after a change, and kept sorted
+# - kept up to date by the records of the table stream (handle()), load() fills it
+#   from the existing memories (the stream only keeps 24 hours of records)
+# - the moment is MMddHHmmss: its first 4 characters are the month-day. The table
+#   is keyed on (owner, moment), so is the feed inside a day: a MODIFY changing the
+#   year of a memory replaces it, as in the table
+# - applying a record is idempotent: INSERT and MODIFY set the new image, REMOVE
+#   drops the keys. Lambda retries a failed batch in order, replaying records
+#   leaves the feed as it was. Only NewImage is read, the stream can be NEW_IMAGE
+
+from datetime import datetime, timezone
+
+from memories.stream import INSERT, MODIFY, REMOVE, from_image, keys
+
+
+def month_day(moment):
+    return moment[:4]
+
+
+def _sort_key(item):
+    # most recent year first, then the moments of the day
+    return (-int(item.year), item.moment)
+
+
+class TodayFeed:
+
+    def __init__(self):
+        # (owner, month-day) -> {moment: MemoryData}
+        self._days = {}
+        # (owner, month-day) -> sorted tuple of the memories, dropped when the day changes
+        self._sorted = {}
+
+    def _add(self, item):
+        day = (item.owner, month_day(item.moment))
+        self._days.setdefault(day, {})[item.moment] = item
+        self._sorted.pop(day, None)
+
+    def _remove(self, owner, moment):
+        day = (owner, month_day(moment))
+        memories = self._days.get(day)
+        if memories is not None and memories.pop(moment, None) is not None:
+            if not memories:
+                del self._days[day]
+            self._sorted.pop(day, None)
+
+    def load(self, items):
+        for item in items:
+            self._add(item)
+
+    def apply(self, record):
+        event_name = record['eventName']
+        if event_name in (INSERT, MODIFY):
+            self._add(from_image(record['dynamodb']['NewImage']))
+        elif event_name == REMOVE:
+            self._remove(*keys(record))
+        else:
+            raise ValueError(f'Unknown stream event {event_name}')
+
+    def handle(self, event):
+        # Lambda handler of the table stream
+        for record in event['Records']:
+            self.apply(record)
+
+    def get(self, owner, day):
+        # the memories of this owner on this month-day (MMdd), all years
+        key = (owner, day)
+        memories = self._sorted.get(key)
+        if memories is None:
+            if key not in self._days:
+                # not cached: any owner and day can be asked for, only the existing ones are kept
+                return ()
+            memories = tuple(sorted(self._days[key].values(), key=_sort_key))
+            self._sorted[key] = memories
+        return memories
+
+    def today(self, owner, now=None):
+        # the app computes moments in UTC
+        now = now or datetime.now(timezone.utc)
+        return self.get(owner, now.strftime('%m%d'))
+
+    def by_year(self, owner, day):
+        # {year: memories}, the groups of TodayView, most recent year first
+        groups = {}
+        for item in self.get(owner, day):
+            groups.setdefault(item.year, []).append(item)
+        return groups
+
+    def __len__(self):
+        return sum(len(memories) for memories in self._days.values())
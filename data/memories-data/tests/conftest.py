@@ -0,0 +1,29 @@
+import pytest
+
+from memories.model import CoordinateData, MemoryData
+from memories.store import MemoryStore, SQLiteStore
+
+
+def memory(owner='alice', moment='0308123456', year='2021', star=3, favourite=False, **fields):
+    return MemoryData(owner, moment, year, fields.pop('image', f'{owner}/{year}{moment}.jpg'), star, favourite,
+                      **fields)
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request):
+    """ An empty store, each test runs against both backends """
+
+    return MemoryStore() if request.param == 'memory' else SQLiteStore()
+
+
+@pytest.fixture()
+def memories(store):
+    """ Three years of memories for alice (the 8th of each month, at 20:00 in 2020, 21:00 in 2021, ...),
+        one for bob """
+
+    items = [memory(moment=f'{month:02d}08{year - 2000}0000', year=str(year), favourite=(month % 4 == 0),
+                    coordinates=CoordinateData(4.35, 50.85))
+             for year in (2020, 2021, 2022) for month in range(1, 13)]
+    items.append(memory(owner='bob'))
+    store.put_many(items)
+    return items
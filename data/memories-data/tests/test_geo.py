@@ -0,0 +1,157 @@
+import random
+
+import pytest
+
+from memories import geo
+from memories.geo import GeoIndex, point_key, tile_x, tile_y
+from memories.model import CoordinateData
+from memories.stream import LocalStream
+from tests.conftest import memory
+
+BRUSSELS = (4.35, 50.85)
+PARIS = (2.35, 48.86)
+TOKYO = (139.69, 35.69)
+AUCKLAND = (174.76, -36.85)
+FIJI = (-179.5, -16.5)
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def clustering(request, monkeypatch):
+    """ Clusters computed with NumPy (whatever the number of memories), then without it """
+
+    if request.param == 'python':
+        monkeypatch.setattr(geo, 'numpy', None)
+    else:
+        monkeypatch.setattr(geo, 'NUMPY_MIN_MEMORIES', 0)
+    return request.param
+
+
+@pytest.fixture()
+def index():
+    """ 100 memories around each city for alice (stars 0 to 4), a few for bob, one without coordinates """
+
+    rng = random.Random(42)
+    items = [memory(moment=f'{city:02d}{n:08d}', star=n % 5,
+                    coordinates=CoordinateData(longitude + rng.uniform(-0.05, 0.05),
+                                               latitude + rng.uniform(-0.05, 0.05)))
+             for (city, (longitude, latitude)) in enumerate([BRUSSELS, PARIS, TOKYO, AUCKLAND, FIJI])
+             for n in range(100)]
+    items.append(memory(owner='bob', coordinates=CoordinateData(*BRUSSELS)))
+    items.append(memory(moment='9999999999'))
+    index = GeoIndex()
+    index.load(items)
+    return index
+
+
+def test_tiles():
+
+    # the tile of Brussels on OpenStreetMap at zoom 10
+    assert (tile_x(BRUSSELS[0], 10), tile_y(BRUSSELS[1], 10)) == (524, 343)
+    # a tile is a prefix of the quadkeys of the points inside
+    assert point_key(*BRUSSELS) >> 2 * (geo.MAX_ZOOM - 10) == geo.quadkey(524, 343)
+    # the poles are clamped to the Mercator limits
+    assert tile_y(90, 2) == 0 and tile_y(-90, 2) == 3
+
+
+def test_query(index):
+
+    assert len(index) == 501
+    found = index.query('alice', (4.0, 50.5, 5.0, 51.0))
+    assert len(found) == 100
+    assert all(m.moment.startswith('00') for m in found)
+
+    # Western Europe
+    assert len(index.query('alice', (-5.0, 42.0, 8.0, 51.5))) == 200
+    assert len(index.query('bob', (-5.0, 42.0, 8.0, 51.5))) == 1
+    assert index.query('carol', (-180, -90, 180, 90)) == []
+
+
+def test_query_matches_a_scan(index):
+
+    rng = random.Random(7)
+    everything = index.query('alice', (-180, -90, 180, 90))
+    assert len(everything) == 500
+
+    for _ in range(50):
+        (west, east) = sorted(rng.uniform(-180, 180) for _ in range(2))
+        (south, north) = sorted(rng.uniform(-60, 60) for _ in range(2))
+        expected = {m.moment for m in everything if geo._inside(m.coordinates, (west, south, east, north))}
+        assert {m.moment for m in index.query('alice', (west, south, east, north))} == expected
+
+
+def test_query_across_the_antimeridian(index):
+
+    # from Auckland to Fiji, over the date line
+    found = index.query('alice', (170.0, -40.0, -170.0, -10.0))
+
+    assert len(found) == 200
+    assert {m.moment[:2] for m in found} == {'03', '04'}
+
+
+def test_put_and_delete(index):
+
+    index.put(memory(moment='0000000001', coordinates=CoordinateData(*TOKYO)))
+    assert len(index.query('alice', (4.0, 50.5, 5.0, 51.0))) == 99
+    assert len(index.query('alice', (139.0, 35.0, 140.0, 36.0))) == 101
+
+    index.put(memory(moment='0000000001'))
+    index.delete('alice', '0000000002')
+    index.delete('alice', 'unknown')
+    assert len(index.query('alice', (139.0, 35.0, 140.0, 36.0))) == 100
+    assert len(index) == 499
+
+
+def test_clusters(index, clustering):
+
+    world = index.clusters('alice', (-180, -85, 180, 85), zoom=1)
+
+    # one pin per city, Brussels and Paris together at this zoom
+    assert [c.count for c in world] == [200, 100, 100, 100]
+    assert sum(c.count for c in world) == 500
+    europe = world[0]
+    assert europe.longitude == pytest.approx((BRUSSELS[0] + PARIS[0]) / 2, abs=0.01)
+    assert europe.latitude == pytest.approx((BRUSSELS[1] + PARIS[1]) / 2, abs=0.01)
+    assert europe.memory.star == 4
+
+    # closer, Brussels and Paris apart
+    assert [c.count for c in index.clusters('alice', (-5.0, 42.0, 8.0, 51.5), zoom=5)] == [100, 100]
+
+    # a street: the memories around Brussels spread over cells
+    street = index.clusters('alice', (4.3, 50.8, 4.4, 50.9), zoom=16)
+    assert len(street) > 10
+    assert sum(c.count for c in street) == len(index.query('alice', (4.3, 50.8, 4.4, 50.9)))
+
+    assert index.clusters('alice', (10.0, 10.0, 11.0, 11.0), zoom=8) == []
+    assert index.clusters('carol', (-180, -85, 180, 85), zoom=1) == []
+
+
+def test_clusters_without_numpy_are_the_same(index, monkeypatch):
+
+    monkeypatch.setattr(geo, 'NUMPY_MIN_MEMORIES', 0)
+    box = (-180, -85, 180, 85)
+    for zoom in (0, 3, 8, 14, 30):
+        with_numpy = index.clusters('alice', box, zoom)
+        with monkeypatch.context() as m:
+            m.setattr(geo, 'numpy', None)
+            without = index.clusters('alice', box, zoom)
+        assert [(c.count, c.memory.moment) for c in with_numpy] == [(c.count, c.memory.moment) for c in without]
+        assert [c.longitude for c in with_numpy] == pytest.approx([c.longitude for c in without])
+
+
+def test_index_follows_the_stream(clustering):
+
+    stream = LocalStream()
+    index = GeoIndex()
+    stream.subscribe(index.handle)
+
+    stream.put(memory(coordinates=CoordinateData(*BRUSSELS)))
+    stream.put(memory(moment='0309000000', coordinates=CoordinateData(*PARIS)))
+    assert [c.count for c in index.clusters('alice', (-180, -85, 180, 85), zoom=0)] == [2]
+
+    # moved to Tokyo, then its coordinates removed
+    stream.put(memory(coordinates=CoordinateData(*TOKYO)))
+    assert len(index.clusters('alice', (-180, -85, 180, 85), zoom=2)) == 2
+    stream.put(memory())
+    stream.delete('alice', '0309000000')
+    assert index.clusters('alice', (-180, -85, 180, 85), zoom=0) == []
+    assert len(index) == 0
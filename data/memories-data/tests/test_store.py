@@ -0,0 +1,162 @@
+import pytest
+
+from memories.model import CoordinateData, MemoryData
+from memories.store import BY_OWNER_YEAR, InvalidNextToken, MemoryStore, SQLiteStore, key_range
+from tests.conftest import memory
+
+
+def test_required_fields():
+
+    with pytest.raises(ValueError) as e:
+        MemoryData('alice', '0308123456', None, None)
+    assert 'year, image' in str(e.value)
+
+
+def test_to_dict_round_trip():
+
+    item = memory(description='Brussels', coordinates=CoordinateData(4.35, 50.85))
+    assert MemoryData.from_dict(item.to_dict()) == item
+    assert item.to_dict()['coordinates'] == {'longitude': 4.35, 'latitude': 50.85}
+
+
+def test_put_get_delete(store):
+
+    item = memory()
+    store.put(item)
+    assert store.get('alice', '0308123456') == item
+    assert store.get('bob', '0308123456') is None
+
+    # same key, replaced
+    store.put(memory(star=5))
+    assert store.get('alice', '0308123456').star == 5
+    assert len(store) == 1
+
+    assert store.delete('alice', '0308123456').star == 5
+    assert store.delete('alice', '0308123456') is None
+    assert store.list_by_owner('alice').items == []
+
+
+def test_list_by_owner(store, memories):
+
+    page = store.list_by_owner('alice')
+
+    # 36 memories, sorted by moment: the three Januaries first
+    assert len(page.items) == 36
+    assert [m.moment for m in page.items[:3]] == ['0108200000', '0108210000', '0108220000']
+    assert page.next_token is None
+
+
+def test_pagination(store, memories):
+
+    pages = list(store.pages('alice', limit=10))
+
+    assert [len(p.items) for p in pages] == [10, 10, 10, 6]
+    assert [m.key for p in pages for m in p.items] == [m.key for m in store.list_by_owner('alice').items]
+
+
+def test_exact_last_page_has_a_token(store, memories):
+
+    # DynamoDB does not know the partition is over: an empty page follows
+    pages = list(store.pages('alice', limit=3, moment={'beginsWith': '01'}))
+    assert [len(p.items) for p in pages] == [3, 0]
+
+
+def test_filter_after_limit(store, memories):
+
+    page = store.list_by_owner('alice', limit=10, filter=lambda m: m.year == '2022')
+
+    # 10 items read, only the 2022 ones returned
+    assert len(page.items) < 10
+    assert page.next_token is not None
+    assert all(m.year == '2022' for m in page.items)
+
+
+def test_descending(store, memories):
+
+    pages = list(store.pages('alice', limit=7, descending=True))
+    moments = [m.moment for p in pages for m in p.items]
+
+    assert moments == sorted(moments, reverse=True)
+    assert len(moments) == 36
+
+
+@pytest.mark.parametrize('condition,count', [
+    ({'beginsWith': '03'}, 3),
+    ({'eq': '0308210000'}, 1),
+    ({'between': ['0308210000', '0608200000']}, 9),
+    ({'lt': '0108220000'}, 2),
+    ({'le': '0108220000'}, 3),
+    ({'gt': '1208210000'}, 1),
+    ({'ge': '1208210000'}, 2),
+])
+def test_key_conditions(store, memories, condition, count):
+
+    assert len(store.list_by_owner('alice', moment=condition).items) == count
+
+
+def test_secondary_indexes(store, memories):
+
+    by_year = store.list_by_year('alice', '2021', limit=5)
+    assert [m.year for m in by_year.items] == ['2021'] * 5
+    assert [m.moment for m in by_year.items] == sorted(m.moment for m in by_year.items)
+
+    rest = store.list_by_year('alice', '2021', limit=5, next_token=by_year.next_token)
+    assert rest.items[0].moment == '0608210000'
+
+    favourites = store.list_favourites('alice')
+    assert len(favourites.items) == 9
+    assert all(m.favourite for m in favourites.items)
+
+
+def test_secondary_indexes_follow_updates(store, memories):
+
+    store.put(memory(moment='0108210000', year='2021', favourite=True))
+    store.put(memory(moment='0108210000', year='2021', favourite=False))
+    store.delete('alice', '0408210000')
+
+    assert len(store.list_favourites('alice').items) == 8
+    assert len(store.list_by_year('alice', '2021').items) == 11
+
+
+def test_token_belongs_to_its_query(store, memories):
+
+    page = store.list_by_owner('alice', limit=5)
+
+    with pytest.raises(InvalidNextToken):
+        store.list_by_owner('bob', limit=5, next_token=page.next_token)
+    with pytest.raises(InvalidNextToken):
+        store.query('alice', BY_OWNER_YEAR, '2021', limit=5, next_token=page.next_token)
+    with pytest.raises(InvalidNextToken):
+        store.list_by_owner('alice', next_token='not a token')
+
+
+def test_tokens_are_portable(memories):
+
+    (in_memory, sqlite) = (MemoryStore(), SQLiteStore())
+    in_memory.put_many(memories)
+    sqlite.put_many(memories)
+
+    first = in_memory.list_by_owner('alice', limit=10)
+    assert sqlite.list_by_owner('alice', limit=10, next_token=first.next_token).items == \
+        in_memory.list_by_owner('alice', limit=10, next_token=first.next_token).items
+
+
+def test_pages_stay_consistent_while_writing(store, memories):
+
+    first = store.list_by_owner('alice', limit=10)
+    # added before the position of the token, never seen; after it, seen once
+    store.put(memory(moment='0101000000', year='2023'))
+    store.put(memory(moment='1231000000', year='2023'))
+
+    rest = store.list_by_owner('alice', limit=100, next_token=first.next_token)
+
+    assert '0101000000' not in [m.moment for m in rest.items]
+    assert rest.items[-1].moment == '1231000000'
+    assert len(rest.items) == 27
+
+
+def test_key_range():
+
+    assert key_range({'beginsWith': '03'}) == ('03', True, '04', False)
+    with pytest.raises(ValueError):
+        key_range({'eq': 'a', 'lt': 'b'})
@@ -0,0 +1,112 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from memories.model import CoordinateData
+from memories.stream import LocalStream, from_image, to_image
+from memories.today import TodayFeed
+from tests.conftest import memory
+
+
+@pytest.fixture()
+def stream(store):
+    """ A stream over an empty store, a feed subscribed to it """
+
+    stream = LocalStream(store)
+    stream.feed = TodayFeed()
+    stream.subscribe(stream.feed.handle)
+    return stream
+
+
+def test_image_round_trip():
+
+    item = memory(description=None, coordinates=CoordinateData(4, 50.85))
+    image = to_image(item)
+
+    assert 'description' not in image
+    assert image['favourite'] == {'BOOL': False}
+    assert image['star'] == {'N': '3'}
+    assert from_image(image) == item
+
+
+def test_feed_follows_the_stream(stream):
+
+    stream.put_many([memory(moment='0308120000', year='2019'), memory(moment='0308090000', year='2021'),
+                     memory(moment='0308180000', year='2021'), memory(moment='0309120000', year='2021'),
+                     memory(owner='bob', moment='0308100000')])
+
+    # most recent year first, then by moment
+    assert [(m.year, m.moment) for m in stream.feed.get('alice', '0308')] == \
+        [('2021', '0308090000'), ('2021', '0308180000'), ('2019', '0308120000')]
+    assert list(stream.feed.by_year('alice', '0308')) == ['2021', '2019']
+    assert stream.feed.get('carol', '0308') == ()
+
+    stream.put(memory(moment='0308090000', year='2021', star=5))
+    assert stream.feed.get('alice', '0308')[0].star == 5
+
+    stream.delete('alice', '0308180000')
+    stream.delete('alice', '0309120000')
+    assert [m.moment for m in stream.feed.get('alice', '0308')] == ['0308090000', '0308120000']
+    assert stream.feed.get('alice', '0309') == ()
+    assert len(stream.feed) == 3
+
+
+def test_modify_changes_the_year(stream):
+
+    # same moment in another year: the table replaces the memory, so does the feed
+    stream.put(memory(year='2019'))
+    stream.put(memory(year='2022'))
+
+    assert [m.year for m in stream.feed.get('alice', '0308')] == ['2022']
+
+
+def test_replayed_records(stream):
+
+    records = []
+    stream.subscribe(lambda event: records.extend(event['Records']))
+    stream.put(memory())
+    stream.put(memory(star=5))
+    stream.delete('alice', '0308123456')
+    stream.put(memory(moment='0308200000'))
+
+    assert [r['eventName'] for r in records] == ['INSERT', 'MODIFY', 'REMOVE', 'INSERT']
+    # unchanged items emit no record
+    stream.put(memory(moment='0308200000'))
+    assert len(records) == 4
+
+    # Lambda retries the whole batch
+    stream.feed.handle({'Records': records})
+    assert [m.moment for m in stream.feed.get('alice', '0308')] == ['0308200000']
+
+
+def test_load_matches_the_store(store, memories):
+
+    feed = TodayFeed()
+    feed.load(memories)
+
+    for day in ('0108', '0308', '1208'):
+        expected = store.list_by_owner('alice', moment={'beginsWith': day}).items
+        assert sorted(m.key for m in feed.get('alice', day)) == sorted(m.key for m in expected)
+    assert len(feed) == len(store)
+
+
+def test_today():
+
+    feed = TodayFeed()
+    feed.load([memory(moment='1231235959')])
+
+    assert len(feed.today('alice', datetime(2023, 12, 31, 23, 59, tzinfo=timezone.utc))) == 1
+    assert feed.today('alice', datetime(2024, 1, 1, tzinfo=timezone.utc)) == ()
+
+
+def test_empty_days_are_not_cached():
+
+    feed = TodayFeed()
+    feed.load([memory(moment='1231235959')])
+
+    for day in range(1, 32):
+        assert feed.get('mallory', f'01{day:02}') == ()
+    assert feed.get('alice', '0101') == ()
+
+    feed.get('alice', '1231')
+    assert list(feed._sorted) == [('alice', '1231')]